@@ -0,0 +1,203 @@
+# artifacts.py
+"""
+Artifact discovery for a run directory.
+
+One os.scandir pass collects every file a run left behind (name, size,
+mtime). Image-like files additionally get a sha256, their MIME type and
+pixel dimensions, and are exposed to clients subject to:
+
+  - MAX_IMAGE_COUNT  images returned per run (sorted by path)
+  - MAX_IMAGE_BYTES  largest image file returned
+
+Everything is written to <run_dir>/manifest.json, which is served with the
+run's files; its presence also marks a run as finished (file caching,
+retention). Files the sandbox itself writes (logs, result.json, the
+manifest) are not artifacts.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import struct
+import hashlib
+import mimetypes
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# What we consider "images" to auto-expose (viewer will handle non-images too)
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".bmp", ".tiff", ".tif", ".pdf"}
+
+MAX_IMAGE_COUNT = int(os.getenv("MAX_IMAGE_COUNT", "8"))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+
+MANIFEST_FILE = "manifest.json"
+# Bookkeeping files written by the sandbox, never reported as artifacts
+_INTERNAL_NAMES = {MANIFEST_FILE, "result.json", ".pinned", ".sandbox_timings.json", ".sandbox_profile.json"}
+_INTERNAL_SUFFIXES = (".log",)
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def guess_mime(path: Path) -> str:
+    ctype, _ = mimetypes.guess_type(path.as_posix())
+    return ctype or "application/octet-stream"
+
+
+def _is_internal(rel: str) -> bool:
+    # Only top-level bookkeeping files; user files in subfolders are left alone
+    if "/" in rel:
+        return False
+    return (
+        rel in _INTERNAL_NAMES
+        or rel.endswith(_INTERNAL_SUFFIXES)
+        or rel.startswith(".manifest-")
+        or (rel.startswith("manifest_") and rel.endswith(".json"))  # per-call session manifests
+    )
+
+
+def scan(run_dir: Path) -> List[Tuple[str, str, int, float]]:
+    """
+    Single scandir walk of run_dir.
+    Returns (relpath, abspath, size, mtime) for each regular file, sorted by relpath.
+    """
+    out: List[Tuple[str, str, int, float]] = []
+    stack: List[Tuple[str, str]] = [(str(run_dir), "")]
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            it = os.scandir(path)
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                rel = prefix + e.name
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append((e.path, rel + "/"))
+                    elif e.is_file(follow_symlinks=False) and not _is_internal(rel):
+                        st = e.stat(follow_symlinks=False)
+                        out.append((rel, e.path, st.st_size, st.st_mtime))
+                except OSError:
+                    continue
+    out.sort()
+    return out
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _dimensions_from_header(path: str) -> Optional[Tuple[int, int]]:
+    """Width/height from PNG, GIF, BMP or JPEG headers (no third-party imports)."""
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+        if head[:2] == b"BM" and len(head) >= 26:
+            w, h = struct.unpack("<ii", head[18:26])
+            return w, abs(h)
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                seg_len = struct.unpack(">H", f.read(2))[0]
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    h, w = struct.unpack(">HH", f.read(5)[1:5])
+                    return w, h
+                f.seek(seg_len - 2, 1)
+    return None
+
+
+def image_dimensions(path: str) -> Optional[Tuple[int, int]]:
+    """(width, height) of a raster image, or None if unknown (SVG, PDF, corrupt files)."""
+    try:
+        from PIL import Image  # optional; only reads the header
+    except Exception:
+        Image = None
+    try:
+        if Image is not None:
+            with Image.open(path) as im:
+                return im.size
+        return _dimensions_from_header(path)
+    except Exception:
+        return None
+
+
+def build_manifest(
+    run_dir: Path,
+    root: Path,
+    since: Optional[float] = None,
+    manifest_name: str = MANIFEST_FILE,
+) -> Dict[str, object]:
+    """
+    Scan run_dir once, write <run_dir>/<manifest_name> and return the manifest:
+      {
+        "run_id": str, "created": float,
+        "files":   [ { "path", "size", "content_type" }, ... ],          # relative to run_dir
+        "images":  [ { "filename", "content_type", "size", "sha256", "width"?, "height"? }, ... ],
+        "skipped": [ { "filename", "size", "note" }, ... ]               # over MAX_IMAGE_* limits
+      }
+    Image filenames are relative to 'root' (TEMP_DIR) so /files/<filename> works.
+    With 'since', only files modified at or after that time are considered.
+    """
+    files: List[Dict[str, object]] = []
+    images: List[Dict[str, object]] = []
+    skipped: List[Dict[str, object]] = []
+    run_prefix = run_dir.relative_to(root).as_posix()
+
+    for rel, path, size, mtime in scan(run_dir):
+        if since is not None and mtime < since:
+            continue
+        ctype = guess_mime(Path(rel))
+        files.append({"path": rel, "size": size, "content_type": ctype})
+        if Path(rel).suffix.lower() not in IMAGE_EXTS:
+            continue
+        filename = f"{run_prefix}/{rel}"
+        if size > MAX_IMAGE_BYTES:
+            skipped.append({"filename": filename, "size": size,
+                            "note": f"exceeds MAX_IMAGE_BYTES ({MAX_IMAGE_BYTES})"})
+            continue
+        if len(images) >= MAX_IMAGE_COUNT:
+            skipped.append({"filename": filename, "size": size,
+                            "note": f"exceeds MAX_IMAGE_COUNT ({MAX_IMAGE_COUNT})"})
+            continue
+        rec: Dict[str, object] = {"filename": filename, "content_type": ctype, "size": size}
+        try:
+            rec["sha256"] = _sha256(path)
+        except OSError:
+            continue
+        dims = image_dimensions(path)
+        if dims:
+            rec["width"], rec["height"] = int(dims[0]), int(dims[1])
+        images.append(rec)
+
+    manifest = {
+        "run_id": run_dir.name,
+        "created": time.time(),
+        "files": files,
+        "images": images,
+        "skipped": skipped,
+    }
+    # Write-and-rename: the old manifest may be a hard link into the result cache
+    tmp = run_dir / f".manifest-{os.getpid()}-{time.monotonic_ns()}"
+    try:
+        tmp.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmp, run_dir / manifest_name)
+    except OSError:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+    return manifest
+
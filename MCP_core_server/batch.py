@@ -0,0 +1,100 @@
+# batch.py
+"""
+Batch execution: many independent snippets in one request.
+
+Items run on a small thread pool (one sandbox subprocess per item, each in
+its own run directory from _new_run_dir) and every item still goes through
+the shared scheduler, so a batch never takes more than MAX_CONCURRENT_RUNS
+slots and competes fairly with /execute. Results come back either all at
+once in input order (run_batch) or one by one as items finish
+(iter_batch, used for NDJSON streaming).
+"""
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import metrics
+from sandbox_core import _new_run_dir, execute_python
+from scheduler import SCHEDULER, QueueFull
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+# Default degree of parallelism; a request may ask for less (or more, up to MAX_CONCURRENT_RUNS)
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", str(SCHEDULER.max_concurrent)))
+
+
+def parallelism_for(requested: Optional[int], n_items: int) -> int:
+    p = requested if requested and requested > 0 else BATCH_PARALLELISM
+    return max(1, min(p, SCHEDULER.max_concurrent, n_items))
+
+
+def _run_item(index: int, item: Dict[str, object], use_cache: bool, cancel: threading.Event) -> Dict[str, object]:
+    out: Dict[str, object] = {"index": index}
+    if item.get("id") is not None:
+        out["id"] = item["id"]
+    if cancel.is_set():
+        return {**out, "stdout": "", "stderr": "[cancelled] Batch was cancelled", "returncode": 130, "images": []}
+    try:
+        with SCHEDULER.slot():
+            result = execute_python(
+                str(item["code"]),
+                run_dir=_new_run_dir(),
+                cancel=cancel,
+                use_cache=use_cache,
+                timeout=item.get("timeout"),  # type: ignore[arg-type]
+            )
+    except QueueFull as e:
+        return {**out, "stdout": "", "stderr": f"[queue] {e}", "returncode": -1, "images": [],
+                "retry_after": e.retry_after}
+    except Exception as e:
+        metrics.RUNNER_ERRORS.inc()
+        return {**out, "stdout": "", "stderr": f"[runner error] {e}", "returncode": 1, "images": []}
+    return {**out, **result}
+
+
+def iter_batch(
+    items: List[Dict[str, object]],
+    parallelism: Optional[int] = None,
+    use_cache: bool = True,
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[Dict[str, object]]:
+    """
+    Yield one result per item as it finishes (each tagged with its "index" and "id").
+    Closing the iterator cancels items that are still queued or running.
+    """
+    cancel = cancel or threading.Event()
+    workers = parallelism_for(parallelism, len(items))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    try:
+        futures = [pool.submit(_run_item, i, item, use_cache, cancel) for i, item in enumerate(items)]
+        for fut in as_completed(futures):
+            yield fut.result()
+    finally:
+        cancel.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_batch(
+    items: List[Dict[str, object]],
+    parallelism: Optional[int] = None,
+    use_cache: bool = True,
+) -> Tuple[List[Dict[str, object]], Dict[str, object]]:
+    """Run all items and return (results in input order, summary)."""
+    results: List[Optional[Dict[str, object]]] = [None] * len(items)
+    for res in iter_batch(items, parallelism=parallelism, use_cache=use_cache):
+        results[int(res["index"])] = res
+    done = [r for r in results if r is not None]
+    return done, summarize(done, parallelism_for(parallelism, len(items)))
+
+
+def summarize(results: List[Dict[str, object]], parallelism: int) -> Dict[str, object]:
+    rcs = [int(r.get("returncode", 1)) for r in results]
+    return {
+        "items": len(results),
+        "parallelism": parallelism,
+        "ok": sum(1 for rc in rcs if rc == 0),
+        "failed": sum(1 for rc in rcs if rc not in (0, 124)),
+        "timeouts": sum(1 for rc in rcs if rc == 124),
+    }
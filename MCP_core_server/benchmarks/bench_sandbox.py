@@ -0,0 +1,276 @@
+# bench_sandbox.py
+"""
+Benchmarks for the sandbox execution path.
+
+Runs a fixed set of snippets either in-process through sandbox_core.execute_python
+("direct") or against a running server's POST /execute ("http"), and reports
+latency percentiles (p50/p95/p99), throughput and the median server-side phase
+timings (result["timings"]) per case. Results are written as JSON so two runs
+can be compared:
+
+  python benchmarks/bench_sandbox.py --mode direct --repeat 10
+  python benchmarks/bench_sandbox.py --mode http --url http://localhost:8000 --clients 1,4,8
+  python benchmarks/bench_sandbox.py --compare results/before.json results/after.json
+
+Direct mode honours the same environment as the server (SANDBOX_TEMP_DIR,
+WARM_POOL_SIZE, RUN_LIMIT_*, ...). The result cache is always bypassed.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+CASES: Dict[str, str] = {
+    "trivial": "print('ok')\n",
+    "heavy_import": (
+        "import pandas as pd\n"
+        "import matplotlib.pyplot as plt\n"
+        "import xgboost\n"
+        "print(pd.__version__, xgboost.__version__)\n"
+    ),
+    "figure": (
+        "import numpy as np\n"
+        "import matplotlib.pyplot as plt\n"
+        "x = np.linspace(0, 10, 2000)\n"
+        "for k in range(3):\n"
+        "    plt.figure()\n"
+        "    plt.plot(x, np.sin(x * (k + 1)))\n"
+        "plt.savefig('explicit.png')\n"
+    ),
+    "large_stdout": (
+        "import sys\n"
+        "line = 'x' * 99 + '\\n'\n"
+        "for _ in range(50_000):\n"   # ~5 MB
+        "    sys.stdout.write(line)\n"
+    ),
+    "many_artifacts": (
+        "import os\n"
+        "os.makedirs('out', exist_ok=True)\n"
+        "for i in range(500):\n"
+        "    with open(f'out/part_{i:04d}.csv', 'w') as f:\n"
+        "        f.write('a,b\\n' + '\\n'.join(f'{j},{j * j}' for j in range(50)))\n"
+    ),
+}
+CONCURRENCY_CASE = "trivial"
+
+# One call -> the result dict; raises on transport errors
+Runner = Callable[[str], Dict[str, object]]
+
+
+def _direct_runner(ready_timeout: float = 120.0) -> Runner:
+    import sandbox_core
+    import warm_pool
+
+    # Measure the steady state: let every warm worker finish its preload first
+    pool = warm_pool.get_pool()
+    deadline = time.monotonic() + ready_timeout
+    while pool is not None and pool.stats()["idle"] < pool.size and time.monotonic() < deadline:
+        time.sleep(0.2)
+
+    def run(code: str) -> Dict[str, object]:
+        return sandbox_core.execute_python(code, use_cache=False)
+    return run
+
+
+def _http_runner(url: str, timeout: float) -> Runner:
+    endpoint = url.rstrip("/") + "/execute"
+
+    def run(code: str) -> Dict[str, object]:
+        body = json.dumps({"code": code, "no_cache": True}).encode("utf-8")
+        req = urllib.request.Request(endpoint, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    return run
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Linear interpolation between closest ranks (numpy's default)."""
+    if not values:
+        return None
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def _summarize(latencies_ms: List[float], errors: List[str], wall_s: float,
+               timings: List[Dict[str, float]]) -> Dict[str, object]:
+    n = len(latencies_ms)
+    out: Dict[str, object] = {
+        "n": n,
+        "errors": len(errors),
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(n / wall_s, 3) if wall_s > 0 else None,
+    }
+    if n:
+        out.update({
+            "min_ms": round(min(latencies_ms), 1),
+            "mean_ms": round(sum(latencies_ms) / n, 1),
+            "p50_ms": round(percentile(latencies_ms, 50), 1),
+            "p95_ms": round(percentile(latencies_ms, 95), 1),
+            "p99_ms": round(percentile(latencies_ms, 99), 1),
+            "max_ms": round(max(latencies_ms), 1),
+        })
+    if errors:
+        out["first_error"] = errors[0][-500:]
+    phases = sorted({k for t in timings for k in t})
+    if phases:
+        out["server_timings_p50_ms"] = {
+            k: round(percentile([t[k] for t in timings if k in t], 50), 1) for k in phases
+        }
+    return out
+
+
+def run_case(runner: Runner, code: str, repeat: int, clients: int = 1) -> Dict[str, object]:
+    """Run 'code' repeat * clients times from 'clients' threads; each thread runs sequentially."""
+    latencies: List[float] = []
+    timings: List[Dict[str, float]] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def client() -> None:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            try:
+                result = runner(code)
+                ok = result.get("returncode") == 0
+                error = f"rc={result.get('returncode')}: {result.get('stderr', '')}"
+            except Exception as e:
+                result, ok, error = {}, False, f"{type(e).__name__}: {e}"
+            dt = (time.perf_counter() - t0) * 1000.0
+            with lock:
+                if ok:
+                    latencies.append(dt)
+                    if isinstance(result.get("timings"), dict):
+                        timings.append(result["timings"])  # type: ignore[arg-type]
+                else:
+                    errors.append(error.strip())
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for f in [pool.submit(client) for _ in range(clients)]:
+            f.result()
+    return _summarize(latencies, errors, time.perf_counter() - t0, timings)
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _environment(args: argparse.Namespace) -> Dict[str, object]:
+    knobs = ("WARM_POOL_SIZE", "MAX_CONCURRENT_RUNS", "EXEC_TIMEOUT_SECONDS", "AUTO_SAVE_MPL",
+             "RUN_LIMIT_AS_MB", "RUN_LIMIT_CPU_SECONDS", "MAX_OUTPUT_HEAD_BYTES")
+    return {
+        "mode": args.mode,
+        "url": args.url if args.mode == "http" else None,
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "env": {k: os.environ[k] for k in knobs if k in os.environ},
+    }
+
+
+def run_suite(args: argparse.Namespace) -> Dict[str, object]:
+    runner = _direct_runner() if args.mode == "direct" else _http_runner(args.url, args.timeout)
+    names = [c for c in args.cases.split(",") if c] if args.cases else list(CASES)
+    unknown = [c for c in names if c not in CASES]
+    if unknown:
+        raise SystemExit(f"unknown case(s): {', '.join(unknown)}; choose from {', '.join(CASES)}")
+
+    report: Dict[str, object] = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": _environment(args),
+        "repeat": args.repeat,
+        "cases": {},
+        "concurrency": {},
+    }
+    for name in names:
+        for _ in range(args.warmup):
+            try:
+                runner(CASES[name])
+            except Exception:
+                pass
+        stats = run_case(runner, CASES[name], args.repeat)
+        report["cases"][name] = stats  # type: ignore[index]
+        _print_row(name, stats)
+
+    for clients in [int(c) for c in args.clients.split(",") if c]:
+        stats = run_case(runner, CASES[CONCURRENCY_CASE], args.repeat, clients=clients)
+        stats["clients"] = clients
+        report["concurrency"][str(clients)] = stats  # type: ignore[index]
+        _print_row(f"{CONCURRENCY_CASE} x{clients}", stats)
+    return report
+
+
+def _print_row(label: str, s: Dict[str, object]) -> None:
+    if not s.get("n"):
+        print(f"{label:<22} all {s['errors']} runs failed: {str(s.get('first_error', '')).splitlines()[-1:]}")
+        return
+    print(f"{label:<22} n={s['n']:<4} err={s['errors']:<3} p50={s['p50_ms']:>9.1f} p95={s['p95_ms']:>9.1f} "
+          f"p99={s['p99_ms']:>9.1f} ms  {s['throughput_rps']:>7.2f} req/s")
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """Print p50/p95/throughput changes between two result files."""
+    before = json.loads(Path(before_path).read_text(encoding="utf-8"))
+    after = json.loads(Path(after_path).read_text(encoding="utf-8"))
+    print(f"{'case':<22} {'p50 ms':>21} {'p95 ms':>21} {'req/s':>19}")
+    for section in ("cases", "concurrency"):
+        for key, a in after.get(section, {}).items():
+            b = before.get(section, {}).get(key)
+            label = key if section == "cases" else f"{CONCURRENCY_CASE} x{key}"
+            if not b or not b.get("n") or not a.get("n"):
+                print(f"{label:<22} (missing in one run)")
+                continue
+            cols = []
+            for metric in ("p50_ms", "p95_ms", "throughput_rps"):
+                old, new = float(b[metric]), float(a[metric])
+                change = (new - old) / old * 100.0 if old else 0.0
+                cols.append(f"{old:>8.1f} → {new:>8.1f} ({change:+.0f}%)")
+            print(f"{label:<22} " + "  ".join(cols))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--mode", choices=("direct", "http"), default="direct")
+    ap.add_argument("--url", default=os.getenv("SANDBOX_BASE_URL", "http://localhost:8000"))
+    ap.add_argument("--cases", default="", help=f"comma-separated subset of: {', '.join(CASES)}")
+    ap.add_argument("--repeat", type=int, default=10, help="runs per case (per client for --clients)")
+    ap.add_argument("--warmup", type=int, default=1, help="untimed runs per case before measuring")
+    ap.add_argument("--clients", default="1,2,4,8", help="client counts for the concurrency case ('' to skip)")
+    ap.add_argument("--timeout", type=float, default=600.0, help="HTTP timeout per request (s)")
+    ap.add_argument("--out", default="", help="result file (default: benchmarks/results/bench-<mode>-<time>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files and exit")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run_suite(args)
+    out = Path(args.out) if args.out else HERE / "results" / f"bench-{args.mode}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
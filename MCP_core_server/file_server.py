@@ -0,0 +1,221 @@
+# file_server.py
+"""
+HTTP caching helpers for serving run artifacts (/files and /view).
+
+  - strong ETag from (inode mtime, size); artifacts are written once per run
+  - Cache-Control: immutable for finished runs (manifest.json present),
+    no-cache for runs in progress and for session folders, whose files can
+    be overwritten by a later call
+  - single byte ranges (Range / If-Range)
+  - precompressed gzip (and br, when the 'brotli' module is installed)
+    variants of text artifacts, created on first request and kept under
+    PRECOMPRESS_CACHE_DIR
+"""
+from __future__ import annotations
+
+import os
+import gzip
+import shutil
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from artifacts import MANIFEST_FILE
+
+PRECOMPRESS_CACHE_DIR = Path(os.getenv(
+    "PRECOMPRESS_CACHE_DIR",
+    str(Path(os.getenv("SANDBOX_TEMP_DIR", "/app/temp")).resolve().parent / "cache" / "encoded"),
+)).resolve()
+# Files outside this size window are always sent as-is
+PRECOMPRESS_MIN_BYTES = 1024
+PRECOMPRESS_MAX_BYTES = int(os.getenv("PRECOMPRESS_MAX_BYTES", str(64 * 1024 * 1024)))
+PRECOMPRESS_CACHE_MAX_BYTES = int(os.getenv("PRECOMPRESS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_COMPRESSIBLE_EXTS = {".svg", ".csv", ".tsv", ".html", ".htm", ".txt", ".json", ".xml", ".md", ".log", ".js", ".css"}
+_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+_lock = threading.Lock()
+_stats = {"not_modified": 0, "partial": 0, "encoded": 0, "encodes": 0, "evictions": 0}
+_incompressible: Dict[str, bool] = {}
+_writes_since_trim = 0
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def etag_for(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def last_modified(st: os.stat_result) -> str:
+    return formatdate(st.st_mtime, usegmt=True)
+
+
+def is_finished(rel: str, root: Path) -> bool:
+    """True once the run that owns 'rel' has written its manifest (never for session folders)."""
+    run_id = rel.split("/", 1)[0]
+    if run_id.startswith("session-"):
+        return False
+    return (root / run_id / MANIFEST_FILE).is_file()
+
+
+def cache_control(rel: str, root: Path) -> str:
+    return IMMUTABLE if is_finished(rel, root) else REVALIDATE
+
+
+def not_modified(headers, etag: str, st: os.stat_result) -> bool:
+    """Evaluate If-None-Match (preferred) or If-Modified-Since."""
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        # Encoded variants carry "<etag>-gzip" / "<etag>-br"; they validate the same file
+        tags = [t.strip().replace('-gzip"', '"').replace('-br"', '"') for t in inm.split(",")]
+        hit = "*" in tags or etag in tags or f"W/{etag}" in tags
+    else:
+        ims = headers.get("if-modified-since")
+        if not ims:
+            return False
+        try:
+            hit = int(st.st_mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    if hit:
+        _count("not_modified")
+    return hit
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single 'bytes=' range into inclusive (start, end).
+    Returns None when the header is absent or not something we serve partially
+    (multiple ranges, other units); raises ValueError when it is unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    try:
+        start = int(first) if first else None
+        stop = int(last) if last else None
+    except ValueError:
+        return None
+    if not sep or (start is None and stop is None):
+        return None
+    if start is None:                      # suffix range: the last N bytes
+        if stop == 0:
+            raise ValueError("range not satisfiable")
+        start, end = max(0, size - stop), size - 1
+    else:
+        end = size - 1 if stop is None else min(stop, size - 1)
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    _count("partial")
+    return start, end
+
+
+def iter_file(path: Path, start: int, end: int, chunk: int = 256 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = end - start + 1
+        while left > 0:
+            data = f.read(min(chunk, left))
+            if not data:
+                break
+            left -= len(data)
+            yield data
+
+
+def trim_lru(directory: Path, max_bytes: int) -> int:
+    """Delete least recently used files in 'directory' until it fits max_bytes; returns the count."""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for e in it:
+                if e.is_file() and not e.name.startswith("."):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+    except FileNotFoundError:
+        return 0
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _brotli():
+    try:
+        import brotli  # optional
+        return brotli
+    except Exception:
+        return None
+
+
+def encoded_variant(path: Path, etag: str, accept_encoding: str) -> Optional[Tuple[Path, str]]:
+    """
+    Precompressed copy of a text artifact matching Accept-Encoding, as (file, encoding).
+    Created on first use; None when the file should be sent as-is.
+    """
+    global _writes_since_trim
+    st = path.stat()
+    if path.suffix.lower() not in _COMPRESSIBLE_EXTS or not (PRECOMPRESS_MIN_BYTES <= st.st_size <= PRECOMPRESS_MAX_BYTES):
+        return None
+    accepted = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding not in accepted or (encoding == "br" and _brotli() is None):
+            continue
+        key = hashlib.sha256(f"{path}:{etag}:{encoding}".encode()).hexdigest()
+        out = PRECOMPRESS_CACHE_DIR / f"{key}{_SUFFIX[encoding]}"
+        if key in _incompressible:
+            return None
+        if out.is_file():
+            try:
+                os.utime(out)  # LRU bookkeeping
+            except OSError:
+                pass
+        else:
+            PRECOMPRESS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = PRECOMPRESS_CACHE_DIR / f".tmp-{key}-{threading.get_ident()}"
+            if encoding == "br":
+                tmp.write_bytes(_brotli().compress(path.read_bytes()))
+            else:
+                with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst)
+            if tmp.stat().st_size >= st.st_size:
+                tmp.unlink()  # not worth it: send identity from now on
+                with _lock:
+                    if len(_incompressible) > 4096:
+                        _incompressible.clear()
+                    _incompressible[key] = True
+                return None
+            os.replace(tmp, out)
+            with _lock:
+                _stats["encodes"] += 1
+                _writes_since_trim += 1
+                trim = _writes_since_trim >= 50
+                if trim:
+                    _writes_since_trim = 0
+            if trim:
+                removed = trim_lru(PRECOMPRESS_CACHE_DIR, PRECOMPRESS_CACHE_MAX_BYTES)
+                with _lock:
+                    _stats["evictions"] += removed
+        _count("encoded")
+        return out, encoding
+    return None
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats)
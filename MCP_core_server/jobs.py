@@ -0,0 +1,192 @@
+# jobs.py
+"""
+Asynchronous job API on top of sandbox_core.execute_python.
+
+A job is a normal sandbox run whose run directory is created up front, so its
+id (= run id) can be handed back immediately. The run itself happens on a
+background thread that goes through the shared scheduler. Partial output is
+kept in memory while the job runs (capped at MAX_OUTPUT_HEAD_BYTES characters
+per stream; the full streams are in the run's stdout.log/stderr.log); the final
+result is written to <TEMP_DIR>/<run_id>/result.json, so finished jobs can
+still be fetched after they are evicted from memory or the service restarts.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import metrics
+from sandbox_core import MAX_OUTPUT_HEAD_BYTES, TEMP_DIR, _new_run_dir, execute_python
+from scheduler import SCHEDULER, QueueFull
+
+RESULT_FILE = "result.json"
+
+# Finished jobs stay in memory this long; afterwards they are served from result.json
+JOBS_KEEP_SECONDS = int(os.getenv("JOBS_KEEP_SECONDS", "900"))
+
+
+class Job:
+    def __init__(self, run_dir: Path):
+        self.id = run_dir.name
+        self.run_dir = run_dir
+        self.status = "queued"          # queued | running | done | rejected
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict[str, object]] = None
+        self.error: Optional[str] = None
+        self.retry_after: Optional[int] = None
+        self.cancel_event = threading.Event()
+        self._out: Dict[str, List[str]] = {"stdout": [], "stderr": []}
+        self._out_len = {"stdout": 0, "stderr": 0}
+        self._lock = threading.Lock()
+
+    def on_output(self, stream: str, text: str) -> None:
+        with self._lock:
+            used = self._out_len[stream]
+            if used > MAX_OUTPUT_HEAD_BYTES:
+                return
+            if used + len(text) > MAX_OUTPUT_HEAD_BYTES:
+                text = text[:MAX_OUTPUT_HEAD_BYTES - used] + f"\n...[live {stream} truncated; see {stream}.log]...\n"
+                self._out_len[stream] = MAX_OUTPUT_HEAD_BYTES + 1
+            else:
+                self._out_len[stream] = used + len(text)
+            self._out[stream].append(text)
+
+    def partial(self, stream: str) -> str:
+        with self._lock:
+            parts = self._out[stream]
+            if len(parts) > 1:
+                parts[:] = ["".join(parts)]
+            return parts[0] if parts else ""
+
+    def snapshot(self, stdout_from: int = 0, stderr_from: int = 0) -> Dict[str, object]:
+        """
+        Status plus output. stdout/stderr hold the live output produced so far
+        starting at the given character offsets, so pollers only fetch what's new.
+        The offsets always index the live text, also once the job is done; the
+        final (head + tail bounded) streams are in "result".
+        """
+        out: Dict[str, object] = {
+            "job_id": self.id,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.error:
+            out["error"] = self.error
+        if self.retry_after is not None:
+            out["retry_after"] = self.retry_after
+        if self.result is not None:
+            out["result"] = self.result
+        stdout, stderr = self.partial("stdout"), self.partial("stderr")
+        out["stdout"] = stdout[stdout_from:]
+        out["stderr"] = stderr[stderr_from:]
+        out["stdout_len"] = len(stdout)
+        out["stderr_len"] = len(stderr)
+        return out
+
+
+_JOBS: Dict[str, Job] = {}
+_JOBS_LOCK = threading.Lock()
+
+
+def _prune() -> None:
+    cutoff = time.time() - JOBS_KEEP_SECONDS
+    with _JOBS_LOCK:
+        for jid in [j.id for j in _JOBS.values() if j.finished and j.finished < cutoff]:
+            _JOBS.pop(jid, None)
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _run(job: Job, code: str, use_cache: bool, profile: bool = False, profile_memory: bool = False) -> None:
+    try:
+        with SCHEDULER.slot():
+            if job.cancel_event.is_set():
+                raise _Cancelled()
+            job.status = "running"
+            job.started = time.time()
+            result = execute_python(code, run_dir=job.run_dir, on_output=job.on_output,
+                                    cancel=job.cancel_event, use_cache=use_cache,
+                                    profile=profile, profile_memory=profile_memory)
+    except _Cancelled:
+        result = {"run_id": job.id, "stdout": "", "stderr": "[cancelled] Job was cancelled before it started",
+                  "returncode": 130, "images": []}
+        job.on_output("stderr", result["stderr"])
+    except QueueFull as e:
+        job.status = "rejected"
+        job.error = str(e)
+        job.retry_after = e.retry_after
+        job.finished = time.time()
+        return
+    except Exception as e:
+        metrics.RUNNER_ERRORS.inc()
+        result = {"run_id": job.id, "stdout": "", "stderr": f"[runner error] {e}", "returncode": 1, "images": []}
+        job.on_output("stderr", result["stderr"])
+    try:
+        (job.run_dir / RESULT_FILE).write_text(json.dumps(result), encoding="utf-8")
+    except Exception:
+        pass
+    job.result = result
+    job.finished = time.time()
+    job.status = "done"
+
+
+def submit(code: str, use_cache: bool = True, profile: bool = False, profile_memory: bool = False) -> Job:
+    """Create the run directory, start the job in the background and return at once."""
+    _prune()
+    job = Job(_new_run_dir())
+    with _JOBS_LOCK:
+        _JOBS[job.id] = job
+    threading.Thread(target=_run, args=(job, code, use_cache, profile, profile_memory),
+                     name=f"job-{job.id}", daemon=True).start()
+    return job
+
+
+def cancel(job_id: str) -> bool:
+    """Ask a live job to stop; False if it is unknown or already finished."""
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is None or job.finished is not None:
+        return False
+    job.cancel_event.set()
+    return True
+
+
+def get(job_id: str, stdout_from: int = 0, stderr_from: int = 0) -> Optional[Dict[str, object]]:
+    """Status/partial output for a live job, or the stored result of a finished one."""
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is not None:
+        return job.snapshot(stdout_from, stderr_from)
+
+    # Not in memory: fall back to the run directory (finished earlier / before a restart)
+    run_dir = (TEMP_DIR / job_id).resolve()
+    if run_dir.parent != TEMP_DIR or not run_dir.is_dir():
+        return None
+    result_file = run_dir / RESULT_FILE
+    if not result_file.is_file():
+        return {"job_id": job_id, "status": "unknown"}
+    try:
+        result = json.loads(result_file.read_text(encoding="utf-8"))
+    except Exception:
+        return {"job_id": job_id, "status": "unknown"}
+    # The live output went with the in-memory job: nothing new past the caller's
+    # offsets (which index the live text, not result["stdout"]); read "result".
+    return {
+        "job_id": job_id,
+        "status": "done",
+        "result": result,
+        "stdout": "",
+        "stderr": "",
+        "stdout_len": stdout_from,
+        "stderr_len": stderr_from,
+    }
@@ -4,7 +4,7 @@ import os
 import re
 import html
 import threading
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 # FastMCP import: support multiple versions
 try:
@@ -14,7 +14,11 @@ except Exception:  # fallback for older releases
 
 import uvicorn
 
+import jobs
+import sessions
+import tool_result
 from sandbox_core import execute_python
+from scheduler import SCHEDULER, QueueFull
 from rest_app import app as rest_app  # reuse the same FastAPI app
 
 # Prefer runtime-provided value; fallback is only for local dev
@@ -70,7 +74,7 @@ def _with_links(image_record: Dict[str, object]) -> Dict[str, object]:
     Augment a sandbox_core image record with absolute links.
 
     Modes:
-      - rest  : base + /files/<relpath> (served by the sandbox FastAPI)
+      - rest  : base + /files/<relpath> (served by the sandbox FastAPI), plus /view and /thumb
       - plain : base + /<relpath>       (served by the external static server)
     """
     filename = str(image_record.get("filename", ""))
@@ -87,6 +91,7 @@ def _with_links(image_record: Dict[str, object]) -> Dict[str, object]:
             **image_record,
             "url": f"{base}/files/{filename}",
             "iframe_url": f"{base}/view/{filename}",
+            "thumb_url": f"{base}/thumb/{filename}?w=320&fmt=webp",
         }
     return _without_none(rec)
 
@@ -99,18 +104,8 @@ def _start_rest_background():
     t.start()
 
 
-@server.tool()
-def execute_python_code(code: str) -> Dict[str, object]:
-    """
-    Executes Python code in a sandboxed subprocess and returns:
-      - stdout (str)
-      - stderr (str)
-      - returncode (int)
-      - images (list[{filename, content_type, note?, url, iframe_url}])
-        * filename may include subfolders (per-run isolation)
-    """
-    result = execute_python(code)
-
+def _present_result(result: Dict[str, object]) -> Dict[str, object]:
+    """Sanitize a sandbox_core result for LM Studio and attach absolute links."""
     # Make sure the keys exist and are of expected types
     stdout = result.get("stdout", "") or ""
     stderr = result.get("stderr", "") or ""
@@ -135,14 +130,117 @@ def execute_python_code(code: str) -> Dict[str, object]:
         hint = f"Generated image(s). Example: {first}" if first else "Generated image(s)."
         stdout = hint
 
-    # 5) Graceful no-image scenario: do nothing special — keep text output as-is.
+    # 5) Truncated streams: point at the full log instead of inlining it
+    output = result.get("output")
+    if isinstance(output, dict):
+        for info in output.values():
+            if isinstance(info, dict) and info.get("log"):
+                info["log_url"] = _with_links({"filename": info["log"]})["url"]
+
+    # 6) Profile dump: link it like an image
+    prof = result.get("profile")
+    if isinstance(prof, dict) and prof.get("prof_file"):
+        prof["prof_url"] = _with_links({"filename": prof["prof_file"]})["url"]
+
+    # 7) Graceful no-image scenario: do nothing special — keep text output as-is.
     #    (stdout/stderr already sanitized; images is an empty list.)
 
     result["stdout"] = stdout
     result["stderr"] = stderr
     result["images"] = images
+    return result
+
+
+def _for_model(result: Dict[str, object]) -> Dict[str, object]:
+    """_present_result, then the compact tool_result view (unless TOOL_RESULT_COMPACT=0)."""
+    result = _present_result(result)
+    return tool_result.compact(result) if tool_result.TOOL_RESULT_COMPACT else result
+
 
-    return {"result": result}
+@server.tool()
+def execute_python_code(
+    code: str,
+    background: bool = False,
+    no_cache: bool = False,
+    session_id: Optional[str] = None,
+    profile: bool = False,
+    profile_memory: bool = False,
+) -> Dict[str, object]:
+    """
+    Executes Python code in a sandboxed subprocess and returns:
+      - stdout (str) and stderr (str); long output keeps its beginning and end
+        with an "...[N lines omitted; full output: <url>]..." marker, repeated
+        lines and identical tracebacks are collapsed
+      - full_output ({stdout?, stderr?: url}) when a stream was shortened
+      - returncode (int)
+      - artifacts (list[{file, url}]) — saved files/figures
+        * file may include subfolders (per-run isolation)
+      - timings (dict of milliseconds per phase: spawn_ms, prelude_ms, user_code_ms,
+        autosave_ms, exit_ms, artifacts_ms, total_ms; imports_ms with profile=True)
+    With background=True the code is started as a job and only {job_id, status}
+    is returned; use get_python_job(job_id) to poll for output and the result.
+    no_cache=True forces a real run even if an identical snippet was cached.
+    session_id keeps variables, loaded data and the working directory between
+    calls that use the same id (reset with reset_python_session); not with background=True.
+    profile=True runs the code under cProfile and adds "profile": the top
+    functions by cumulative time (function, ncalls, tottime_s, cumtime_s) and a
+    prof_url to the full profile.prof; profile_memory=True also lists the top
+    allocation sites (tracemalloc). Use it to explain where a slow run spends time.
+    """
+    if session_id and (profile or profile_memory):
+        return {"result": {"stdout": "", "stderr": "[session] profile is not supported for session runs",
+                           "returncode": 1, "images": []}}
+    if session_id and background:
+        return {"result": {"stdout": "", "stderr": "[session] background is not supported for session runs",
+                           "returncode": 1, "images": []}}
+    if background:
+        job = jobs.submit(code, use_cache=not no_cache, profile=profile, profile_memory=profile_memory)
+        return {"result": {"job_id": job.id, "status": job.status}}
+
+    try:
+        with SCHEDULER.slot():
+            if session_id:
+                result = sessions.execute_in_session(session_id, code)
+            else:
+                result = execute_python(code, use_cache=not no_cache, profile=profile, profile_memory=profile_memory)
+    except QueueFull as e:
+        return {"result": {
+            "stdout": "",
+            "stderr": f"[busy] {e}; retry in ~{e.retry_after}s",
+            "returncode": 1,
+            "images": [],
+        }}
+    except (ValueError, RuntimeError) as e:
+        return {"result": {"stdout": "", "stderr": f"[session] {e}", "returncode": 1, "images": []}}
+
+    return {"result": _for_model(result)}
+
+
+@server.tool()
+def get_python_job(job_id: str) -> Dict[str, object]:
+    """
+    Returns the status of a background job started with execute_python_code(background=True):
+      - status: queued | running | done | rejected
+      - stdout/stderr produced so far while running
+      - result (same shape as execute_python_code) once done
+    """
+    snap = jobs.get(job_id)
+    if snap is None:
+        return {"result": {"job_id": job_id, "status": "not_found"}}
+    if isinstance(snap.get("result"), dict):
+        snap["result"] = _for_model(dict(snap["result"]))
+        snap["stdout"] = snap["result"]["stdout"]
+        snap["stderr"] = snap["result"]["stderr"]
+    else:
+        snap["stdout"] = _strip_data_uris(_escape_toolish_tags(str(snap.get("stdout") or "")))
+        snap["stderr"] = _strip_data_uris(_escape_toolish_tags(str(snap.get("stderr") or "")))
+    return {"result": snap}
+
+
+@server.tool()
+def reset_python_session(session_id: str) -> Dict[str, object]:
+    """Discards the interpreter state (variables, imports, loaded data) of a session."""
+    return {"result": {"session_id": session_id, "reset": sessions.reset(session_id)}}
 
 
 def run_stdio_compat():
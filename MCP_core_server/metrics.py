@@ -0,0 +1,195 @@
+# metrics.py
+"""
+In-process metrics in the Prometheus text exposition format (GET /metrics).
+
+Runs are instrumented where they execute (sandbox_core.execute_python and
+sessions.execute_in_session), so the REST endpoints, batches, jobs and the
+MCP tool all report through the same series. Gauges that describe state
+owned by other modules (scheduler, warm pool, caches, TEMP_DIR usage) are
+filled by collector callbacks at scrape time; see register_collector().
+
+No client library is needed: a scrape renders a few dozen lines.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+_LOCK = threading.Lock()
+_METRICS: List["_Metric"] = []
+_COLLECTORS: List[Callable[[], None]] = []
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        with _LOCK:
+            _METRICS.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels: object) -> None:
+        """Mirror a running total kept by another module (e.g. its stats() dict)."""
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = float(value)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: object) -> None:
+        self.set_total(value, **labels)
+
+    def dec(self, amount: float = 1.0, **labels: object) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with _LOCK:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+            total[1] += 1
+
+    def _samples(self) -> List[str]:
+        out: List[str] = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(round(total[0], 6))}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {total[1]}")
+        return out
+
+
+def register_collector(fn: Callable[[], None]) -> None:
+    """Call 'fn' before every render (typically to Gauge.set() values owned elsewhere)."""
+    with _LOCK:
+        if fn not in _COLLECTORS:
+            _COLLECTORS.append(fn)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format (version 0.0.4)."""
+    with _LOCK:
+        collectors = list(_COLLECTORS)
+        metrics = list(_METRICS)
+    for fn in collectors:
+        try:
+            fn()
+        except Exception:
+            COLLECTOR_ERRORS.inc()
+    lines: List[str] = []
+    for m in metrics:
+        with _LOCK:
+            lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# --- run instrumentation (sandbox_core, sessions) ---
+RUN_SECONDS = Histogram(
+    "sandbox_run_duration_seconds", "Wall time of one execution, from spawn to collected artifacts.",
+    _TIME_BUCKETS, ("mode",))
+SPAWN_SECONDS = Histogram(
+    "sandbox_spawn_duration_seconds", "Time to start the child process (warm fork or cold exec).",
+    _FAST_BUCKETS, ("mode",))
+SCAN_SECONDS = Histogram(
+    "sandbox_artifact_scan_duration_seconds", "Time to scan a run directory and write its manifest.",
+    _FAST_BUCKETS)
+RUNS = Counter("sandbox_runs_total", "Finished executions by mode and return code.", ("mode", "returncode"))
+TIMEOUTS = Counter("sandbox_timeouts_total", "Executions killed for exceeding their time limit (rc 124).")
+RUNNER_ERRORS = Counter("sandbox_runner_errors_total", "Executions that failed inside the runner itself.")
+IN_FLIGHT = Gauge("sandbox_runs_in_flight", "Executions currently running.")
+COLLECTOR_ERRORS = Counter("sandbox_metrics_collector_errors_total", "Collector callbacks that raised during a scrape.")
+
+
+@contextmanager
+def in_flight() -> Iterator[None]:
+    IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        IN_FLIGHT.dec()
+
+
+def record_run(mode: str, returncode: int, seconds: float) -> None:
+    """mode: "warm", "cold", "cached", "session" or "error"."""
+    RUN_SECONDS.observe(seconds, mode=mode)
+    RUNS.inc(mode=mode, returncode=returncode)
+    if returncode == 124:
+        TIMEOUTS.inc()
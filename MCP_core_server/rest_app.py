@@ -1,50 +1,316 @@
 from __future__ import annotations
 
 import html
+import json
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 
-from sandbox_core import TEMP_DIR, execute_python
+import batch
+import file_server
+import jobs
+import metrics
+import result_cache
+import retention
+import rlimits
+import sessions
+import streaming
+import thumbs
+import warm_pool
+from sandbox_core import TEMP_DIR, _guess_mime, execute_python
+from scheduler import SCHEDULER, QueueFull
 
 app = FastAPI(title="Python Sandbox REST")
 
-# Serve raw generated files (including per-run subfolders)
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
-app.mount("/files", StaticFiles(directory=TEMP_DIR), name="files")
 
 
 class ImageRecord(BaseModel):
     filename: str        # may include subfolders, e.g. run-id/sine.png
     content_type: str
     note: Optional[str] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+class SkippedImage(BaseModel):
+    filename: str
+    size: int
+    note: str            # which MAX_IMAGE_* limit excluded it
+
+
+class OutputInfo(BaseModel):
+    bytes: int                 # total bytes the stream produced
+    truncated: bool            # stdout/stderr only hold head + tail
+    log: Optional[str] = None  # full stream, relative to /files, e.g. run-id/stdout.log
 
 
 class ExecRequest(BaseModel):
     code: str
+    no_cache: bool = False   # bypass the result cache for this run
+    session_id: Optional[str] = None  # run inside a persistent interpreter session (/execute only)
+    profile: bool = False         # run under cProfile; adds "profile" and saves profile.prof
+    profile_memory: bool = False  # also trace allocations with tracemalloc (implies profile)
 
 
 class ExecResponse(BaseModel):
+    run_id: Optional[str] = None
+    session_id: Optional[str] = None
     stdout: str
     stderr: str
     returncode: int
     images: List[ImageRecord]
+    cached: Optional[bool] = None
+    output: Optional[Dict[str, OutputInfo]] = None
+    manifest: Optional[str] = None   # relpath of the run's manifest.json (all files, sizes, hashes)
+    rusage: Optional[Dict[str, float]] = None  # user_s, sys_s, max_rss_mb, inblock, oublock
+    images_skipped: Optional[List[SkippedImage]] = None
+    timings: Optional[Dict[str, float]] = None  # per-phase ms: spawn, prelude, user_code, ... (imports with profile)
+    profile: Optional[Dict[str, Any]] = None    # top functions / allocation sites, prof_file relpath
+
+
+class BatchItem(BaseModel):
+    code: str
+    timeout: Optional[float] = None   # seconds, capped at EXEC_TIMEOUT_SECONDS
+    id: Optional[str] = None          # echoed back so callers can match results
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    parallelism: Optional[int] = None  # default BATCH_PARALLELISM, capped at MAX_CONCURRENT_RUNS
+    stream: bool = False               # NDJSON, one line per item as it finishes
+    no_cache: bool = False
+
+
+@app.on_event("startup")
+def _start_warm_pool():
+    # Workers import the preload set in the background; early runs fall back to cold spawns
+    warm_pool.get_pool()
+    retention.start()
+
+
+@app.on_event("shutdown")
+def _stop_warm_pool():
+    warm_pool.shutdown()
+    sessions.shutdown()
+    retention.shutdown()
+
+
+@app.middleware("http")
+async def _track_run_access(request: Request, call_next):
+    # Serving a run's files counts as an access for retention (least recently accessed goes first)
+    parts = request.url.path.split("/", 3)
+    if len(parts) > 3 and parts[1] in ("files", "view", "thumb"):
+        retention.touch(parts[2])
+    return await call_next(request)
+
+
+def _queue_full(e: QueueFull) -> HTTPException:
+    """429 when the wait queue is full, 503 when the wait for a slot timed out."""
+    return HTTPException(
+        status_code=503 if e.timed_out else 429,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 
 @app.post("/execute", response_model=ExecResponse, response_model_exclude_none=True)
-def execute(req: ExecRequest):
+def execute(req: ExecRequest, response: Response):
     """
     Execute Python source in a subprocess with CWD=<TEMP_DIR>/<run_id>
     and return stdout/stderr/returncode plus any new image files.
+    Runs are admitted through the shared scheduler (bounded concurrency + queue).
+    With session_id set, the code runs in that session's persistent interpreter.
+    With profile (and profile_memory) set, the response carries "profile": the
+    top functions by cumulative time and top allocation sites; the full
+    cProfile dump is saved as <run_id>/profile.prof.
     """
-    result = execute_python(req.code)
+    if req.session_id and (req.profile or req.profile_memory):
+        raise HTTPException(status_code=400, detail="profile is not supported for session runs")
+    try:
+        with SCHEDULER.slot() as wait_ms:
+            if req.session_id:
+                result = sessions.execute_in_session(req.session_id, req.code)
+            else:
+                result = execute_python(req.code, use_cache=not req.no_cache,
+                                        profile=req.profile, profile_memory=req.profile_memory)
+    except QueueFull as e:
+        raise _queue_full(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    response.headers["X-Queue-Wait-Ms"] = f"{wait_ms:.0f}"
     return ExecResponse(**result)
 
 
+@app.post("/execute/stream")
+def execute_stream(req: ExecRequest):
+    """
+    Same as /execute, but streams line-buffered stdout/stderr and artifact
+    events as Server-Sent Events while the run is in progress, then a final
+    'result' event. Closing the connection cancels the run.
+    """
+    if req.session_id:
+        raise HTTPException(status_code=400, detail="session_id is not supported for streamed runs; use /execute")
+    try:
+        SCHEDULER.check_admission()
+    except QueueFull as e:
+        raise _queue_full(e)
+    return StreamingResponse(
+        streaming.stream_execution(req.code, use_cache=not req.no_cache,
+                                   profile=req.profile, profile_memory=req.profile_memory),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/execute/batch")
+def execute_batch(req: BatchRequest):
+    """
+    Run many independent snippets in parallel, each in its own run directory.
+    Default: {"results": [...in input order...], "summary": {...}}.
+    With "stream": true, answer NDJSON with one result per line as items
+    finish (each carries "index" and "id"), then a {"summary": ...} line.
+    """
+    if not req.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(req.items) > batch.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {batch.BATCH_MAX_ITEMS} items per batch")
+    items = [item.model_dump() for item in req.items]
+    parallelism = batch.parallelism_for(req.parallelism, len(items))
+
+    if req.stream:
+        def lines():
+            t0 = time.perf_counter()
+            done = []
+            for res in batch.iter_batch(items, parallelism=parallelism, use_cache=not req.no_cache):
+                done.append(res)
+                yield json.dumps(res, ensure_ascii=False) + "\n"
+            summary = batch.summarize(done, parallelism)
+            summary["wall_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+            yield json.dumps({"summary": summary}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    t0 = time.perf_counter()
+    results, summary = batch.run_batch(items, parallelism=parallelism, use_cache=not req.no_cache)
+    summary["wall_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    return {"results": results, "summary": summary}
+
+
+@app.get("/execute/stats")
+def execute_stats():
+    """Scheduler state: running/queued runs, rejections and queue wait times."""
+    return SCHEDULER.stats()
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(req: ExecRequest):
+    """
+    Start an execution in the background and return its id right away.
+    Poll GET /jobs/{job_id} for status, partial output and the final result.
+    """
+    if req.session_id:
+        raise HTTPException(status_code=400, detail="session_id is not supported for jobs; use /execute")
+    try:
+        SCHEDULER.check_admission()
+    except QueueFull as e:
+        raise _queue_full(e)
+    job = jobs.submit(req.code, use_cache=not req.no_cache,
+                      profile=req.profile, profile_memory=req.profile_memory)
+    return {"job_id": job.id, "status": job.status, "poll_url": f"/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, stdout_from: int = 0, stderr_from: int = 0):
+    """
+    Job status. While running, stdout/stderr carry the output produced so far
+    (from the given character offsets); once done, 'result' has the /execute payload.
+    """
+    snap = jobs.get(job_id, stdout_from=max(0, stdout_from), stderr_from=max(0, stderr_from))
+    if snap is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return snap
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job (the child process is killed)."""
+    if not jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or already finished")
+    return {"job_id": job_id, "status": "cancelling"}
+
+
+@app.get("/sessions")
+def list_sessions():
+    """Live interpreter sessions with call counts, idle time and memory use."""
+    return sessions.list_sessions()
+
+
+@app.delete("/sessions/{session_id}")
+def reset_session(session_id: str):
+    """Reset a session: its interpreter (and all globals) is discarded."""
+    if not sessions.reset(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "status": "reset"}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Result cache counters (hits/misses/stores/evictions)."""
+    return result_cache.stats()
+
+
+@app.get("/cache/thumbs")
+def thumb_stats():
+    """Thumbnail cache counters (hits/renders/fallbacks/evictions)."""
+    return thumbs.stats()
+
+
+@app.get("/retention")
+def retention_report():
+    """
+    Dry run: which runs the retention limits would remove right now and how many
+    bytes that would reclaim, plus counters of what earlier passes removed.
+    """
+    report = retention.plan()
+    report["stats"] = retention.stats()
+    return report
+
+
+@app.post("/retention/collect")
+def retention_collect():
+    """Apply the retention limits now instead of waiting for the next background pass."""
+    report = retention.collect()
+    report["stats"] = retention.stats()
+    return report
+
+
+@app.post("/runs/{run_id}/pin")
+def pin_run(run_id: str):
+    """Keep a run directory regardless of retention limits."""
+    if not retention.pin(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    return {"run_id": run_id, "pinned": True}
+
+
+@app.delete("/runs/{run_id}/pin")
+def unpin_run(run_id: str):
+    """Make a pinned run eligible for retention again."""
+    if not retention.unpin(run_id):
+        raise HTTPException(status_code=404, detail="Run not found or not pinned")
+    return {"run_id": run_id, "pinned": False}
+
+
 def _resolve_safe(relpath: str) -> Path:
     """
     Safely resolve a relative path under TEMP_DIR, allowing subfolders,
@@ -57,21 +323,94 @@ def _resolve_safe(relpath: str) -> Path:
     return candidate
 
 
-@app.get("/view/{relpath:path}", response_class=HTMLResponse)
-def view_file(relpath: str):
-    """Simple HTML viewer for images/PDF/SVG/etc under TEMP_DIR (with subfolders)."""
+@app.get("/thumb/{relpath:path}")
+def thumb_file(relpath: str, request: Request, w: int = 320, fmt: str = "webp", q: int = 80):
+    """
+    Resized/recompressed derivative of an image under TEMP_DIR, e.g.
+    /thumb/<run_id>/figure_1.png?w=320&fmt=webp. Derivatives are cached on disk by
+    content hash. Files that cannot be rasterized (SVG, PDF) redirect to /files.
+    """
     file_path = _resolve_safe(relpath)
-    rel_display = file_path.relative_to(TEMP_DIR).as_posix()
-
-    file_url = f"/files/{html.escape(rel_display)}"
-    ctype = "application/octet-stream"
+    rel = file_path.relative_to(TEMP_DIR).as_posix()
+    if not thumbs.supports(file_path):
+        thumbs.note_fallback()
+        return RedirectResponse(f"/files/{rel}", status_code=307)
     try:
-        import mimetypes
-        ctype = mimetypes.guess_type(file_path.as_posix())[0] or ctype
+        out, ctype, key = thumbs.derivative(file_path, w, fmt, q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception:
-        pass
+        thumbs.note_fallback()
+        return RedirectResponse(f"/files/{rel}", status_code=307)
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": file_server.cache_control(rel, TEMP_DIR)}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(out, media_type=ctype, headers=headers)
+
 
-    if ctype.startswith("image/"):
+@app.api_route("/files/{relpath:path}", methods=["GET", "HEAD"])
+def serve_file(relpath: str, request: Request):
+    """
+    Raw generated files (including per-run subfolders), with HTTP caching:
+    strong ETag / Last-Modified and 304s, Cache-Control immutable once the run
+    has finished, single byte ranges (206/416) and precompressed gzip/br
+    variants of text artifacts.
+    """
+    file_path = _resolve_safe(relpath)
+    rel = file_path.relative_to(TEMP_DIR).as_posix()
+    st = file_path.stat()
+    etag = file_server.etag_for(st)
+    finished = file_server.is_finished(rel, TEMP_DIR)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": file_server.last_modified(st),
+        "Cache-Control": file_server.IMMUTABLE if finished else file_server.REVALIDATE,
+        "Accept-Ranges": "bytes",
+    }
+    if file_server.not_modified(request.headers, etag, st):
+        return Response(status_code=304, headers=headers)
+    ctype = _guess_mime(file_path)
+
+    # Byte ranges (If-Range: only when the client's copy is still current)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            span = file_server.parse_range(range_header, st.st_size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{st.st_size}"
+            return Response(status_code=416, headers=headers)
+        if span is not None:
+            start, end = span
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            body = [] if request.method == "HEAD" else file_server.iter_file(file_path, start, end)
+            return StreamingResponse(body, status_code=206, media_type=ctype, headers=headers)
+
+    if finished:
+        variant = file_server.encoded_variant(file_path, etag, request.headers.get("accept-encoding", ""))
+        headers["Vary"] = "Accept-Encoding"
+        if variant is not None:
+            encoded, encoding = variant
+            headers["Content-Encoding"] = encoding
+            headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+            return FileResponse(encoded, media_type=ctype, headers=headers, method=request.method)
+    return FileResponse(file_path, media_type=ctype, headers=headers, method=request.method)
+
+
+@lru_cache(maxsize=512)
+def _render_view(rel_display: str, ctype: str, thumbable: bool, _version: str) -> str:
+    """HTML for /view; '_version' (the file's ETag) keys the cache so edits re-render."""
+    file_url = f"/files/{html.escape(rel_display)}"
+    if ctype.startswith("image/") and thumbable:
+        # Screen-sized derivative; the full-resolution file is one click away
+        thumb_url = f"/thumb/{html.escape(rel_display)}?w=1600&amp;fmt=webp"
+        body = (
+            f'<a href="{file_url}"><img src="{thumb_url}" alt="{html.escape(rel_display)}" '
+            f'style="max-width:100%;height:auto" /></a>'
+        )
+    elif ctype.startswith("image/"):
         body = f'<img src="{file_url}" alt="{html.escape(rel_display)}" style="max-width:100%;height:auto" />'
     else:
         body = (
@@ -94,9 +433,74 @@ def view_file(relpath: str):
 </html>"""
 
 
+@app.get("/view/{relpath:path}", response_class=HTMLResponse)
+def view_file(relpath: str, request: Request):
+    """Simple HTML viewer for images/PDF/SVG/etc under TEMP_DIR (with subfolders)."""
+    file_path = _resolve_safe(relpath)
+    rel_display = file_path.relative_to(TEMP_DIR).as_posix()
+    st = file_path.stat()
+    etag = file_server.etag_for(st)
+    headers = {"ETag": etag, "Cache-Control": file_server.cache_control(rel_display, TEMP_DIR)}
+    if file_server.not_modified(request.headers, etag, st):
+        return Response(status_code=304, headers=headers)
+    page = _render_view(rel_display, _guess_mime(file_path), thumbs.supports(file_path), etag)
+    return HTMLResponse(page, headers=headers)
+
+
+_QUEUE = metrics.Gauge("sandbox_scheduler_runs", "Runs holding or waiting for a scheduler slot.", ("state",))
+_ADMISSIONS = metrics.Counter("sandbox_scheduler_admissions_total", "Scheduler admission decisions.", ("outcome",))
+_WARM_WORKERS = metrics.Gauge("sandbox_warm_pool_workers", "Warm-pool workers by state.", ("state",))
+_CACHE = metrics.Counter("sandbox_result_cache_events_total", "Result-cache lookups and evictions.", ("event",))
+_TEMP_BYTES = metrics.Gauge("sandbox_temp_dir_bytes", "Bytes used by run directories under TEMP_DIR.")
+_RUN_DIRS = metrics.Gauge("sandbox_run_directories", "Run directories under TEMP_DIR.")
+_RETENTION = metrics.Counter("sandbox_retention_removed_total", "Run directories / bytes removed by retention.", ("unit",))
+_SESSIONS = metrics.Gauge("sandbox_sessions_live", "Live persistent sessions.")
+
+
+def _collect_metrics() -> None:
+    s = SCHEDULER.stats()
+    _QUEUE.set(s["running"], state="running")
+    _QUEUE.set(s["queued"], state="queued")
+    for outcome, key in (("admitted", "admitted"), ("rejected", "rejected"), ("timed_out", "queue_timeouts")):
+        _ADMISSIONS.set_total(s[key], outcome=outcome)
+    pool = warm_pool.get_pool()
+    if pool is not None:
+        p = pool.stats()
+        _WARM_WORKERS.set(p["size"], state="configured")
+        _WARM_WORKERS.set(p["idle"], state="idle")
+    c = result_cache.stats()
+    for event in ("hits", "misses", "evictions"):
+        _CACHE.set_total(c.get(event, 0), event=event)
+    u = retention.usage()
+    _TEMP_BYTES.set(u["bytes"])
+    _RUN_DIRS.set(u["runs"])
+    r = retention.stats()
+    _RETENTION.set_total(r["runs_removed"], unit="runs")
+    _RETENTION.set_total(r["bytes_reclaimed"], unit="bytes")
+    _SESSIONS.set(len(sessions.list_sessions()))
+
+
+metrics.register_collector(_collect_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """
+    Prometheus text exposition: run duration / spawn / artifact-scan histograms,
+    return-code, timeout and runner-error counters, in-flight runs, scheduler,
+    warm-pool and cache state, TEMP_DIR bytes and run-directory count.
+    Runs made through the MCP tool are included (same process, same counters).
+    """
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    out = {"status": "ok", "run_limits": rlimits.describe()}
+    pool = warm_pool.get_pool()
+    if pool is not None:
+        out["warm_pool"] = pool.stats()
+    return out
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -106,10 +510,11 @@ def root():
   <head><meta charset="utf-8"><title>Python Sandbox REST</title></head>
   <body style="font-family: system-ui, sans-serif; margin:16px">
     <h2>Python Sandbox REST</h2>
-    <p>Use the <code>/execute</code> POST endpoint to run code. Generated files (per-run folders) are under <code>/files</code>.</p>
+    <p>Use the <code>/execute</code> POST endpoint to run code, or <code>/jobs</code> to run it in the background and poll <code>/jobs/{id}</code>. Generated files (per-run folders) are under <code>/files</code>.</p>
     <ul>
       <li><a href="/docs">OpenAPI docs</a></li>
       <li><a href="/health">Health</a></li>
+      <li><a href="/metrics">Metrics</a></li>
     </ul>
   </body>
 </html>"""
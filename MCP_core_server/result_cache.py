@@ -0,0 +1,247 @@
+# result_cache.py
+"""
+Opt-in, content-addressed cache of sandbox results.
+
+Key = sha256(environment fingerprint + code). The fingerprint covers the
+Python version/executable, installed package versions and a few env vars
+that change what a run does, so a rebuilt image never serves stale results.
+
+An entry stores stdout/stderr/returncode plus every file the run left in its
+run directory. A hit re-links (hard link, copy as fallback) those files into
+the new run directory, so URLs keep pointing at a per-run folder as usual.
+
+Each entry also records how long the run took (spawn to exit). The key only
+covers the code, so a lookup with a limit below EXEC_TIMEOUT_SECONDS (batch
+items with their own "timeout") is a miss unless the recorded run fits in it;
+otherwise a snippet that once finished in 20s would be served as a success
+where it should time out.
+
+Eviction: entries older than RESULT_CACHE_MAX_AGE_SECONDS are dropped, then
+least-recently-used entries until the cache fits RESULT_CACHE_MAX_BYTES.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "0") not in {"0", "false", "False", ""}
+RESULT_CACHE_DIR = Path(os.getenv(
+    "RESULT_CACHE_DIR",
+    str(Path(os.getenv("SANDBOX_TEMP_DIR", "/app/temp")).resolve().parent / "cache" / "results"),
+)).resolve()
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+RESULT_CACHE_MAX_AGE_SECONDS = int(os.getenv("RESULT_CACHE_MAX_AGE_SECONDS", str(24 * 3600)))
+# Env vars whose values are part of the fingerprint
+RESULT_CACHE_ENV_VARS = [
+    v.strip()
+    for v in os.getenv("RESULT_CACHE_ENV_VARS", "MPLBACKEND,AUTO_SAVE_MPL,EXEC_TIMEOUT_SECONDS,PYTHONHASHSEED").split(",")
+    if v.strip()
+]
+
+# Return codes that say nothing about the code itself (timeout, cancel, killed by signal)
+_UNCACHEABLE_RC = {124, 130}
+
+_META = "meta.json"
+_FILES = "files"
+_FORMAT = 1
+
+_lock = threading.Lock()
+_fingerprint: Optional[str] = None
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+
+def enabled() -> bool:
+    return RESULT_CACHE_ENABLED
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def env_fingerprint() -> str:
+    """Hash of interpreter, installed distributions and relevant env vars (computed once)."""
+    global _fingerprint
+    if _fingerprint is None:
+        from importlib import metadata
+
+        h = hashlib.sha256()
+        h.update(f"format={_FORMAT}\n{sys.version}\n{sys.executable}\n".encode())
+        dists = sorted(
+            f"{(d.metadata['Name'] or '').lower()}=={d.version}" for d in metadata.distributions()
+        )
+        h.update("\n".join(dists).encode())
+        for var in RESULT_CACHE_ENV_VARS:
+            h.update(f"\n{var}={os.environ.get(var, '')}".encode())
+        _fingerprint = h.hexdigest()
+    return _fingerprint
+
+
+def key_for(code: str) -> str:
+    return hashlib.sha256((env_fingerprint() + "\0" + code).encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _walk_files(root: Path) -> List[Tuple[Path, int]]:
+    out: List[Tuple[Path, int]] = []
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(Path(e.path))
+                elif e.is_file(follow_symlinks=False):
+                    out.append((Path(e.path), e.stat(follow_symlinks=False).st_size))
+    return out
+
+
+def note_bypass() -> None:
+    _count("bypassed")
+
+
+def lookup(key: str, run_dir: Path, max_run_s: Optional[float] = None) -> Optional[Dict[str, object]]:
+    """
+    On a hit, re-link the cached files into run_dir and return
+    {"stdout", "stderr", "returncode", "output"?}; None on a miss.
+    max_run_s: only accept an entry whose recorded run time fits in it
+    (entries without one never do).
+    """
+    entry = RESULT_CACHE_DIR / key
+    try:
+        meta = json.loads((entry / _META).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        _count("misses")
+        return None
+    if time.time() - float(meta.get("created", 0)) > RESULT_CACHE_MAX_AGE_SECONDS:
+        shutil.rmtree(entry, ignore_errors=True)
+        _count("misses")
+        return None
+    if max_run_s is not None and float(meta.get("run_s", float("inf"))) > max_run_s:
+        _count("misses")
+        return None
+    try:
+        files_dir = entry / _FILES
+        if files_dir.is_dir():
+            for src, _size in _walk_files(files_dir):
+                _link_or_copy(src, run_dir / src.relative_to(files_dir))
+        os.utime(entry)  # LRU bookkeeping
+    except OSError:
+        _count("errors")
+        return None
+    _count("hits")
+    hit = {"stdout": meta["stdout"], "stderr": meta["stderr"], "returncode": meta["returncode"]}
+    if meta.get("output"):
+        hit["output"] = meta["output"]
+    return hit
+
+
+def store(key: str, run_dir: Path, result: Dict[str, object], exclude: Tuple[str, ...] = (),
+          run_s: Optional[float] = None) -> None:
+    """Save a finished run under 'key' (no-op for timeouts/cancellations/signals); run_s = its run time."""
+    rc = int(result.get("returncode", 1))
+    if rc in _UNCACHEABLE_RC or rc < 0:
+        return
+    entry = RESULT_CACHE_DIR / key
+    if entry.exists():
+        return
+    tmp = RESULT_CACHE_DIR / f".tmp-{uuid4().hex}"
+    try:
+        files_dir = tmp / _FILES
+        files_dir.mkdir(parents=True)
+        total = 0
+        for src, size in _walk_files(run_dir):
+            rel = src.relative_to(run_dir)
+            if rel.as_posix() in exclude:
+                continue
+            _link_or_copy(src, files_dir / rel)
+            total += size
+        meta = {
+            "created": time.time(),
+            "bytes": total,
+            "stdout": result.get("stdout", ""),
+            "stderr": result.get("stderr", ""),
+            "returncode": rc,
+        }
+        if run_s is not None:
+            meta["run_s"] = round(run_s, 3)
+        output = result.get("output")
+        if isinstance(output, dict):
+            # Log paths are stored relative to the run dir and re-rooted on a hit
+            meta["output"] = {
+                k: {**v, "log": Path(v["log"]).name if v.get("log") else None} for k, v in output.items()
+            }
+        (tmp / _META).write_text(json.dumps(meta), encoding="utf-8")
+        os.rename(tmp, entry)
+        _count("stores")
+    except OSError:
+        _count("errors")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    evict()
+
+
+def evict() -> int:
+    """Apply age and size limits; returns the number of entries removed."""
+    try:
+        entries = []
+        now = time.time()
+        with os.scandir(RESULT_CACHE_DIR) as it:
+            for e in it:
+                if not e.is_dir() or e.name.startswith("."):
+                    continue
+                try:
+                    meta = json.loads(Path(e.path, _META).read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    continue
+                entries.append((e.stat().st_mtime, float(meta.get("created", 0)), int(meta.get("bytes", 0)), e.path))
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    total = 0
+    keep = []
+    for used, created, size, path in entries:
+        if now - created > RESULT_CACHE_MAX_AGE_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        else:
+            keep.append((used, size, path))
+            total += size
+    for used, size, path in sorted(keep):
+        if total <= RESULT_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed += 1
+    if removed:
+        with _lock:
+            _stats["evictions"] += removed
+    return removed
+
+
+def stats() -> Dict[str, object]:
+    with _lock:
+        out: Dict[str, object] = dict(_stats)
+    out["enabled"] = RESULT_CACHE_ENABLED
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+    return out
+
+
+if RESULT_CACHE_ENABLED:
+    RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,286 @@
+# retention.py
+"""
+Retention / garbage collection for run directories under TEMP_DIR.
+
+A background thread applies, every RETENTION_INTERVAL_SECONDS:
+
+  1. RETENTION_MAX_AGE_SECONDS  runs not accessed for longer are removed
+  2. RETENTION_MAX_RUNS         then least-recently-accessed runs until the count fits
+  3. RETENTION_MAX_BYTES        then least-recently-accessed runs until the size fits
+
+(0 disables a limit.) "Last access" is the run directory's mtime: it moves when
+the run writes files and when its files are served (touch()). Never removed:
+
+  - pinned runs (a .pinned file in the run directory, see pin()/unpin())
+  - directories of live sessions
+  - runs still in flight (no manifest.json yet and younger than a grace period)
+
+plan() computes the same decisions without deleting anything (dry-run report).
+"""
+from __future__ import annotations
+
+import os
+import time
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import sessions
+from artifacts import MANIFEST_FILE
+from sandbox_core import EXEC_TIMEOUT, TEMP_DIR
+from scheduler import QUEUE_TIMEOUT
+
+RETENTION_MAX_BYTES = int(os.getenv("RETENTION_MAX_BYTES", "0"))
+RETENTION_MAX_AGE_SECONDS = int(os.getenv("RETENTION_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+RETENTION_MAX_RUNS = int(os.getenv("RETENTION_MAX_RUNS", "0"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "300"))
+
+PIN_FILE = ".pinned"
+# A run without a manifest is treated as in flight for this long (queued + running + slack)
+_IN_FLIGHT_GRACE_SECONDS = QUEUE_TIMEOUT + EXEC_TIMEOUT + 60
+# touch() updates a run's mtime at most this often
+_TOUCH_EVERY_SECONDS = 60.0
+
+_lock = threading.Lock()
+_sizes: Dict[str, int] = {}           # finished runs only; their size no longer changes
+_touched: Dict[str, float] = {}
+_stats = {"passes": 0, "runs_removed": 0, "bytes_reclaimed": 0, "errors": 0,
+          "last_pass": None, "last_pass_ms": 0.0, "last_removed": 0, "last_bytes_reclaimed": 0}
+_usage: Dict[str, float] = {"runs": 0, "bytes": 0, "at": 0.0}
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def _run_dir(run_id: str) -> Optional[Path]:
+    if not run_id or run_id.startswith(".") or "/" in run_id:
+        return None
+    path = TEMP_DIR / run_id
+    return path if path.is_dir() else None
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    else:
+                        total += e.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    return total
+
+
+def _live_session_dirs() -> Set[str]:
+    return {str(s["run_id"]) for s in sessions.list_sessions()}
+
+
+def _inventory() -> List[Dict[str, object]]:
+    """One entry per run directory: id, last access, bytes, pinned, protected reason."""
+    now = time.time()
+    live_sessions = _live_session_dirs()
+    runs: List[Dict[str, object]] = []
+    seen: Set[str] = set()
+    with os.scandir(TEMP_DIR) as it:
+        for e in it:
+            if e.name.startswith(".") or not e.is_dir(follow_symlinks=False):
+                continue
+            try:
+                accessed = e.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            seen.add(e.name)
+            finished = os.path.exists(os.path.join(e.path, MANIFEST_FILE))
+            protect = None
+            if os.path.exists(os.path.join(e.path, PIN_FILE)):
+                protect = "pinned"
+            elif e.name in live_sessions:
+                protect = "live session"
+            elif not finished and now - accessed < _IN_FLIGHT_GRACE_SECONDS:
+                protect = "in flight"
+
+            with _lock:
+                size = _sizes.get(e.name)
+            if size is None:
+                size = _dir_bytes(e.path)
+                if finished and not e.name.startswith("session-"):
+                    with _lock:
+                        _sizes[e.name] = size
+            runs.append({"run_id": e.name, "last_access": accessed, "bytes": size, "protected": protect})
+    with _lock:
+        for gone in set(_sizes) - seen:
+            _sizes.pop(gone, None)
+    return runs
+
+
+def plan(now: Optional[float] = None) -> Dict[str, object]:
+    """
+    Decide which runs the limits would remove, without touching anything.
+    Returns totals before/after plus the candidate list (oldest access first).
+    """
+    now = now or time.time()
+    runs = _inventory()
+    total_bytes = sum(int(r["bytes"]) for r in runs)
+    evict: List[Tuple[Dict[str, object], str]] = []
+    keep: List[Dict[str, object]] = []
+
+    # Least recently accessed first
+    for r in sorted(runs, key=lambda r: float(r["last_access"])):
+        if r["protected"] is None and RETENTION_MAX_AGE_SECONDS > 0 \
+                and now - float(r["last_access"]) > RETENTION_MAX_AGE_SECONDS:
+            evict.append((r, "max_age"))
+        else:
+            keep.append(r)
+
+    remaining_runs = len(keep)
+    remaining_bytes = sum(int(r["bytes"]) for r in keep)
+    for r in keep:
+        if r["protected"] is not None:
+            continue
+        if RETENTION_MAX_RUNS > 0 and remaining_runs > RETENTION_MAX_RUNS:
+            reason = "max_runs"
+        elif RETENTION_MAX_BYTES > 0 and remaining_bytes > RETENTION_MAX_BYTES:
+            reason = "max_bytes"
+        else:
+            continue
+        evict.append((r, reason))
+        remaining_runs -= 1
+        remaining_bytes -= int(r["bytes"])
+
+    return {
+        "limits": {
+            "max_bytes": RETENTION_MAX_BYTES,
+            "max_age_seconds": RETENTION_MAX_AGE_SECONDS,
+            "max_runs": RETENTION_MAX_RUNS,
+        },
+        "runs": len(runs),
+        "bytes": total_bytes,
+        "protected": sum(1 for r in runs if r["protected"] is not None),
+        "evict": [
+            {"run_id": r["run_id"], "bytes": r["bytes"], "last_access": r["last_access"], "reason": reason}
+            for r, reason in evict
+        ],
+        "reclaim_bytes": sum(int(r["bytes"]) for r, _ in evict),
+        "runs_after": remaining_runs,
+        "bytes_after": remaining_bytes,
+    }
+
+
+def collect() -> Dict[str, object]:
+    """Run one retention pass; returns the executed plan plus what was actually removed."""
+    t0 = time.perf_counter()
+    report = plan()
+    removed = 0
+    reclaimed = 0
+    for item in report["evict"]:
+        path = TEMP_DIR / str(item["run_id"])
+        # Re-check the pin: the run may have been pinned since plan()
+        if (path / PIN_FILE).exists():
+            continue
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            with _lock:
+                _stats["errors"] += 1
+            continue
+        removed += 1
+        reclaimed += int(item["bytes"])
+        with _lock:
+            _sizes.pop(str(item["run_id"]), None)
+            _touched.pop(str(item["run_id"]), None)
+    with _lock:
+        _stats["passes"] += 1
+        _stats["runs_removed"] += removed
+        _stats["bytes_reclaimed"] += reclaimed
+        _stats["last_pass"] = time.time()
+        _stats["last_pass_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        _stats["last_removed"] = removed
+        _stats["last_bytes_reclaimed"] = reclaimed
+    report["removed"] = removed
+    report["reclaimed_bytes"] = reclaimed
+    return report
+
+
+def touch(run_id: str) -> None:
+    """Record an access to a run (moves it to the back of the eviction order)."""
+    now = time.time()
+    with _lock:
+        if now - _touched.get(run_id, 0.0) < _TOUCH_EVERY_SECONDS:
+            return
+        _touched[run_id] = now
+    path = _run_dir(run_id)
+    if path is not None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+def pin(run_id: str) -> bool:
+    path = _run_dir(run_id)
+    if path is None:
+        return False
+    (path / PIN_FILE).touch()
+    return True
+
+
+def unpin(run_id: str) -> bool:
+    path = _run_dir(run_id)
+    if path is None:
+        return False
+    try:
+        (path / PIN_FILE).unlink()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def stats() -> Dict[str, object]:
+    with _lock:
+        return dict(_stats)
+
+
+def usage(max_age: float = 30.0) -> Dict[str, int]:
+    """Run-directory count and total bytes under TEMP_DIR, recomputed at most every max_age seconds."""
+    with _lock:
+        fresh = time.time() - _usage["at"] < max_age
+    if not fresh:
+        runs = _inventory()
+        with _lock:
+            _usage.update(runs=len(runs), bytes=sum(int(r["bytes"]) for r in runs), at=time.time())
+    with _lock:
+        return {"runs": int(_usage["runs"]), "bytes": int(_usage["bytes"])}
+
+
+def _loop() -> None:
+    while not _stop.wait(RETENTION_INTERVAL_SECONDS):
+        try:
+            collect()
+        except Exception:
+            with _lock:
+                _stats["errors"] += 1
+
+
+def start() -> None:
+    """Start the background retention thread (no-op if every limit is disabled)."""
+    global _thread
+    if RETENTION_INTERVAL_SECONDS <= 0 or not (RETENTION_MAX_BYTES or RETENTION_MAX_AGE_SECONDS or RETENTION_MAX_RUNS):
+        return
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_loop, name="retention", daemon=True)
+        _thread.start()
+
+
+def shutdown() -> None:
+    _stop.set()
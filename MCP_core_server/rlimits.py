@@ -0,0 +1,149 @@
+# rlimits.py
+"""
+Per-run resource limits and resource-usage accounting for sandbox children.
+
+Limits are applied inside the child before user code runs: by a prelude at the
+top of the cold child's code (prelude()), right after fork for warm-pool runs,
+and first thing in a session interpreter. Never via preexec_fn, which is not
+safe in the threaded server process. 0 disables a limit:
+
+  RUN_LIMIT_AS_MB         address space (RLIMIT_AS), MB
+  RUN_LIMIT_CPU_SECONDS   CPU time (RLIMIT_CPU); the child gets SIGXCPU, then SIGKILL
+  RUN_LIMIT_NOFILE        open file descriptors (RLIMIT_NOFILE)
+  RUN_LIMIT_NPROC         processes/threads of the sandbox user (RLIMIT_NPROC; counts
+                          every process of that uid, server included)
+  RUN_LIMIT_FSIZE_MB      largest file the run may write (RLIMIT_FSIZE), MB
+
+Usage comes from wait4() on the child (or getrusage deltas in sessions) and is
+reported as result["rusage"].
+"""
+from __future__ import annotations
+
+import os
+import signal
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # non-POSIX platforms: limits and rusage are unavailable
+    resource = None  # type: ignore[assignment]
+
+RUN_LIMIT_AS_MB = int(os.getenv("RUN_LIMIT_AS_MB", "0"))
+RUN_LIMIT_CPU_SECONDS = int(os.getenv("RUN_LIMIT_CPU_SECONDS", "0"))
+RUN_LIMIT_NOFILE = int(os.getenv("RUN_LIMIT_NOFILE", "0"))
+RUN_LIMIT_NPROC = int(os.getenv("RUN_LIMIT_NPROC", "0"))
+RUN_LIMIT_FSIZE_MB = int(os.getenv("RUN_LIMIT_FSIZE_MB", "0"))
+
+_MB = 1024 * 1024
+
+
+def configured(cpu: bool = True) -> Dict[str, int]:
+    """RLIMIT_* name -> soft limit for every enabled limit."""
+    out: Dict[str, int] = {}
+    if RUN_LIMIT_AS_MB > 0:
+        out["RLIMIT_AS"] = RUN_LIMIT_AS_MB * _MB
+    if cpu and RUN_LIMIT_CPU_SECONDS > 0:
+        out["RLIMIT_CPU"] = RUN_LIMIT_CPU_SECONDS
+    if RUN_LIMIT_NOFILE > 0:
+        out["RLIMIT_NOFILE"] = RUN_LIMIT_NOFILE
+    if RUN_LIMIT_NPROC > 0:
+        out["RLIMIT_NPROC"] = RUN_LIMIT_NPROC
+    if RUN_LIMIT_FSIZE_MB > 0:
+        out["RLIMIT_FSIZE"] = RUN_LIMIT_FSIZE_MB * _MB
+    return out
+
+
+def _targets(cpu: bool = True) -> List[Tuple[int, int, int]]:
+    """(RLIMIT_* constant, soft, hard) for every enabled limit, capped at the current hard limits."""
+    if resource is None:
+        return []
+    out: List[Tuple[int, int, int]] = []
+    for name, soft in configured(cpu).items():
+        try:
+            which = getattr(resource, name)
+            _cur_soft, cur_hard = resource.getrlimit(which)
+        except (ValueError, OSError, AttributeError):
+            continue
+        # CPU: SIGXCPU at the soft limit, SIGKILL a little later at the hard one
+        hard = soft + 2 if name == "RLIMIT_CPU" else soft
+        if cur_hard != resource.RLIM_INFINITY:
+            hard = min(hard, cur_hard)
+        out.append((which, min(soft, hard), hard))
+    return out
+
+
+def apply(cpu: bool = True) -> None:
+    """
+    Lower the calling process's limits (run in the child, before user code).
+    Must stay fork-safe: no locks, no logging, errors are ignored.
+    """
+    for which, soft, hard in _targets(cpu):
+        try:
+            resource.setrlimit(which, (soft, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def prelude(cpu: bool = True) -> str:
+    """Python source that applies the limits; put it first in a `python -c` child ("" if none)."""
+    targets = _targets(cpu)
+    if not targets:
+        return ""
+    return (
+        "# --- sandbox resource limits (RUN_LIMIT_*) ---\n"
+        "import resource as _sbx_resource\n"
+        f"for _sbx_which, _sbx_soft, _sbx_hard in {targets!r}:\n"
+        "    try:\n"
+        "        _sbx_resource.setrlimit(_sbx_which, (_sbx_soft, _sbx_hard))\n"
+        "    except (ValueError, OSError):\n"
+        "        pass\n"
+    )
+
+
+def rusage_dict(ru) -> Dict[str, float]:
+    """JSON-friendly subset of a struct_rusage (ru_maxrss is KB on Linux)."""
+    return {
+        "user_s": round(ru.ru_utime, 3),
+        "sys_s": round(ru.ru_stime, 3),
+        "max_rss_mb": round(ru.ru_maxrss / 1024.0, 1),
+        "inblock": int(ru.ru_inblock),
+        "oublock": int(ru.ru_oublock),
+    }
+
+
+def self_usage():
+    """getrusage(RUSAGE_SELF) or None (sessions report per-call deltas)."""
+    return resource.getrusage(resource.RUSAGE_SELF) if resource is not None else None
+
+
+def usage_delta(before, after) -> Optional[Dict[str, float]]:
+    if before is None or after is None:
+        return None
+    return {
+        "user_s": round(after.ru_utime - before.ru_utime, 3),
+        "sys_s": round(after.ru_stime - before.ru_stime, 3),
+        "max_rss_mb": round(after.ru_maxrss / 1024.0, 1),  # high-water mark of the interpreter
+        "inblock": int(after.ru_inblock - before.ru_inblock),
+        "oublock": int(after.ru_oublock - before.ru_oublock),
+    }
+
+
+def limit_note(returncode: int, usage: Optional[Dict[str, float]] = None) -> str:
+    """Explain a child killed by a resource limit ("" otherwise)."""
+    if returncode == -signal.SIGXFSZ:
+        return f"\n[limit] File size limit exceeded ({RUN_LIMIT_FSIZE_MB} MB)"
+    if returncode in (-signal.SIGXCPU, -signal.SIGKILL) and RUN_LIMIT_CPU_SECONDS > 0:
+        cpu = (usage or {}).get("user_s", 0) + (usage or {}).get("sys_s", 0)
+        if returncode == -signal.SIGXCPU or cpu >= RUN_LIMIT_CPU_SECONDS:
+            return f"\n[limit] CPU time limit exceeded ({RUN_LIMIT_CPU_SECONDS}s)"
+    return ""
+
+
+def describe() -> Dict[str, int]:
+    return {
+        "as_mb": RUN_LIMIT_AS_MB,
+        "cpu_seconds": RUN_LIMIT_CPU_SECONDS,
+        "nofile": RUN_LIMIT_NOFILE,
+        "nproc": RUN_LIMIT_NPROC,
+        "fsize_mb": RUN_LIMIT_FSIZE_MB,
+    }
@@ -3,30 +3,52 @@ from __future__ import annotations
 
 import os
 import sys
+import json
+import codecs
+import signal
+import collections
+import time
 import subprocess
+import threading
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 from uuid import uuid4
 
+import artifacts
+import metrics
+import result_cache
+import rlimits
+import warm_pool
+from artifacts import IMAGE_EXTS, MAX_IMAGE_BYTES, MAX_IMAGE_COUNT
+
 # Root where all runs are stored and served
 TEMP_DIR = Path(os.getenv("SANDBOX_TEMP_DIR", "/app/temp")).resolve()
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
 
-# What we consider "images" to auto-expose (viewer will handle non-images too)
-IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".bmp", ".tiff", ".tif", ".pdf"}
-
 # Execution guardrails
 EXEC_TIMEOUT = int(os.getenv("EXEC_TIMEOUT_SECONDS", "30"))
 
+# Output capture bounds: keep the first HEAD and last TAIL bytes of each stream in
+# memory; the complete stream always goes to stdout.log / stderr.log in the run dir
+MAX_OUTPUT_HEAD_BYTES = int(os.getenv("MAX_OUTPUT_HEAD_BYTES", str(64 * 1024)))
+MAX_OUTPUT_TAIL_BYTES = int(os.getenv("MAX_OUTPUT_TAIL_BYTES", str(16 * 1024)))
+
 # Toggle autosave of Matplotlib figures at process exit (default on for LM Studio UX)
 AUTO_SAVE_MPL = os.getenv("AUTO_SAVE_MPL", "1") not in {"0", "false", "False"}
 
+# Written by the child's timing markers at exit, read back (and removed) by the server
+TIMINGS_FILE = ".sandbox_timings.json"
+
+# Profiling mode (profile=True): rows kept in the summary, and where the child puts its output.
+# PROFILE_FILE is a regular run artifact (open it with pstats / snakeviz); the summary is internal.
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+PROFILE_FILE = "profile.prof"
+PROFILE_SUMMARY_FILE = ".sandbox_profile.json"
+
 
 def _guess_mime(path: Path) -> str:
-    import mimetypes
-    ctype, _ = mimetypes.guess_type(path.as_posix())
-    return ctype or "application/octet-stream"
+    return artifacts.guess_mime(path)
 
 
 def _new_run_dir() -> Path:
@@ -42,29 +64,174 @@ def _new_run_dir() -> Path:
 
 def _list_new_images(run_dir: Path) -> List[Dict[str, str]]:
     """
-    Recursively list image-like files created within run_dir.
+    Cheap listing of image-like files in run_dir (one scandir pass, no hashing),
+    within the MAX_IMAGE_COUNT / MAX_IMAGE_BYTES limits. Used while a run is
+    still going; finished runs use artifacts.build_manifest().
     Return paths relative to TEMP_DIR so /files/<relpath> works.
     """
+    prefix = run_dir.relative_to(TEMP_DIR).as_posix()
     out: List[Dict[str, str]] = []
-    for p in sorted(run_dir.rglob("*")):
-        if not p.is_file():
+    for rel, _path, size, _mtime in artifacts.scan(run_dir):
+        if Path(rel).suffix.lower() not in IMAGE_EXTS or size > MAX_IMAGE_BYTES:
             continue
-        ext = p.suffix.lower()
-        if ext in IMAGE_EXTS:
-            rel = p.relative_to(TEMP_DIR).as_posix()  # e.g. "20250921-.../sine.png"
-            out.append({"filename": rel, "content_type": _guess_mime(p)})
+        if len(out) >= MAX_IMAGE_COUNT:
+            break
+        out.append({"filename": f"{prefix}/{rel}", "content_type": _guess_mime(Path(rel))})
     return out
 
 
-def _wrap_with_mpl_autosave(user_code: str) -> str:
+def _collect_artifacts(run_dir: Path, result: Dict[str, object]) -> None:
+    """Write the run's manifest.json and fill result["images"] / result["manifest"] from it."""
+    t0 = time.perf_counter()
+    manifest = artifacts.build_manifest(run_dir, TEMP_DIR)
+    elapsed = time.perf_counter() - t0
+    metrics.SCAN_SECONDS.observe(elapsed)
+    result.setdefault("timings", {})["artifacts_ms"] = round(elapsed * 1000.0, 1)
+    result["images"] = manifest["images"]
+    result["manifest"] = f"{run_dir.relative_to(TEMP_DIR).as_posix()}/{artifacts.MANIFEST_FILE}"
+    if manifest["skipped"]:
+        result["images_skipped"] = manifest["skipped"]
+
+
+# Phase markers for result["timings"]. The writer is registered before any other
+# atexit hook so it runs last. Import time in user code is not measured here (a
+# wrapped __import__ would slow every import and show up in tracebacks); profiled
+# runs report it as imports_ms from cProfile.
+_TIMING_PRELUDE = r"""
+# --- sandbox timing markers ---
+try:
+    import time as _sbx_time, atexit as _sbx_atexit
+    _sbx_t = {"start": _sbx_time.time()}
+    _sbx_path = __import__("os").path.abspath(%r)
+
+    def _sbx_write_timings():
+        try:
+            _sbx_t.setdefault("user_end", _sbx_time.time())
+            _sbx_t["end"] = _sbx_time.time()
+            with open(_sbx_path, "w") as f:
+                f.write("{" + ", ".join('"%%s": %%r' %% kv for kv in _sbx_t.items()) + "}")
+        except Exception:
+            pass
+
+    _sbx_atexit.register(_sbx_write_timings)
+except Exception:
+    pass
+# --- end timing markers ---
+"""
+
+_TIMING_USER_START = r"""
+# --- sandbox timing markers: user code starts here ---
+try:
+    _sbx_t["user_start"] = _sbx_time.time()
+except Exception:
+    pass
+"""
+
+
+# Profiling mode: the user code is compiled from a string literal as "<sandbox>"
+# (so its lines keep their own numbers and can be told apart from this wrapper,
+# which is "<string>") and exec'd in __main__ under cProfile (and tracemalloc
+# when asked); the summary is written even when the code raises or calls sys.exit().
+_PROFILE_SETUP = r"""
+# --- sandbox profiler ---
+import os as _sbx_os, cProfile as _sbx_cprofile
+_sbx_prof_dir = _sbx_os.path.abspath(".")
+
+def _sbx_where(filename, lineno, name=None):
+    if filename == "~":  # built-in functions
+        return name
+    for marker in ("site-packages/", "dist-packages/", "/lib/python"):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            if marker == "/lib/python":  # "3.11/json/decoder.py"
+                filename = filename.split("/", 1)[-1]
+            break
+    where = f"{filename}:{lineno}"
+    return f"{where}({name})" if name else where
+
+def _sbx_profile_report(prof, memory, top):
+    report = {"top_n": top}
+    if memory:  # snapshot first, before the report itself allocates
+        try:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            snap = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snap = snap.filter_traces((
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<string>"),   # this wrapper; user code is "<sandbox>"
+            ))
+            report["memory"] = {
+                "current_kb": round(current / 1024, 1),
+                "peak_kb": round(peak / 1024, 1),
+                "top": [
+                    {"site": _sbx_where(s.traceback[0].filename, s.traceback[0].lineno),
+                     "size_kb": round(s.size / 1024, 1), "count": s.count}
+                    for s in snap.statistics("lineno")[:top]
+                ],
+            }
+        except Exception as e:
+            report["memory"] = {"error": f"tracemalloc: {e}"}
+    import json, pstats
+    _sbx_wrapper_calls = ("<built-in method builtins.exec>", "<built-in method builtins.compile>")
+    try:
+        prof.dump_stats(_sbx_os.path.join(_sbx_prof_dir, %(prof_file)r))
+        st = pstats.Stats(prof)
+        rows = []
+        for (filename, lineno, name), (cc, nc, tt, ct, _callers) in st.stats.items():
+            # Leave out the wrapper itself: exec/compile of the user code, the profiler, _sbx_* helpers
+            if name.startswith("_sbx_") or "_lsprof.Profiler" in name or name in _sbx_wrapper_calls:
+                continue
+            rows.append({"function": _sbx_where(filename, lineno, name), "ncalls": nc, "primitive_calls": cc,
+                         "tottime_s": round(tt, 6), "cumtime_s": round(ct, 6)})
+        rows.sort(key=lambda r: r["cumtime_s"], reverse=True)
+        report.update(total_calls=st.total_calls, total_time_s=round(st.total_tt, 6), functions=rows[:top])
+        # Import time: cumulative time of importlib's _find_and_load (outermost calls only,
+        # nested imports are part of them), i.e. modules actually loaded by the run
+        report["imports_s"] = round(sum(ct for (filename, _l, name), (_cc, _nc, _tt, ct, _c) in st.stats.items()
+                                        if name == "_find_and_load" and "importlib" in filename), 6)
+    except Exception as e:
+        report["error"] = f"cProfile: {e}"
+    try:
+        with open(_sbx_os.path.join(_sbx_prof_dir, %(summary_file)r), "w") as f:
+            json.dump(report, f)
+    except Exception:
+        pass
+# --- end sandbox profiler ---
+"""
+
+_PROFILE_RUN = r"""
+_sbx_code = compile(%(code)r, "<sandbox>", "exec")
+if %(memory)r:
+    import tracemalloc as _sbx_tracemalloc
+    _sbx_tracemalloc.start()
+_sbx_prof = _sbx_cprofile.Profile()
+_sbx_prof.enable()
+try:
+    exec(_sbx_code)
+finally:
+    _sbx_prof.disable()
+    _sbx_profile_report(_sbx_prof, %(memory)r, %(top)d)
+"""
+
+
+def _wrap_with_mpl_autosave(user_code: str, profile: bool = False, profile_memory: bool = False) -> str:
     """
-    Prepend a small shim that:
+    Prepend the timing markers and a small shim that:
       - Forces a non-interactive backend.
       - Registers an atexit handler to save any open figures as figure_N.png
         if the user didn't explicitly save them.
+    With profile=True the user code runs under cProfile (plus tracemalloc with
+    profile_memory=True), see _PROFILE_SETUP.
     """
+    timing = _TIMING_PRELUDE % TIMINGS_FILE
+    if profile:
+        timing += _PROFILE_SETUP % {"prof_file": PROFILE_FILE, "summary_file": PROFILE_SUMMARY_FILE}
+        user_code = _PROFILE_RUN % {"code": user_code, "memory": bool(profile_memory), "top": PROFILE_TOP_N}
     if not AUTO_SAVE_MPL:
-        return user_code
+        return timing + _TIMING_USER_START + "\n" + user_code
 
     prelude = r"""
 # --- sandbox autosave shim (matplotlib) ---
@@ -81,6 +248,10 @@ try:
         plt = None
 
     def _sandbox_autosave_figs():
+        try:
+            _sbx_t["user_end"] = _sbx_t["autosave_start"] = _sbx_time.time()
+        except Exception:
+            pass
         try:
             if plt is None:
                 return
@@ -99,6 +270,11 @@ try:
                     pass
         except Exception:
             pass
+        finally:
+            try:
+                _sbx_t["autosave_end"] = _sbx_time.time()
+            except Exception:
+                pass
 
     atexit.register(_sandbox_autosave_figs)
 except Exception:
@@ -106,57 +282,420 @@ except Exception:
     pass
 # --- end autosave shim ---
 """
-    return prelude + "\n" + user_code
+    return timing + prelude + _TIMING_USER_START + "\n" + user_code
+
+
+def _ms(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return round(max(0.0, end - start) * 1000.0, 1)
+
+
+def _read_timings(run_dir: Path, spawned: float, exited: float) -> Dict[str, float]:
+    """
+    Turn the child's markers (epoch seconds) into per-phase milliseconds.
+    Phases the child never reached (killed, os._exit) are simply absent.
+    """
+    path = run_dir / TIMINGS_FILE
+    try:
+        marks = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        marks = {}
+    finally:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+    phases = {
+        "spawn_ms": _ms(spawned, marks.get("start")),
+        "prelude_ms": _ms(marks.get("start"), marks.get("user_start")),
+        "user_code_ms": _ms(marks.get("user_start"), marks.get("user_end")),
+        "autosave_ms": _ms(marks.get("autosave_start"), marks.get("autosave_end")),
+        "exit_ms": _ms(marks.get("end"), exited),
+    }
+    if not marks:
+        phases["process_ms"] = _ms(spawned, exited)
+    return {k: v for k, v in phases.items() if v is not None}
+
+
+def _read_profile(run_dir: Path) -> Dict[str, object]:
+    """The child's profile summary plus the relpath of the full .prof file."""
+    path = run_dir / PROFILE_SUMMARY_FILE
+    try:
+        report = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"error": "no profile was written (syntax error, or the run was killed or left via os._exit)"}
+    finally:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+    if (run_dir / PROFILE_FILE).is_file():
+        report["prof_file"] = f"{run_dir.relative_to(TEMP_DIR).as_posix()}/{PROFILE_FILE}"
+    return report
+
+
+# Receives (stream_name, text) as output arrives: stream_name is "stdout" or "stderr"
+OutputCallback = Callable[[str, str], None]
+
+
+class _PipeReader(threading.Thread):
+    """
+    Drain one child pipe in the background so neither stream can block the other.
+
+    Memory use is bounded: only the first MAX_OUTPUT_HEAD_BYTES and the last
+    MAX_OUTPUT_TAIL_BYTES are kept; the full stream is spilled to 'log_path'.
+    """
+
+    def __init__(self, pipe, name: str, on_output: Optional[OutputCallback] = None,
+                 log_path: Optional[Path] = None):
+        super().__init__(daemon=True)
+        self._pipe = pipe
+        self._name = name
+        self._on_output = on_output
+        self._log_path = log_path
+        self._head = bytearray()
+        self._tail: "collections.deque[bytes]" = collections.deque()
+        self._tail_len = 0
+        self.total = 0
+
+    def _keep(self, chunk: bytes) -> None:
+        room = MAX_OUTPUT_HEAD_BYTES - len(self._head)
+        if room > 0:
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        if not chunk or MAX_OUTPUT_TAIL_BYTES <= 0:
+            return
+        self._tail.append(chunk)
+        self._tail_len += len(chunk)
+        # Drop whole chunks from the front while the rest still covers the tail budget
+        while self._tail_len - len(self._tail[0]) >= MAX_OUTPUT_TAIL_BYTES:
+            self._tail_len -= len(self._tail.popleft())
+
+    def run(self):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        log = None
+        try:
+            if self._log_path is not None:
+                try:
+                    log = open(self._log_path, "wb")
+                except OSError:
+                    log = None
+            for chunk in iter(lambda: self._pipe.read1(65536), b""):
+                self.total += len(chunk)
+                self._keep(chunk)
+                if log is not None:
+                    try:
+                        log.write(chunk)
+                    except OSError:
+                        log.close()
+                        log = None
+                if self._on_output is not None:
+                    text = decoder.decode(chunk)
+                    if text:
+                        self._emit(text)
+            if self._on_output is not None:
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    self._emit(tail)
+        except Exception:
+            pass
+        finally:
+            try:
+                self._pipe.close()
+            except Exception:
+                pass
+            if log is not None:
+                log.close()
+            if self._log_path is not None and self.total == 0:
+                try:
+                    self._log_path.unlink()
+                except OSError:
+                    pass
+
+    def _emit(self, text: str) -> None:
+        try:
+            self._on_output(self._name, text)
+        except Exception:
+            # A slow or broken consumer must never stall the child
+            pass
+
+    def _tail_bytes(self) -> bytes:
+        if MAX_OUTPUT_TAIL_BYTES <= 0:
+            return b""
+        return b"".join(self._tail)[-MAX_OUTPUT_TAIL_BYTES:]
+
+    def log_relpath(self) -> Optional[str]:
+        if self._log_path is None or self.total == 0:
+            return None
+        return self._log_path.relative_to(TEMP_DIR).as_posix()
+
+    def truncated_bytes(self) -> int:
+        return self.total - len(self._head) - len(self._tail_bytes())
 
+    def text(self) -> str:
+        tail = self._tail_bytes()
+        dropped = self.total - len(self._head) - len(tail)
+        if dropped <= 0:
+            return (bytes(self._head) + tail).decode("utf-8", errors="replace")
+        # Name the log relative to the run dir so cached results stay valid when re-linked
+        where = self._log_path.name if self.log_relpath() else "the run log"
+        return (
+            bytes(self._head).decode("utf-8", errors="replace")
+            + f"\n...[{dropped} bytes truncated; full {self._name} in {where}]...\n"
+            + tail.decode("utf-8", errors="replace")
+        )
+
+    def info(self) -> Dict[str, object]:
+        """Truncation metadata returned as result["output"][<stream>]."""
+        return {"bytes": self.total, "truncated": self.truncated_bytes() > 0, "log": self.log_relpath()}
+
+
+def _spawn_cold(wrapped: str, run_dir: Path, env: Dict[str, str]) -> subprocess.Popen:
+    """Classic path: a brand-new interpreter per run (RUN_LIMIT_* applied by its first lines)."""
+    return subprocess.Popen(
+        [sys.executable, "-c", rlimits.prelude() + wrapped],
+        cwd=run_dir,            # isolate writes into this unique folder
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,  # own process group, so a timeout kills the whole tree
+    )
+
+
+def _kill_tree(proc) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _wait_child(proc, timeout: Optional[float]) -> bool:
+    """
+    Wait up to 'timeout' seconds (None = forever); True once the child has exited.
+    Cold children are reaped with wait4() so their resource usage is kept in
+    proc.rusage; warm-pool handles receive it from their worker.
+    """
+    if not isinstance(proc, subprocess.Popen):
+        try:
+            proc.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+    if proc.returncode is not None:
+        return True
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            pid, status, ru = os.wait4(proc.pid, os.WNOHANG)
+        except ChildProcessError:
+            proc.wait()
+            return True
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            proc.rusage = rlimits.rusage_dict(ru)
+            return True
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
 
-def execute_python(code: str) -> Dict[str, object]:
+
+def _wait_for_exit(proc, timeout: float, cancel: Optional[threading.Event]) -> str:
+    """
+    Wait for the child; kill it on timeout or when 'cancel' is set.
+    Returns "exited", "timeout" or "cancelled".
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            outcome = "timeout"
+            break
+        if _wait_child(proc, min(remaining, 0.25) if cancel is not None else remaining):
+            return "exited"
+        if cancel is not None and cancel.is_set():
+            outcome = "cancelled"
+            break
+    _kill_tree(proc)
+    _wait_child(proc, None)
+    return outcome
+
+
+def execute_python(
+    code: str,
+    run_dir: Optional[Path] = None,
+    on_output: Optional[OutputCallback] = None,
+    cancel: Optional[threading.Event] = None,
+    use_cache: bool = True,
+    timeout: Optional[float] = None,
+    profile: bool = False,
+    profile_memory: bool = False,
+) -> Dict[str, object]:
     """
     Run 'code' in a sandboxed subprocess with a fresh per-run CWD = <TEMP_DIR>/<run_id>.
+    When WARM_POOL_SIZE > 0 the subprocess is forked from a pre-warmed worker
+    (see warm_pool.py); otherwise a cold `python -c` is started.
     Collects any image-like files created during execution (recursively).
+
+    run_dir   : use an already created run directory (e.g. one handed out by the job API)
+    on_output : called with ("stdout"|"stderr", text) while the child is still running
+    cancel    : set this event to kill the run early (reported as returncode 130)
+    use_cache : consult the result cache when it is enabled (RESULT_CACHE_ENABLED);
+                a hit re-links the cached artifacts and sets "cached": True
+    timeout   : per-run limit in seconds (capped at EXEC_TIMEOUT; default EXEC_TIMEOUT)
+    profile   : run the code under cProfile (never served from the cache); adds "profile"
+                and saves <run_id>/profile.prof. profile_memory also runs tracemalloc.
+    The child also runs under the RUN_LIMIT_* resource limits (see rlimits.py).
     Returns:
       {
+        "run_id": str,
         "stdout": str,
         "stderr": str,
         "returncode": int,
-        "images": [ { "filename": str, "content_type": str }, ... ]
+        "images": [ { "filename": str, "content_type": str, "size": int, "sha256": str,
+                      "width"?: int, "height"?: int }, ... ],
+        "images_skipped"?: [ { "filename": str, "size": int, "note": str }, ... ],
+        "manifest": relpath of manifest.json,
+        "output": { "stdout"|"stderr": { "bytes": int, "truncated": bool, "log": relpath|None } },
+        "rusage": { "user_s", "sys_s", "max_rss_mb", "inblock", "oublock" },
+        "timings": { "spawn_ms", "prelude_ms", "user_code_ms", "autosave_ms", "exit_ms",
+                     "artifacts_ms", "total_ms", "imports_ms"? },  # phases that ran, in ms;
+                                                                  # imports_ms with profile only
+        "profile"?: { "functions": [ { "function", "ncalls", "primitive_calls", "tottime_s",
+                                       "cumtime_s" }, ... ],   # top PROFILE_TOP_N by cumulative time
+                      "total_calls", "total_time_s", "imports_s", "top_n", "prof_file": relpath,
+                      "memory"?: { "current_kb", "peak_kb", "top": [ { "site", "size_kb", "count" } ] } }
       }
+    stdout/stderr are bounded (head + tail); the full streams are in <run_id>/stdout.log
+    and <run_id>/stderr.log.
     """
-    run_dir = _new_run_dir()
+    run_dir = run_dir or _new_run_dir()
+    limit = EXEC_TIMEOUT if timeout is None else max(0.1, min(float(timeout), EXEC_TIMEOUT))
+    started = time.perf_counter()
+    profile = profile or profile_memory
+    with metrics.in_flight():
+        return _execute(code, run_dir, on_output, cancel, use_cache and not profile, limit, started,
+                        profile, profile_memory)
+
+
+def _execute(
+    code: str,
+    run_dir: Path,
+    on_output: Optional[OutputCallback],
+    cancel: Optional[threading.Event],
+    use_cache: bool,
+    limit: float,
+    started: float,
+    profile: bool = False,
+    profile_memory: bool = False,
+) -> Dict[str, object]:
+
+    cache_key = None
+    if result_cache.enabled():
+        if not use_cache:
+            result_cache.note_bypass()
+        else:
+            cache_key = result_cache.key_for(code)
+            # the key ignores the limit: a shorter one needs a recorded run that fits
+            hit = result_cache.lookup(cache_key, run_dir, max_run_s=limit if limit < EXEC_TIMEOUT else None)
+            if hit is not None:
+                if on_output is not None:
+                    for stream in ("stdout", "stderr"):
+                        if hit[stream]:
+                            on_output(stream, hit[stream])
+                output = hit.pop("output", None)
+                if output:
+                    for info in output.values():
+                        if info.get("log"):
+                            info["log"] = f"{run_dir.name}/{info['log']}"
+                    hit["output"] = output
+                result = {"run_id": run_dir.name, **hit, "cached": True}
+                _collect_artifacts(run_dir, result)
+                elapsed = time.perf_counter() - started
+                result["timings"]["total_ms"] = round(elapsed * 1000.0, 1)
+                metrics.record_run("cached", int(result["returncode"]), elapsed)
+                return result
 
     # Prepare environment (force non-interactive MPL backend)
     env = os.environ.copy()
     env.setdefault("MPLBACKEND", "Agg")
+    # Unbuffered child output so streaming consumers see lines as they are printed
+    env.setdefault("PYTHONUNBUFFERED", "1")
 
     # Inject autosave shim so figures are persisted even if user forgets to savefig()
-    wrapped = _wrap_with_mpl_autosave(code)
-
-    cmd = [sys.executable, "-c", wrapped]
+    wrapped = _wrap_with_mpl_autosave(code, profile=profile, profile_memory=profile_memory)
 
+    mode = "error"
+    timings: Dict[str, float] = {}
+    ran_s: Optional[float] = None
     try:
-        proc = subprocess.run(
-            cmd,
-            cwd=run_dir,            # isolate writes into this unique folder
-            env=env,
-            capture_output=True,
-            text=True,
-            timeout=EXEC_TIMEOUT,
-        )
-        stdout = proc.stdout
-        stderr = proc.stderr
-        returncode = proc.returncode
-    except subprocess.TimeoutExpired as e:
-        stdout = e.stdout or ""
-        stderr = (e.stderr or "") + f"\n[timeout] Execution exceeded {EXEC_TIMEOUT}s"
-        returncode = 124
+        t0 = time.perf_counter()
+        spawned = time.time()
+        proc = warm_pool.spawn(wrapped, run_dir, env)
+        mode = "warm" if proc is not None else "cold"
+        proc = proc or _spawn_cold(wrapped, run_dir, env)
+        metrics.SPAWN_SECONDS.observe(time.perf_counter() - t0, mode=mode)
+        try:
+            readers = [
+                _PipeReader(proc.stdout, "stdout", on_output, log_path=run_dir / "stdout.log"),
+                _PipeReader(proc.stderr, "stderr", on_output, log_path=run_dir / "stderr.log"),
+            ]
+            for r in readers:
+                r.start()
+            outcome = _wait_for_exit(proc, limit, cancel)
+            exited = time.time()
+            ran_s = exited - spawned
+            timings = _read_timings(run_dir, spawned, exited)
+            returncode = proc.returncode
+            for r in readers:
+                r.join(timeout=5)
+            stdout, stderr = readers[0].text(), readers[1].text()
+            output = {"stdout": readers[0].info(), "stderr": readers[1].info()}
+            rusage = getattr(proc, "rusage", None)
+            stderr += rlimits.limit_note(returncode, rusage)
+            if outcome == "timeout":
+                stderr += f"\n[timeout] Execution exceeded {limit:g}s"
+                returncode = 124
+            elif outcome == "cancelled":
+                stderr += "\n[cancelled] Execution was cancelled"
+                returncode = 130
+        finally:
+            # anything raising above must not leave the child running (or a warm worker busy)
+            if proc.returncode is None:
+                _kill_tree(proc)
+                _wait_child(proc, None)
     except Exception as e:
         stdout, stderr, returncode = "", f"[runner error] {e}", 1
+        output = None
+        rusage = None
+        mode = "error"
+        metrics.RUNNER_ERRORS.inc()
 
-    images = _list_new_images(run_dir)
-
-    return {
+    result = {
+        "run_id": run_dir.name,
         "stdout": stdout,
         "stderr": stderr,
         "returncode": returncode,
-        "images": images,
+        "timings": timings,
     }
-
+    if profile:
+        result["profile"] = _read_profile(run_dir)
+        if "imports_s" in result["profile"]:
+            timings["imports_ms"] = round(float(result["profile"]["imports_s"]) * 1000.0, 1)
+    _collect_artifacts(run_dir, result)
+    if output is not None:
+        result["output"] = output
+    if rusage:
+        result["rusage"] = rusage
+    if cache_key is not None:
+        result_cache.store(cache_key, run_dir, result, exclude=(artifacts.MANIFEST_FILE,), run_s=ran_s)
+    elapsed = time.perf_counter() - started
+    timings["total_ms"] = round(elapsed * 1000.0, 1)
+    metrics.record_run(mode, returncode, elapsed)
+    return result
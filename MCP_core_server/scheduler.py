@@ -0,0 +1,117 @@
+# scheduler.py
+"""
+Bounded admission control in front of sandbox_core.execute_python.
+
+At most MAX_CONCURRENT_RUNS executions run at once; up to MAX_QUEUED_RUNS
+more wait for a slot. Anything beyond that is rejected immediately with
+QueueFull so the caller can shed load (HTTP 429 + Retry-After) instead of
+letting a burst slow every run down at once.
+"""
+from __future__ import annotations
+
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", str(os.cpu_count() or 2)))
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "16"))
+# Longest a request may wait for a slot before it is turned away
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "60"))
+
+
+class QueueFull(Exception):
+    """Raised when a run cannot be admitted (queue full or queue wait timed out)."""
+
+    def __init__(self, message: str, retry_after: int, timed_out: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.timed_out = timed_out
+
+
+class ExecutionScheduler:
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.last_wait_ms = 0.0
+        # Exponential moving average of run duration, used for Retry-After hints
+        self._avg_run_s = 5.0
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up for a newcomer."""
+        backlog = self.queued + 1
+        return max(1, math.ceil(self._avg_run_s * backlog / self.max_concurrent))
+
+    def check_admission(self) -> None:
+        """
+        Fail fast with QueueFull if a new run would be rejected right now.
+        Used by entry points that must answer before the run starts (jobs, streaming).
+        """
+        with self._cond:
+            if self.running >= self.max_concurrent and self.queued >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull("Execution queue is full", self.retry_after())
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """Hold one execution slot; yields the time spent queued (ms)."""
+        t0 = time.perf_counter()
+        with self._cond:
+            if self.running >= self.max_concurrent:
+                if self.queued >= self.max_queued:
+                    self.rejected += 1
+                    raise QueueFull("Execution queue is full", self.retry_after())
+                self.queued += 1
+                try:
+                    ok = self._cond.wait_for(lambda: self.running < self.max_concurrent, timeout=self.queue_timeout)
+                finally:
+                    self.queued -= 1
+                if not ok:
+                    self.timed_out += 1
+                    raise QueueFull("Timed out waiting for an execution slot", self.retry_after(), timed_out=True)
+            self.running += 1
+            self.admitted += 1
+            wait_ms = (time.perf_counter() - t0) * 1000.0
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            self.last_wait_ms = wait_ms
+        t_run = time.perf_counter()
+        try:
+            yield wait_ms
+        finally:
+            elapsed = time.perf_counter() - t_run
+            with self._cond:
+                self.running -= 1
+                self._avg_run_s = 0.8 * self._avg_run_s + 0.2 * elapsed
+                self._cond.notify()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "running": self.running,
+                "queued": self.queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "queue_timeouts": self.timed_out,
+                "wait_ms_avg": round(self.wait_ms_total / self.admitted, 1) if self.admitted else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 1),
+                "wait_ms_last": round(self.last_wait_ms, 1),
+                "avg_run_s": round(self._avg_run_s, 3),
+            }
+
+
+# Process-wide scheduler shared by the REST and MCP entry points
+SCHEDULER = ExecutionScheduler(MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS, QUEUE_TIMEOUT)
@@ -0,0 +1,426 @@
+# sessions.py
+"""
+Stateful sandbox sessions.
+
+A session is a long-lived interpreter process that keeps its globals, its
+working directory (<TEMP_DIR>/session-<id>) and anything it loaded between
+calls, so multi-step analyses don't reload data and re-import the stack on
+every turn. Calls to the same session are serialized.
+
+Per call the parent hands the session fresh stdout/stderr pipes (passed as
+file descriptors, like warm_pool does), so output is captured and streamed
+exactly as for one-shot runs. Artifacts reported for a call are the image
+files created or modified during that call (listed in manifest_<call>.json).
+
+Lifecycle:
+  - idle sessions are closed after SESSION_IDLE_SECONDS
+  - at most SESSION_MAX_COUNT sessions live at once (least recently used goes)
+  - a session whose RSS exceeds SESSION_MAX_MEMORY_MB after a call is reset
+  - a call that exceeds EXEC_TIMEOUT is interrupted (KeyboardInterrupt, state
+    kept); if it does not stop within a grace period the session is killed
+  - reset() drops a session explicitly
+"""
+from __future__ import annotations
+
+import os
+import re
+import sys
+import time
+import signal
+import socket
+import subprocess
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import artifacts
+import metrics
+import rlimits
+from sandbox_core import (
+    EXEC_TIMEOUT,
+    TEMP_DIR,
+    OutputCallback,
+    _PipeReader,
+    _kill_tree,
+)
+from warm_pool import recv_msg, send_msg
+
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "900"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "8"))
+SESSION_MAX_MEMORY_MB = int(os.getenv("SESSION_MAX_MEMORY_MB", "2048"))
+# Time a timed-out call gets to react to KeyboardInterrupt before the session is killed
+SESSION_INTERRUPT_GRACE_SECONDS = 3.0
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+# -------------------- session process side --------------------
+def _autosave_figures(call_no: int) -> None:
+    """Per-call equivalent of the one-shot autosave shim: save and close open figures."""
+    plt = sys.modules.get("matplotlib.pyplot")
+    if plt is None:
+        return
+    try:
+        for idx, num in enumerate(plt.get_fignums(), 1):
+            try:
+                plt.figure(num).savefig(f"figure_{call_no}_{idx}.png", bbox_inches="tight")
+            except Exception:
+                pass
+        plt.close("all")
+    except Exception:
+        pass
+
+
+def _serve(fd: int) -> None:
+    """Session main loop: one persistent __main__ namespace, one call at a time."""
+    import builtins
+    import traceback
+    import types
+
+    from warm_pool import _exit_code
+
+    sock = socket.socket(fileno=fd)
+    main = types.ModuleType("__main__")
+    main.__dict__["__builtins__"] = builtins
+    sys.modules["__main__"] = main
+    sys.argv = ["-c"]
+    sys.path[0] = ""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+    except Exception:
+        pass
+    send_msg(sock, {"ready": True, "pid": os.getpid()})
+
+    while True:
+        try:
+            req, fds = recv_msg(sock, maxfds=2)
+        except (EOFError, OSError):
+            break
+        saved = (os.dup(1), os.dup(2))
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for f in fds:
+            os.close(f)
+        usage_before = rlimits.self_usage()
+        t0 = time.perf_counter()
+        try:
+            exec(compile(req["code"], "<string>", "exec"), main.__dict__)
+            rc = 0
+        except SystemExit as e:
+            rc = _exit_code(e.code)
+        except BaseException as e:
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+            rc = 1
+        t1 = time.perf_counter()
+        _autosave_figures(int(req.get("call", 0)))
+        t2 = time.perf_counter()
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+        send_msg(sock, {
+            "returncode": rc,
+            "rusage": rlimits.usage_delta(usage_before, rlimits.self_usage()),
+            "timings": {"user_code_ms": round((t1 - t0) * 1000.0, 1), "autosave_ms": round((t2 - t1) * 1000.0, 1)},
+        })
+
+
+# -------------------- parent side --------------------
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.dir = TEMP_DIR / f"session-{session_id}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.created = time.time()
+        self.last_used = self.created
+        self.calls = 0
+        self.closed = False
+        self._last_usage: Optional[Dict[str, float]] = None
+        self._last_timings: Dict[str, float] = {}
+
+        env = os.environ.copy()
+        env.setdefault("MPLBACKEND", "Agg")
+        env["PYTHONUNBUFFERED"] = "1"
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock = parent_sock
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, "-c",
+                 # CPU seconds would accumulate over the session's lifetime, so only the other limits apply
+                 f"import sys; sys.path.insert(0, {str(Path(__file__).resolve().parent)!r}); "
+                 f"import rlimits; rlimits.apply(cpu=False); "
+                 f"import sessions; sessions._serve({child_sock.fileno()})"],
+                cwd=self.dir,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),),
+                start_new_session=True,
+            )
+        finally:
+            child_sock.close()
+        self.sock.settimeout(60)
+        try:
+            recv_msg(self.sock)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            self.sock.settimeout(None)
+
+    def rss_mb(self) -> float:
+        try:
+            with open(f"/proc/{self.proc.pid}/status", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024.0
+        except OSError:
+            pass
+        return 0.0
+
+    def _await_reply(self, timeout: float) -> Optional[int]:
+        self.sock.settimeout(timeout)
+        try:
+            msg, _ = recv_msg(self.sock)
+            self._last_usage = msg.get("rusage")
+            self._last_timings = msg.get("timings") or {}
+            return int(msg["returncode"])
+        except socket.timeout:
+            return None
+        finally:
+            try:
+                self.sock.settimeout(None)
+            except OSError:
+                pass
+
+    def run(self, code: str, on_output: Optional[OutputCallback] = None) -> Dict[str, object]:
+        """Execute one call; the caller holds self.lock."""
+        self.calls += 1
+        started = time.time()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            send_msg(self.sock, {"code": code, "call": self.calls}, fds=(out_w, err_w))
+        except OSError:
+            os.close(out_r)
+            os.close(err_r)
+            self.close()
+            return {
+                "run_id": self.dir.name,
+                "session_id": self.id,
+                "stdout": "",
+                "stderr": "[session] interpreter died before the call; session was reset",
+                "returncode": 1,
+                "images": [],
+            }
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        readers = [
+            _PipeReader(os.fdopen(out_r, "rb"), "stdout", on_output, log_path=self.dir / f"stdout_{self.calls}.log"),
+            _PipeReader(os.fdopen(err_r, "rb"), "stderr", on_output, log_path=self.dir / f"stderr_{self.calls}.log"),
+        ]
+        for r in readers:
+            r.start()
+
+        note = ""
+        self._last_usage = None
+        self._last_timings = {}
+        try:
+            returncode = self._await_reply(EXEC_TIMEOUT)
+            if returncode is None:
+                # Interrupt the call but try to keep the session's state
+                os.kill(self.proc.pid, signal.SIGINT)
+                returncode = self._await_reply(SESSION_INTERRUPT_GRACE_SECONDS)
+                if returncode is None:
+                    self.close()
+                    note = f"\n[timeout] Execution exceeded {EXEC_TIMEOUT}s; session was reset"
+                else:
+                    note = f"\n[timeout] Execution exceeded {EXEC_TIMEOUT}s; call interrupted, session state kept"
+                returncode = 124
+        except (OSError, EOFError, ValueError, KeyError):
+            self.close()
+            returncode = 1
+            note = "\n[session] interpreter died; session was reset"
+
+        for r in readers:
+            r.join(timeout=5)
+        self.last_used = time.time()
+
+        if not self.closed and SESSION_MAX_MEMORY_MB > 0:
+            rss = self.rss_mb()
+            if rss > SESSION_MAX_MEMORY_MB:
+                self.close()
+                note += f"\n[session] memory cap exceeded ({rss:.0f} MB > {SESSION_MAX_MEMORY_MB} MB); session was reset"
+
+        # Only report artifacts written during this call
+        manifest_name = f"manifest_{self.calls}.json"
+        t0 = time.perf_counter()
+        manifest = artifacts.build_manifest(self.dir, TEMP_DIR, since=started, manifest_name=manifest_name)
+        artifacts_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+
+        result = {
+            "run_id": self.dir.name,
+            "session_id": self.id,
+            "stdout": readers[0].text(),
+            "stderr": readers[1].text() + note,
+            "returncode": returncode,
+            "images": manifest["images"],
+            "manifest": f"{self.dir.name}/{manifest_name}",
+            "output": {"stdout": readers[0].info(), "stderr": readers[1].info()},
+        }
+        if manifest["skipped"]:
+            result["images_skipped"] = manifest["skipped"]
+        if self._last_usage:
+            result["rusage"] = self._last_usage
+        result["timings"] = {
+            **self._last_timings,
+            "artifacts_ms": artifacts_ms,
+            "total_ms": round((time.time() - started) * 1000.0, 1),
+        }
+        return result
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        _kill_tree(self.proc)
+        try:
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+    def info(self) -> Dict[str, object]:
+        return {
+            "session_id": self.id,
+            "run_id": self.dir.name,
+            "created": self.created,
+            "last_used": self.last_used,
+            "calls": self.calls,
+            "rss_mb": round(self.rss_mb(), 1),
+            "busy": self.lock.locked(),
+        }
+
+
+_SESSIONS: Dict[str, Session] = {}
+_CREATING: Dict[str, threading.Event] = {}   # ids whose interpreter is starting (set when done)
+_SESSIONS_LOCK = threading.Lock()
+_reaper_started = False
+
+
+def _reap_idle() -> None:
+    while True:
+        time.sleep(30)
+        cutoff = time.time() - SESSION_IDLE_SECONDS
+        with _SESSIONS_LOCK:
+            idle = [s for s in _SESSIONS.values() if s.last_used < cutoff and not s.lock.locked()]
+            for s in idle:
+                _SESSIONS.pop(s.id, None)
+        for s in idle:
+            s.close()
+
+
+def _get_or_create(session_id: str) -> Session:
+    """
+    The live session for 'session_id', starting one if needed. The slot is
+    reserved under _SESSIONS_LOCK but the interpreter is started outside it
+    (spawn, imports and the handshake take seconds); concurrent callers for
+    the same id wait for that start instead of spawning a second one.
+    """
+    global _reaper_started
+    while True:
+        evicted: List[Session] = []
+        with _SESSIONS_LOCK:
+            if not _reaper_started:
+                threading.Thread(target=_reap_idle, name="session-reaper", daemon=True).start()
+                _reaper_started = True
+            sess = _SESSIONS.get(session_id)
+            if sess is not None and not sess.closed:
+                return sess
+            starting = _CREATING.get(session_id)
+            if starting is None:
+                while len(_SESSIONS) + len(_CREATING) >= SESSION_MAX_COUNT:
+                    idle = [s for s in _SESSIONS.values() if not s.lock.locked()]
+                    if not idle:
+                        raise RuntimeError(f"All {SESSION_MAX_COUNT} sessions are busy")
+                    lru = min(idle, key=lambda s: s.last_used)
+                    evicted.append(_SESSIONS.pop(lru.id))
+                _CREATING[session_id] = threading.Event()
+        if starting is not None:
+            starting.wait()
+            continue  # published (or failed to start): look again
+        break
+
+    for s in evicted:
+        s.close()
+    try:
+        sess = Session(session_id)
+    except BaseException:
+        with _SESSIONS_LOCK:
+            _CREATING.pop(session_id).set()
+        raise
+    with _SESSIONS_LOCK:
+        _SESSIONS[session_id] = sess
+        _CREATING.pop(session_id).set()
+    return sess
+
+
+def execute_in_session(session_id: str, code: str, on_output: Optional[OutputCallback] = None) -> Dict[str, object]:
+    """
+    Run 'code' inside the session's persistent interpreter (created on first use).
+    Returns the execute_python payload plus "session_id".
+    Raises ValueError for a malformed session id.
+    """
+    if not _ID_RE.match(session_id or ""):
+        raise ValueError("session_id must be 1-64 characters of [A-Za-z0-9_.-]")
+    while True:
+        sess = _get_or_create(session_id)
+        with sess.lock:
+            if sess.closed:  # reset or evicted while we were waiting
+                continue
+            started = time.perf_counter()
+            with metrics.in_flight():
+                result = sess.run(code, on_output=on_output)
+            metrics.record_run("session", int(result["returncode"]), time.perf_counter() - started)
+        break
+    if sess.closed:
+        with _SESSIONS_LOCK:
+            if _SESSIONS.get(session_id) is sess:
+                _SESSIONS.pop(session_id, None)
+    return result
+
+
+def reset(session_id: str) -> bool:
+    """Drop a session's interpreter state; its working directory is left in place."""
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.pop(session_id, None)
+    if sess is None:
+        return False
+    sess.close()
+    return True
+
+
+def list_sessions() -> List[Dict[str, object]]:
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.values())
+    return [s.info() for s in sessions]
+
+
+def shutdown() -> None:
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    for s in sessions:
+        s.close()
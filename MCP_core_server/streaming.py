@@ -0,0 +1,160 @@
+# streaming.py
+"""
+Server-Sent Events for live sandbox runs.
+
+stream_execution() starts execute_python on a background thread and turns its
+output into an SSE event stream:
+
+  event: start     data: {"run_id": ...}
+  event: stdout    data: {"text": "<one line>"}
+  event: stderr    data: {"text": "<one line>"}
+  event: artifact  data: {"filename": ..., "content_type": ...}
+  event: result    data: <same payload as /execute>
+
+Output is line-buffered; a partial line is flushed once the child has been
+quiet for a moment (prompts, progress without newline). Live output per stream
+is capped at STREAM_MAX_OUTPUT_BYTES. If the consumer goes
+away, the run is cancelled so broken runs can be aborted early.
+"""
+from __future__ import annotations
+
+import os
+import json
+import queue
+import threading
+from typing import Dict, Iterator, Optional, Set
+
+import metrics
+from sandbox_core import _list_new_images, _new_run_dir, execute_python
+from scheduler import SCHEDULER, QueueFull
+
+# How often the run directory is checked for new artifacts
+STREAM_ARTIFACT_POLL_SECONDS = float(os.getenv("STREAM_ARTIFACT_POLL_SECONDS", "0.5"))
+# Idle time after which a partial (unterminated) line is flushed
+STREAM_PARTIAL_FLUSH_SECONDS = 0.3
+# SSE comment sent when nothing happened for a while (keeps proxies and disconnect detection alive)
+STREAM_KEEPALIVE_SECONDS = 10.0
+# Live output forwarded per stream; past this the client gets one notice and the
+# final result (head + tail, link to the full log) instead of every line
+STREAM_MAX_OUTPUT_BYTES = int(os.getenv("STREAM_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+
+_DONE = object()
+
+
+def sse(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _watch_artifacts(run_dir, events: "queue.Queue", stop: threading.Event) -> None:
+    """Emit an artifact event once a new file has a stable size across two polls."""
+    announced: Set[str] = set()
+    sizes: Dict[str, int] = {}
+    while not stop.wait(STREAM_ARTIFACT_POLL_SECONDS):
+        try:
+            for rec in _list_new_images(run_dir):
+                name = rec["filename"]
+                if name in announced:
+                    continue
+                try:
+                    size = (run_dir.parent / name).stat().st_size
+                except OSError:
+                    continue
+                if sizes.get(name) == size and size > 0:
+                    announced.add(name)
+                    events.put(("artifact", rec))
+                sizes[name] = size
+        except Exception:
+            pass
+
+
+def stream_execution(code: str, use_cache: bool = True, profile: bool = False,
+                     profile_memory: bool = False) -> Iterator[str]:
+    """
+    Yield SSE frames for one run. Admission is checked by the caller
+    (SCHEDULER.check_admission) so it can still answer 429 before streaming starts.
+    """
+    run_dir = _new_run_dir()
+    events: "queue.Queue" = queue.Queue()
+    cancel = threading.Event()
+    stop_watch = threading.Event()
+    holder: Dict[str, object] = {}
+
+    forwarded = {"stdout": 0, "stderr": 0}
+
+    def on_output(stream: str, text: str) -> None:
+        used = forwarded[stream]
+        if used > STREAM_MAX_OUTPUT_BYTES:
+            return
+        if used + len(text) > STREAM_MAX_OUTPUT_BYTES:
+            text = text[:STREAM_MAX_OUTPUT_BYTES - used] + f"\n...[live {stream} truncated; full stream in {stream}.log]...\n"
+            forwarded[stream] = STREAM_MAX_OUTPUT_BYTES + 1
+        else:
+            forwarded[stream] = used + len(text)
+        events.put((stream, text))
+
+    def worker() -> None:
+        try:
+            with SCHEDULER.slot():
+                holder["result"] = execute_python(code, run_dir=run_dir, on_output=on_output, cancel=cancel,
+                                                  use_cache=use_cache, profile=profile,
+                                                  profile_memory=profile_memory)
+        except QueueFull as e:
+            holder["error"] = {"detail": str(e), "retry_after": e.retry_after}
+        except Exception as e:
+            metrics.RUNNER_ERRORS.inc()
+            holder["error"] = {"detail": f"[runner error] {e}"}
+        finally:
+            stop_watch.set()
+            events.put(_DONE)
+
+    threading.Thread(target=worker, name=f"stream-{run_dir.name}", daemon=True).start()
+    threading.Thread(target=_watch_artifacts, args=(run_dir, events, stop_watch), daemon=True).start()
+
+    partial = {"stdout": "", "stderr": ""}
+    announced: Set[str] = set()
+    idle = 0.0
+    try:
+        yield sse("start", {"run_id": run_dir.name})
+        while True:
+            try:
+                item = events.get(timeout=STREAM_PARTIAL_FLUSH_SECONDS)
+                idle = 0.0
+            except queue.Empty:
+                idle += STREAM_PARTIAL_FLUSH_SECONDS
+                for stream, buf in partial.items():
+                    if buf:
+                        partial[stream] = ""
+                        yield sse(stream, {"text": buf})
+                if idle >= STREAM_KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+                continue
+            if item is _DONE:
+                break
+            kind, payload = item
+            if kind == "artifact":
+                announced.add(payload["filename"])
+                yield sse("artifact", payload)
+                continue
+            buf = partial[kind] + payload
+            lines = buf.split("\n")
+            partial[kind] = lines.pop()
+            for line in lines:
+                yield sse(kind, {"text": line + "\n"})
+
+        for stream, buf in partial.items():
+            if buf:
+                yield sse(stream, {"text": buf})
+        result: Optional[Dict[str, object]] = holder.get("result")  # type: ignore[assignment]
+        if result is None:
+            yield sse("error", holder.get("error") or {"detail": "no result"})
+            return
+        # Artifacts written at exit (e.g. autosaved figures) that the watcher did not see yet
+        for rec in result.get("images") or []:
+            if rec["filename"] not in announced:
+                yield sse("artifact", rec)
+        yield sse("result", result)
+    finally:
+        # Consumer disconnected (or finished): make sure the child does not outlive the stream
+        cancel.set()
+        stop_watch.set()
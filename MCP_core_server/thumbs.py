@@ -0,0 +1,144 @@
+# thumbs.py
+"""
+On-demand image derivatives (thumbnails / format conversion) for /thumb.
+
+A derivative is identified by sha256(source content + width + format +
+quality) and stored once under THUMB_CACHE_DIR, so the same figure is
+resized at most once no matter how many previews ask for it. The cache is
+trimmed to THUMB_CACHE_MAX_BYTES (least recently used first).
+
+Requires Pillow (installed with matplotlib); without it, or for formats
+Pillow cannot rasterize (SVG, PDF), callers fall back to the original file.
+"""
+from __future__ import annotations
+
+import os
+import io
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+from file_server import trim_lru
+
+THUMB_CACHE_DIR = Path(os.getenv(
+    "THUMB_CACHE_DIR",
+    str(Path(os.getenv("SANDBOX_TEMP_DIR", "/app/temp")).resolve().parent / "cache" / "thumbs"),
+)).resolve()
+THUMB_CACHE_MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+THUMB_MAX_WIDTH = 2048
+
+FORMATS = {"webp": "image/webp", "png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg"}
+_RASTER_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tiff", ".tif"}
+
+_lock = threading.Lock()
+_source_hashes: Dict[Tuple[str, int, int], str] = {}
+_stats = {"hits": 0, "renders": 0, "fallbacks": 0, "evictions": 0}
+_writes_since_trim = 0
+
+
+def available() -> bool:
+    try:
+        import PIL  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def supports(path: Path) -> bool:
+    return path.suffix.lower() in _RASTER_EXTS and available()
+
+
+def _source_hash(path: Path) -> str:
+    """Content hash of the source, memoized per (path, size, mtime)."""
+    st = path.stat()
+    memo_key = (str(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        cached = _source_hashes.get(memo_key)
+    if cached:
+        return cached
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        if len(_source_hashes) > 4096:
+            _source_hashes.clear()
+        _source_hashes[memo_key] = digest
+    return digest
+
+
+def _render(src: Path, width: int, fmt: str, quality: int) -> bytes:
+    from PIL import Image
+
+    with Image.open(src) as im:
+        im.seek(0)  # first frame of animated GIF/WebP
+        if im.width > width:
+            height = max(1, round(im.height * width / im.width))
+            im = im.resize((width, height), Image.LANCZOS)
+        if fmt in ("jpeg", "jpg") and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        elif im.mode == "P":
+            im = im.convert("RGBA")
+        buf = io.BytesIO()
+        save_fmt = "JPEG" if fmt in ("jpeg", "jpg") else fmt.upper()
+        if save_fmt == "PNG":
+            im.save(buf, format=save_fmt, optimize=True)
+        else:
+            im.save(buf, format=save_fmt, quality=quality)
+        return buf.getvalue()
+
+
+def derivative(src: Path, width: int, fmt: str, quality: int = 80) -> Tuple[Path, str, str]:
+    """
+    Resized/recompressed version of 'src' (never upscaled).
+    Returns (cached file, content type, key); the key doubles as a strong ETag.
+    Raises ValueError for unsupported parameters.
+    """
+    global _writes_since_trim
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt must be one of {', '.join(sorted(FORMATS))}")
+    width = max(16, min(int(width), THUMB_MAX_WIDTH))
+    quality = max(1, min(int(quality), 100))
+
+    key = hashlib.sha256(f"{_source_hash(src)}:{width}:{fmt}:{quality}".encode()).hexdigest()
+    out = THUMB_CACHE_DIR / f"{key}.{fmt}"
+    if out.is_file():
+        try:
+            os.utime(out)  # LRU bookkeeping
+        except OSError:
+            pass
+        with _lock:
+            _stats["hits"] += 1
+        return out, FORMATS[fmt], key
+
+    data = _render(src, width, fmt, quality)
+    THUMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = THUMB_CACHE_DIR / f".tmp-{key}-{threading.get_ident()}"
+    tmp.write_bytes(data)
+    os.replace(tmp, out)
+    with _lock:
+        _stats["renders"] += 1
+        _writes_since_trim += 1
+        trim = _writes_since_trim >= 50
+        if trim:
+            _writes_since_trim = 0
+    if trim:
+        removed = trim_lru(THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES)
+        with _lock:
+            _stats["evictions"] += removed
+    return out, FORMATS[fmt], key
+
+
+def note_fallback() -> None:
+    with _lock:
+        _stats["fallbacks"] += 1
+
+
+def stats() -> Dict[str, object]:
+    with _lock:
+        out: Dict[str, object] = dict(_stats)
+    out["available"] = available()
+    return out
@@ -0,0 +1,432 @@
+# warm_pool.py
+"""
+Pre-warmed fork-server pool for sandbox_core.execute_python.
+
+Each worker is a long-lived interpreter that has already imported a
+configurable set of modules (numpy, pandas, matplotlib with the Agg backend,
+...). A run is executed in a *fresh forked child* of a worker, so every run
+still gets its own process and its own run directory; only interpreter
+startup and the heavy imports are paid ahead of time.
+
+Control protocol (parent <-> worker) runs over a Unix socketpair using
+length-prefixed JSON frames. The child's stdin/stdout/stderr pipes are passed
+to the worker as file descriptors (SCM_RIGHTS), so the caller reads the
+child's output exactly like it would from a subprocess.Popen.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import queue
+import signal
+import socket
+import struct
+import subprocess
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import rlimits
+
+# 0 disables the pool (every run is a cold `python -c`)
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "0"))
+
+# Modules imported by each worker before it starts forking runs
+WARM_POOL_PRELOAD = [
+    m.strip()
+    for m in os.getenv("WARM_POOL_PRELOAD", "numpy,pandas,matplotlib,matplotlib.pyplot").split(",")
+    if m.strip()
+]
+
+# A worker is replaced after this many runs (0 = never)
+WARM_POOL_RECYCLE_AFTER = int(os.getenv("WARM_POOL_RECYCLE_AFTER", "50"))
+
+# How long to wait for a new worker to finish its imports
+WARM_POOL_START_TIMEOUT = float(os.getenv("WARM_POOL_START_TIMEOUT_SECONDS", "120"))
+
+_HDR = struct.Struct("!I")
+
+
+# -------------------- framing --------------------
+def send_msg(sock: socket.socket, obj: dict, fds: Tuple[int, ...] = ()) -> None:
+    """Send one JSON frame, optionally carrying file descriptors."""
+    data = json.dumps(obj).encode("utf-8")
+    header = _HDR.pack(len(data))
+    if fds:
+        socket.send_fds(sock, [header], list(fds))
+    else:
+        sock.sendall(header)
+    sock.sendall(data)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise EOFError("control socket closed")
+        buf += chunk
+    return buf
+
+
+def recv_msg(sock: socket.socket, maxfds: int = 0) -> Tuple[dict, List[int]]:
+    """Receive one JSON frame and any file descriptors attached to it."""
+    fds: List[int] = []
+    if maxfds:
+        head, fds, _flags, _addr = socket.recv_fds(sock, _HDR.size, maxfds)
+        if not head:
+            raise EOFError("control socket closed")
+    else:
+        head = sock.recv(_HDR.size)
+        if not head:
+            raise EOFError("control socket closed")
+    if len(head) < _HDR.size:
+        head += _recv_exact(sock, _HDR.size - len(head))
+    (length,) = _HDR.unpack(head)
+    return json.loads(_recv_exact(sock, length).decode("utf-8")), fds
+
+
+# -------------------- worker side --------------------
+def _exit_code(code) -> int:
+    """Map a SystemExit payload to a process exit code (like the interpreter does)."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    try:
+        print(code, file=sys.stderr)
+    except Exception:
+        pass
+    return 1
+
+
+def _run_as_main(code: str) -> int:
+    """Execute 'code' the way `python -c` would, including atexit handlers."""
+    import atexit
+    import builtins
+    import traceback
+    import types
+
+    main = types.ModuleType("__main__")
+    main.__dict__["__builtins__"] = builtins
+    sys.modules["__main__"] = main
+    try:
+        exec(compile(code, "<string>", "exec"), main.__dict__)
+        rc = 0
+    except SystemExit as e:
+        rc = _exit_code(e.code)
+    except BaseException as e:
+        # Drop this frame so the traceback looks like a plain `python -c` one
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        rc = 1
+    try:
+        atexit._run_exitfuncs()
+    except Exception:
+        pass
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    return rc
+
+
+def _child(req: dict, fds: List[int], sock: socket.socket) -> None:
+    """Runs inside the forked child: rewire stdio, enter run dir, exec, _exit."""
+    rc = 1
+    try:
+        sock.close()
+        os.setsid()  # own process group so the parent can kill the whole tree
+        rlimits.apply()
+        for target, fd in zip((0, 1, 2), fds):
+            os.dup2(fd, target)
+        for fd in fds:
+            if fd > 2:
+                os.close(fd)
+        os.environ.clear()
+        os.environ.update(req.get("env") or {})
+        os.chdir(req["cwd"])
+        unbuffered = bool(os.environ.get("PYTHONUNBUFFERED"))
+        sys.stdin = open(0, "r", encoding="utf-8", errors="replace", closefd=False)
+        sys.stdout = open(1, "w", encoding="utf-8", errors="backslashreplace", closefd=False,
+                          buffering=1 if unbuffered else -1)
+        sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", closefd=False,
+                          buffering=1)
+        sys.argv = ["-c"]
+        sys.path[0] = ""
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        rc = _run_as_main(req["code"])
+    except BaseException:
+        pass
+    os._exit(rc)
+
+
+def _serve(fd: int) -> None:
+    """Worker main loop: preload modules, then fork one child per request."""
+    import importlib
+
+    sock = socket.socket(fileno=fd)
+    preloaded: List[str] = []
+    for name in WARM_POOL_PRELOAD:
+        try:
+            importlib.import_module(name)
+            preloaded.append(name)
+        except Exception:
+            pass
+    # The parent handles interrupts; a Ctrl-C on the server must not kill idle workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    send_msg(sock, {"ready": True, "preloaded": preloaded})
+
+    while True:
+        try:
+            req, fds = recv_msg(sock, maxfds=3)
+        except (EOFError, OSError):
+            break
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _child(req, fds, sock)
+        for f in fds:
+            os.close(f)
+        send_msg(sock, {"pid": pid})
+        _pid, status, ru = os.wait4(pid, 0)
+        send_msg(sock, {"returncode": os.waitstatus_to_exitcode(status), "rusage": rlimits.rusage_dict(ru)})
+
+
+# -------------------- parent side --------------------
+class _Worker:
+    """One fork-server process plus its control socket."""
+
+    def __init__(self, env: Dict[str, str]):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock = parent_sock
+        self.runs = 0
+        self.broken = False
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, "-c", f"import warm_pool; warm_pool._serve({child_sock.fileno()})"],
+                cwd=Path(__file__).resolve().parent,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),),
+            )
+        finally:
+            child_sock.close()
+        self.sock.settimeout(WARM_POOL_START_TIMEOUT)
+        try:
+            hello, _ = recv_msg(self.sock)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            self.sock.settimeout(None)
+        self.preloaded: List[str] = hello.get("preloaded") or []
+
+    def start_run(self, code: str, cwd: Path, env: Dict[str, str]) -> "WarmProcess":
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            try:
+                send_msg(self.sock, {"code": code, "cwd": str(cwd), "env": env}, fds=(devnull, out_w, err_w))
+            finally:
+                os.close(devnull)
+                os.close(out_w)
+                os.close(err_w)
+            msg, _ = recv_msg(self.sock)
+            pid = int(msg["pid"])
+        except Exception:
+            # Worker died or the channel desynced: no run to reap, retire the worker
+            self.broken = True
+            os.close(out_r)
+            os.close(err_r)
+            raise
+        return WarmProcess(self, pid, os.fdopen(out_r, "rb"), os.fdopen(err_r, "rb"))
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class WarmProcess:
+    """
+    Popen-like handle for a run forked by a warm worker.
+    Supports the subset sandbox_core needs: pid, stdout, stderr, wait(), kill().
+    """
+
+    def __init__(self, worker: _Worker, pid: int, stdout, stderr):
+        self._worker = worker
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[Dict[str, float]] = None
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if self.returncode is not None:
+            return self.returncode
+        sock = self._worker.sock
+        sock.settimeout(timeout)
+        try:
+            msg, _ = recv_msg(sock)
+            self.returncode = int(msg["returncode"])
+            self.rusage = msg.get("rusage")
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(cmd="warm-pool", timeout=timeout)
+        except (OSError, EOFError, ValueError, KeyError):
+            # Worker died or the channel desynced; report a runner failure and retire it
+            self._worker.broken = True
+            self.returncode = 1
+        finally:
+            try:
+                sock.settimeout(None)
+            except OSError:
+                pass
+        _pool_release(self._worker)
+        return self.returncode
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class WarmPool:
+    """Fixed-size set of fork-server workers with recycle-after-N-runs."""
+
+    def __init__(self, size: int, recycle_after: int):
+        self.size = size
+        self.recycle_after = recycle_after
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.started = 0
+        self.recycled = 0
+        self.warm_runs = 0
+        self.cold_fallbacks = 0
+
+    def _worker_env(self) -> Dict[str, str]:
+        env = os.environ.copy()
+        env.setdefault("MPLBACKEND", "Agg")
+        return env
+
+    def _add_worker(self) -> None:
+        try:
+            w = _Worker(self._worker_env())
+        except Exception as e:
+            print(f"[warm_pool] worker start failed: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            if self._closed:
+                w.close()
+                return
+            self.started += 1
+        self._idle.put(w)
+
+    def start(self) -> None:
+        """Start all workers in the background so server startup is not blocked."""
+        for _ in range(self.size):
+            threading.Thread(target=self._add_worker, name="warm-pool-start", daemon=True).start()
+
+    def spawn(self, code: str, cwd: Path, env: Dict[str, str]) -> Optional[WarmProcess]:
+        """Fork a run on an idle worker; None if no worker is free (caller goes cold)."""
+        try:
+            w = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.cold_fallbacks += 1
+            return None
+        try:
+            proc = w.start_run(code, cwd, env)
+        except Exception:
+            w.broken = True
+            self.release(w)
+            with self._lock:
+                self.cold_fallbacks += 1
+            return None
+        with self._lock:
+            self.warm_runs += 1
+        return proc
+
+    def release(self, w: _Worker) -> None:
+        w.runs += 1
+        if self._closed:
+            w.close()
+            return
+        if w.broken or w.proc.poll() is not None or (self.recycle_after and w.runs >= self.recycle_after):
+            w.close()
+            with self._lock:
+                self.recycled += 1
+            threading.Thread(target=self._add_worker, name="warm-pool-recycle", daemon=True).start()
+            return
+        self._idle.put(w)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "started": self.started,
+                "recycled": self.recycled,
+                "warm_runs": self.warm_runs,
+                "cold_fallbacks": self.cold_fallbacks,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_POOL: Optional[WarmPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> Optional[WarmPool]:
+    """Return the process-wide pool, starting it on first use (None when disabled)."""
+    global _POOL
+    if WARM_POOL_SIZE <= 0:
+        return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = WarmPool(WARM_POOL_SIZE, WARM_POOL_RECYCLE_AFTER)
+            _POOL.start()
+        return _POOL
+
+
+def _pool_release(w: _Worker) -> None:
+    if _POOL is not None:
+        _POOL.release(w)
+    else:
+        w.close()
+
+
+def spawn(code: str, cwd: Path, env: Dict[str, str]) -> Optional[WarmProcess]:
+    """Try to start 'code' on a warm worker; None means "use a cold subprocess"."""
+    pool = get_pool()
+    if pool is None:
+        return None
+    return pool.spawn(code, cwd, env)
+
+
+def shutdown() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown()
+            _POOL = None
@@ -5,12 +5,17 @@ import os
 import re
 import json
 import time
+import queue
 import hashlib
-import requests
 import gradio as gr
-from typing import Dict, Any, List, Iterable, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Iterable, Optional, Tuple
 from urllib.parse import urlparse
 from pathlib import Path
+import http_client
+import context_window
+import ui_stream
+import tool_result
 from ui_logging import configure_logging, make_rid
 from sys_prompt import SYSTEM_PROMPT
 
@@ -28,11 +33,32 @@ ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
 
 ARTIFACTS_EXTERNAL_BASE = os.getenv("ARTIFACTS_EXTERNAL_BASE", "").rstrip("/")
 
+# Run sandbox code through the job API (POST /jobs + polling) instead of one long /execute request
+SANDBOX_USE_JOBS = os.getenv("SANDBOX_USE_JOBS", "0") in ("1", "true", "TRUE", "yes", "on")
+SANDBOX_JOB_POLL_SECONDS = float(os.getenv("SANDBOX_JOB_POLL_SECONDS", "0.5"))
+SANDBOX_JOB_MAX_WAIT_SECONDS = float(os.getenv("SANDBOX_JOB_MAX_WAIT_SECONDS", "3600"))
+
+# Stream sandbox stdout/stderr live (POST /execute/stream) in the Sandbox tab and the chat tool path
+SANDBOX_STREAM_OUTPUT = os.getenv("SANDBOX_STREAM_OUTPUT", "1") in ("1", "true", "TRUE", "yes", "on")
+# Stream the first (tool-enabled) pass: plain answers show as they arrive and tool calls start once complete
+UI_STREAM_FIRST_PASS = os.getenv("UI_STREAM_FIRST_PASS", "1") in ("1", "true", "TRUE", "yes", "on")
+# Tool calls from one model message run concurrently on up to this many threads (1 = one after another)
+UI_TOOL_CONCURRENCY = int(os.getenv("UI_TOOL_CONCURRENCY", "4"))
+# How many trailing output lines the chat shows while a tool call is running
+UI_TOOL_LIVE_LINES = int(os.getenv("UI_TOOL_LIVE_LINES", "12"))
+# Gallery previews use the sandbox's /thumb derivatives at this width (0 = full-size images)
+UI_THUMB_WIDTH = int(os.getenv("UI_THUMB_WIDTH", "320"))
+
 UI_LOG_ENABLED = os.getenv("UI_LOG_ENABLED", "1") in ("1", "true", "TRUE", "yes", "on")
 UI_LOG_LEVEL = os.getenv("UI_LOG_LEVEL", "DEBUG")
 UI_LOG_DIR = os.getenv("UI_LOG_DIR", "/app/logs")
 UI_LOG_FORMAT = os.getenv("UI_LOG_FORMAT", "json")
 
+# Read timeouts for outbound HTTP; connect timeout, pooling and retries live in http_client.py
+LMSTUDIO_READ_TIMEOUT = float(os.getenv("LMSTUDIO_READ_TIMEOUT", "600"))
+SANDBOX_READ_TIMEOUT = float(os.getenv("SANDBOX_READ_TIMEOUT", "600"))
+HTTP_CONTROL_READ_TIMEOUT = float(os.getenv("HTTP_CONTROL_READ_TIMEOUT", "30"))  # model list, job submit/poll
+
 # Tracing controls
 UI_TRACE_VERBOSE = os.getenv("UI_TRACE_VERBOSE", "1") in ("1", "true", "TRUE", "yes", "on")
 UI_TRACE_MAXLEN = int(os.getenv("UI_TRACE_MAXLEN", "4000"))
@@ -110,6 +136,9 @@ def trace(marker: str, rid: Optional[str] = None, **fields):
     payload.update(fields)
     log.info("trace", extra=payload)
 
+# Every outbound request is traced as "HTTP" (latency to headers, pool counters)
+http_client.set_trace(trace)
+
 def _join_url(base: str, path: str) -> str:
     base = base.rstrip("/")
     if not path.startswith("/"):
@@ -135,7 +164,7 @@ def list_models() -> List[str]:
     t0 = _time_ms()
     try:
         trace("MODELS_BEGIN", rid=rid, url=url)
-        r = requests.get(url, timeout=30)
+        r = http_client.get(url, read_timeout=HTTP_CONTROL_READ_TIMEOUT, rid=rid)
         r.raise_for_status()
         data = r.json()
         ids = [item.get("id") for item in data.get("data", []) if item.get("id")]
@@ -162,22 +191,14 @@ def set_model(selected: str) -> str:
 
 # -------------------- Streaming helpers --------------------
 def _iter_sse_lines(resp, rid: str):
+    """SSE data payloads as bytes (ui_stream.iter_sse_data), traced per line in verbose mode."""
     total = 0
-    for raw in resp.iter_lines(decode_unicode=True):
-        if not raw:
-            continue
-        if raw.startswith("data:"):
-            raw = raw[len("data:"):].strip()
-        if raw == "[DONE]":
-            trace("STREAM_DONE", rid=rid, total=total)
-            break
-        try:
-            total += 1
-            if UI_TRACE_VERBOSE:
-                trace("STREAM_LINE", rid=rid, line=_clip_str(raw, 512))
-        except Exception:
-            pass
+    for raw in ui_stream.iter_sse_data(resp):
+        total += 1
+        if UI_TRACE_VERBOSE:
+            trace("STREAM_LINE", rid=rid, line=_clip_str(raw.decode("utf-8", "replace"), 512))
         yield raw
+    trace("STREAM_DONE", rid=rid, total=total)
 
 # -------------------- Cutoff detection --------------------
 _CUTOFF_SNIPPETS = (
@@ -201,20 +222,113 @@ def looks_cut_off(txt: str) -> bool:
     return False
 
 CODE_FENCE_RE = re.compile(r"```.*?```", re.DOTALL)
+CODE_HIDDEN = "[code hidden – ask to see it]"
 def strip_code_blocks(s: str) -> str:
-    return CODE_FENCE_RE.sub("[code hidden – ask to see it]", s or "")
+    return CODE_FENCE_RE.sub(CODE_HIDDEN, s or "")
+
+class FenceStripper:
+    """
+    Incremental strip_code_blocks for streamed text. feed() takes the text so
+    far (each call extends the previous one) and returns what is safe to show:
+    closed fences become CODE_HIDDEN, an open fence shows CODE_HIDDEN until it
+    closes, and a trailing "`" or "``" is held back in case it starts a fence.
+    finish() on the complete text returns exactly strip_code_blocks(text).
+    """
+    FENCE = "```"
+
+    def __init__(self):
+        self._shown = ""      # sanitized output for text[:self._pos]
+        self._pos = 0         # end of the last fence marker consumed
+        self._scan = 0        # no marker starts before this offset
+        self._open = None     # offset of the unclosed opening fence
+
+    def _advance(self, text: str) -> None:
+        while True:
+            i = text.find(self.FENCE, max(self._pos, self._scan))
+            if i < 0:
+                # a marker may still complete across the end of 'text'
+                self._scan = max(self._pos, len(text) - len(self.FENCE) + 1)
+                return
+            if self._open is None:
+                self._shown += text[self._pos:i]
+                self._open = i
+            else:
+                self._shown += CODE_HIDDEN
+                self._open = None
+            self._pos = i + len(self.FENCE)
+
+    def feed(self, text: str) -> str:
+        self._advance(text)
+        if self._open is not None:
+            return self._shown + CODE_HIDDEN
+        tail = text[self._pos:]
+        held = len(tail) - len(tail.rstrip("`"))
+        return self._shown + (tail[:-held] if held else tail)
+
+    def finish(self, text: str) -> str:
+        self._advance(text)
+        if self._open is not None:
+            return self._shown + text[self._open:]   # unclosed fence stays visible, like the regex
+        return self._shown + text[self._pos:]
 
 # -------------------- Sandbox helpers --------------------
+def _timing_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Server-side phase timings as flat trace fields (t_spawn_ms, t_user_code_ms, ...)."""
+    timings = data.get("timings") or {}
+    if not isinstance(timings, dict):
+        return {}
+    return {f"t_{k}": v for k, v in timings.items() if isinstance(v, (int, float))}
+
+def _sandbox_execute_job(code: str, rid: Optional[str] = None) -> Dict[str, Any]:
+    """Submit to POST /jobs and poll GET /jobs/{id}; no connection is held for the whole run."""
+    r = http_client.post(_join_url(SANDBOX_BASE_URL, "/jobs"), json={"code": code},
+                         read_timeout=HTTP_CONTROL_READ_TIMEOUT, rid=rid)
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    trace("SANDBOX_JOB_SUBMITTED", rid=rid, job_id=job_id)
+    poll_url = _join_url(SANDBOX_BASE_URL, f"/jobs/{job_id}")
+    deadline = time.time() + SANDBOX_JOB_MAX_WAIT_SECONDS
+    offsets = {"stdout_from": 0, "stderr_from": 0}
+    polls = 0
+    while True:
+        time.sleep(SANDBOX_JOB_POLL_SECONDS)
+        r = http_client.get(poll_url, params=offsets, read_timeout=HTTP_CONTROL_READ_TIMEOUT, rid=rid)
+        r.raise_for_status()
+        snap = r.json()
+        polls += 1
+        status = snap.get("status")
+        if status == "done":
+            trace("SANDBOX_JOB_DONE", rid=rid, job_id=job_id, polls=polls)
+            return snap.get("result") or {}
+        if status == "rejected":
+            raise RuntimeError(f"sandbox busy: {snap.get('error')} (retry after {snap.get('retry_after')}s)")
+        if status not in ("queued", "running"):
+            # "unknown": the run dir has no readable result.json (server restart, failed write)
+            trace("SANDBOX_JOB_LOST", rid=rid, job_id=job_id, status=status, polls=polls)
+            raise RuntimeError(f"job {job_id} ended with status {status!r}")
+        offsets = {"stdout_from": snap.get("stdout_len", 0), "stderr_from": snap.get("stderr_len", 0)}
+        if time.time() > deadline:
+            # Stop it on the server too, so it doesn't keep holding a scheduler slot
+            try:
+                http_client.request("DELETE", poll_url, read_timeout=HTTP_CONTROL_READ_TIMEOUT, rid=rid)
+            except Exception as e:
+                trace("SANDBOX_JOB_CANCEL_ERROR", rid=rid, job_id=job_id, error=str(e))
+            raise TimeoutError(f"job {job_id} still {status} after {SANDBOX_JOB_MAX_WAIT_SECONDS:.0f}s (cancelled)")
+
+
 def sandbox_execute_raw(code: str, rid: Optional[str] = None) -> Dict[str, Any]:
-    exec_url = _join_url(SANDBOX_BASE_URL, "/execute")
+    exec_url = _join_url(SANDBOX_BASE_URL, "/jobs" if SANDBOX_USE_JOBS else "/execute")
     t0 = _time_ms()
     try:
         trace("SANDBOX_EXEC_BEGIN", rid=rid, url=exec_url, len_code=len(code), code_hash=_sha(code))
         if UI_TRACE_INCLUDE_CODE:
             dump_blob("sandbox_req_code", rid or make_rid(), code, suffix="py")
-        r = requests.post(exec_url, json={"code": code}, timeout=600)
-        r.raise_for_status()
-        data = r.json()
+        if SANDBOX_USE_JOBS:
+            data = _sandbox_execute_job(code, rid=rid)
+        else:
+            r = http_client.post(exec_url, json={"code": code}, read_timeout=SANDBOX_READ_TIMEOUT, rid=rid)
+            r.raise_for_status()
+            data = r.json()
         dt = _time_ms() - t0
         trace("SANDBOX_EXEC_RESULT",
               rid=rid,
@@ -222,7 +336,8 @@ def sandbox_execute_raw(code: str, rid: Optional[str] = None) -> Dict[str, Any]:
               rc=data.get("returncode", None),
               stdout_len=len(data.get("stdout", "") or ""),
               stderr_len=len(data.get("stderr", "") or ""),
-              images=len((data.get("images") or [])))
+              images=len((data.get("images") or [])),
+              **_timing_fields(data))
         dump_blob("sandbox_resp", rid or make_rid(), data)
         return data
     except Exception as e:
@@ -230,16 +345,84 @@ def sandbox_execute_raw(code: str, rid: Optional[str] = None) -> Dict[str, Any]:
         trace("SANDBOX_EXEC_ERROR", rid=rid, ms=dt, error=str(e))
         return {"error": str(e)}
 
-def sandbox_execute(code: str):
-    rid = make_rid()
-    trace("SANDBOX_UI_RUN", rid=rid, len_code=len(code), code_hash=_sha(code))
-    data = sandbox_execute_raw(code, rid=rid)
-    if "error" in data:
-        return "", f"[client-error] {data['error']}", -1, [], [], []
-    stdout = data.get("stdout", "")
-    stderr = data.get("stderr", "")
-    rc = int(data.get("returncode", -1))
-    images = data.get("images") or []
+def _iter_sse_events(resp) -> Iterable[Tuple[str, Dict[str, Any]]]:
+    """Parse a text/event-stream response into (event, json_data) pairs."""
+    event, data_lines = "message", []
+    for raw in resp.iter_lines(decode_unicode=True):
+        if raw is None:
+            continue
+        if raw == "":
+            if data_lines:
+                try:
+                    yield event, json.loads("\n".join(data_lines))
+                except Exception:
+                    pass
+            event, data_lines = "message", []
+        elif raw.startswith(":"):
+            continue  # keepalive comment
+        elif raw.startswith("event:"):
+            event = raw[len("event:"):].strip()
+        elif raw.startswith("data:"):
+            data_lines.append(raw[len("data:"):].lstrip())
+
+def sandbox_execute_stream_raw(code: str, rid: Optional[str] = None) -> Iterable[Tuple[str, Dict[str, Any]]]:
+    """
+    Run code via POST /execute/stream and yield (event, data) as it happens:
+    stdout/stderr lines, artifacts, then ("result", payload) or ("error", {"error": ...}).
+    Falls back to the blocking path if the sandbox has no streaming endpoint.
+    """
+    stream_url = _join_url(SANDBOX_BASE_URL, "/execute/stream")
+    t0 = _time_ms()
+    try:
+        trace("SANDBOX_STREAM_BEGIN", rid=rid, url=stream_url, len_code=len(code), code_hash=_sha(code))
+        if UI_TRACE_INCLUDE_CODE:
+            dump_blob("sandbox_req_code", rid or make_rid(), code, suffix="py")
+        with http_client.post(stream_url, json={"code": code}, stream=True,
+                              read_timeout=SANDBOX_READ_TIMEOUT, rid=rid) as r:
+            if r.status_code == 404:
+                trace("SANDBOX_STREAM_UNSUPPORTED", rid=rid)
+                data = sandbox_execute_raw(code, rid=rid)
+                yield ("error", data) if "error" in data else ("result", data)
+                return
+            r.raise_for_status()
+            n_events = 0
+            first_ms = None
+            for event, data in _iter_sse_events(r):
+                n_events += 1
+                if first_ms is None and event in ("stdout", "stderr"):
+                    first_ms = _time_ms() - t0
+                if event == "result":
+                    trace("SANDBOX_EXEC_RESULT",
+                          rid=rid,
+                          ms=_time_ms() - t0,
+                          first_output_ms=first_ms,
+                          events=n_events,
+                          rc=data.get("returncode", None),
+                          stdout_len=len(data.get("stdout", "") or ""),
+                          stderr_len=len(data.get("stderr", "") or ""),
+                          images=len((data.get("images") or [])),
+                          **_timing_fields(data))
+                    dump_blob("sandbox_resp", rid or make_rid(), data)
+                    yield event, data
+                    return
+                if event == "error":
+                    raise RuntimeError(data.get("detail") or "sandbox stream error")
+                yield event, data
+        raise RuntimeError("stream ended without a result")
+    except Exception as e:
+        trace("SANDBOX_EXEC_ERROR", rid=rid, ms=_time_ms() - t0, error=str(e))
+        yield "error", {"error": str(e)}
+
+def _thumb_url(url: str) -> str:
+    """Preview URL for a sandbox /files URL (the static artifacts server has no /thumb)."""
+    if UI_THUMB_WIDTH <= 0 or ARTIFACTS_EXTERNAL_BASE or "/files/" not in url:
+        return url
+    if Path(urlparse(url).path).suffix.lower() in (".svg", ".pdf"):
+        return url
+    return url.replace("/files/", "/thumb/", 1) + f"?w={UI_THUMB_WIDTH}&fmt=webp"
+
+def _resolve_links(images: List[Dict[str, Any]]) -> Tuple[List[List[str]], List[str]]:
+    """Table rows [filename, full url, viewer] plus gallery preview (thumbnail) URLs in the same order."""
     links = []
     gallery_urls = []
     for rec in images:
@@ -254,10 +437,76 @@ def sandbox_execute(code: str):
             iframe = _join_url(SANDBOX_BASE_URL, f"/view/{filename}")
         links.append([filename, url, iframe])
         if url:
-            gallery_urls.append(url)
+            gallery_urls.append(_thumb_url(url))
+    return links, gallery_urls
+
+def _artifact_url(filename: str) -> str:
+    """Absolute URL of a file under the sandbox's TEMP_DIR (artifact or run log)."""
+    if ARTIFACTS_EXTERNAL_BASE:
+        return f"{ARTIFACTS_EXTERNAL_BASE}/{filename}"
+    return _join_url(SANDBOX_BASE_URL, f"/files/{filename}")
+
+def show_full_image(links: Any, evt: gr.SelectData):
+    """Gallery click: load the full-resolution file for the selected preview."""
+    rows = links.values.tolist() if hasattr(links, "values") else (links or [])
+    full = [r[1] for r in rows if len(r) > 1 and r[1]]
+    idx = evt.index if isinstance(evt.index, int) else (evt.index or [0])[0]
+    if 0 <= idx < len(full):
+        trace("SANDBOX_UI_FULL_IMAGE", url=full[idx])
+        return full[idx]
+    return None
+
+def sandbox_execute(code: str):
+    rid = make_rid()
+    trace("SANDBOX_UI_RUN", rid=rid, len_code=len(code), code_hash=_sha(code))
+    data = sandbox_execute_raw(code, rid=rid)
+    if "error" in data:
+        return "", f"[client-error] {data['error']}", -1, [], [], []
+    stdout = data.get("stdout", "")
+    stderr = data.get("stderr", "")
+    rc = int(data.get("returncode", -1))
+    images = data.get("images") or []
+    links, gallery_urls = _resolve_links(images)
     trace("SANDBOX_UI_PARSED", rid=rid, images=len(images), links=len(links), gallery=len(gallery_urls))
     return stdout, stderr, rc, images, links, gallery_urls
 
+def sandbox_execute_live(code: str):
+    """Sandbox tab handler: render stdout/stderr/artifacts progressively while the run is going."""
+    if not SANDBOX_STREAM_OUTPUT:
+        yield sandbox_execute(code)
+        return
+    rid = make_rid()
+    trace("SANDBOX_UI_RUN", rid=rid, len_code=len(code), code_hash=_sha(code), stream=True)
+    out: List[str] = []
+    err: List[str] = []
+    images: List[Dict[str, Any]] = []
+    for event, data in sandbox_execute_stream_raw(code, rid=rid):
+        if event == "error":
+            yield "".join(out), "".join(err) + f"[client-error] {data.get('error')}", -1, images, *_resolve_links(images)
+            return
+        if event == "result":
+            images = data.get("images") or []
+            links, gallery_urls = _resolve_links(images)
+            trace("SANDBOX_UI_PARSED", rid=rid, images=len(images), links=len(links), gallery=len(gallery_urls))
+            yield (data.get("stdout", ""), data.get("stderr", ""), int(data.get("returncode", -1)),
+                   images, links, gallery_urls)
+            return
+        if event == "stdout":
+            out.append(data.get("text", ""))
+        elif event == "stderr":
+            err.append(data.get("text", ""))
+        elif event == "artifact":
+            images.append(data)
+        yield "".join(out), "".join(err), None, images, *_resolve_links(images)
+
+def _live_tool_status(idx: int, total: int, lines: List[str], done: int = 0) -> str:
+    """Chat placeholder while tool calls run: header plus the output tail of the call that last printed."""
+    head = "🔧 Executing in Python sandbox…" + (f" (call {idx}/{total}, {done} done)" if total > 1 else "")
+    tail = "".join(lines).splitlines()[-UI_TOOL_LIVE_LINES:]
+    if not tail:
+        return head
+    return head + "\n\n```text\n" + "\n".join(tail) + "\n```"
+
 # -------------------- Tool schema --------------------
 PY_SANDBOX_TOOL = {
     "type": "function",
@@ -307,7 +556,7 @@ def _first_chat_pass(
     t0 = _time_ms()
     trace("FIRST_PASS_BEGIN", rid=rid, url=url, temp=temperature, max_tokens=payload.get("max_tokens"), tools=bool(tools))
     dump_blob("chat_first_req", rid, payload)
-    r = requests.post(url, json=payload, timeout=600)
+    r = http_client.post(url, json=payload, read_timeout=LMSTUDIO_READ_TIMEOUT, rid=rid)
     r.raise_for_status()
     data = r.json()
     dt = _time_ms() - t0
@@ -318,6 +567,105 @@ def _first_chat_pass(
         dump_blob("chat_first_resp", rid, data)
     return data
 
+def _tool_args_complete(call: Dict[str, Any]) -> bool:
+    """A streamed call is complete once its arguments parse (no proper prefix of a JSON object does)."""
+    args = (call.get("function") or {}).get("arguments", "").rstrip()
+    if not call["function"].get("name") or not args.endswith("}"):
+        return False
+    try:
+        json.loads(args)
+        return True
+    except ValueError:
+        return False
+
+def _first_chat_pass_stream(
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    tools: Optional[List[Dict[str, Any]]],
+    rid: str,
+) -> Iterable[Tuple[str, Any]]:
+    """
+    Streamed first pass. Yields ("text", content_so_far) as content arrives,
+    ("tool_call", call) as soon as each tool call is complete (its arguments
+    parse, or a later call / the end of the stream starts), and finally
+    ("done", message) with the assembled assistant message.
+    """
+    url = _join_url(LMSTUDIO_BASE_URL, "/v1/chat/completions")
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens if max_tokens > 0 else None,
+        "stream": True,
+    }
+    if tools:
+        payload["tools"] = tools
+        payload["tool_choice"] = "auto"
+    payload = {k: v for k, v in payload.items() if v is not None}
+    t0 = _time_ms()
+    trace("FIRST_PASS_BEGIN", rid=rid, url=url, temp=temperature, max_tokens=payload.get("max_tokens"),
+          tools=bool(tools), stream=True)
+    dump_blob("chat_first_req", rid, payload)
+
+    text = ui_stream.StreamText()
+    calls: Dict[int, Dict[str, Any]] = {}   # stream index -> call being assembled
+    emitted: set = set()
+    finish = None
+    first_ms = None
+    with http_client.post(url, json=payload, stream=True, read_timeout=LMSTUDIO_READ_TIMEOUT, rid=rid) as resp:
+        resp.raise_for_status()
+        for line in ui_stream.with_ticks(_iter_sse_lines(resp, rid=rid), text.wait):
+            if line is ui_stream.TICK:   # stalled: show what arrived since the last frame
+                if text.tick():
+                    yield "text", text.text
+                continue
+            try:
+                choice = (ui_stream.json_loads(line).get("choices") or [{}])[0]
+            except ValueError:
+                continue
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                if first_ms is None:
+                    first_ms = _time_ms() - t0
+                if text.add(delta["content"]):
+                    yield "text", text.text
+            for d in delta.get("tool_calls") or []:
+                idx = d.get("index", 0)
+                # A new index means every earlier call is finished
+                for j in sorted(calls):
+                    if j < idx and j not in emitted:
+                        emitted.add(j)
+                        yield "tool_call", calls[j]
+                call = calls.setdefault(idx, {"id": None, "type": "function",
+                                              "function": {"name": "", "arguments": ""}})
+                if first_ms is None:
+                    first_ms = _time_ms() - t0
+                if d.get("id"):
+                    call["id"] = d["id"]
+                if d.get("type"):
+                    call["type"] = d["type"]
+                fn = d.get("function") or {}
+                call["function"]["name"] += fn.get("name") or ""
+                call["function"]["arguments"] += fn.get("arguments") or ""
+                if idx not in emitted and _tool_args_complete(call):
+                    emitted.add(idx)
+                    yield "tool_call", call
+            if choice.get("finish_reason"):
+                finish = choice["finish_reason"]
+    for j in sorted(calls):
+        if j not in emitted:
+            yield "tool_call", calls[j]
+
+    content = text.flush()
+    message: Dict[str, Any] = {"role": "assistant", "content": content}
+    if calls:
+        message["tool_calls"] = [calls[j] for j in sorted(calls)]
+    trace("FIRST_PASS_RESULT", rid=rid, ms=_time_ms() - t0, first_token_ms=first_ms,
+          tool_calls=len(calls), chars=len(content), frames=text.gate.frames, finish=finish)
+    dump_blob("chat_first_resp", rid, {"choices": [{"index": 0, "message": message, "finish_reason": finish}]})
+    yield "done", message
+
 def _final_chat_stream(
     messages: List[Dict[str, Any]],
     temperature: float,
@@ -335,24 +683,30 @@ def _final_chat_stream(
     payload = {k: v for k, v in payload.items() if v is not None}
     dump_blob("chat_final_stream_req", rid, payload)
     t0 = _time_ms()
-    with requests.post(url, json=payload, stream=True, timeout=600) as resp:
+    with http_client.post(url, json=payload, stream=True, read_timeout=LMSTUDIO_READ_TIMEOUT, rid=rid) as resp:
         resp.raise_for_status()
-        full = ""
+        # New deltas are appended only when a frame goes out (ui_stream.StreamText), not per token
+        text = ui_stream.StreamText()
         n_chunks = 0
-        for line in _iter_sse_lines(resp, rid=rid):
+        for line in ui_stream.with_ticks(_iter_sse_lines(resp, rid=rid), text.wait):
+            if line is ui_stream.TICK:
+                if text.tick():
+                    yield text.text
+                continue
             try:
-                obj = json.loads(line)
-                delta = obj.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                if delta:
-                    n_chunks += 1
-                    full += delta
-                    if UI_TRACE_VERBOSE:
-                        trace("STREAM_CHUNK", rid=rid, add=len(delta), total=len(full), chunks=n_chunks)
-                    yield full
-            except Exception:
+                delta = ui_stream.delta_content(ui_stream.json_loads(line))
+            except ValueError:
                 continue
+            if delta:
+                n_chunks += 1
+                if text.add(delta):
+                    if UI_TRACE_VERBOSE:
+                        trace("STREAM_CHUNK", rid=rid, total=len(text.text), chunks=n_chunks,
+                              frames=text.gate.frames)
+                    yield text.text
+        full = text.flush()
         dt = _time_ms() - t0
-        trace("FINAL_STREAM_DONE", rid=rid, ms=dt, chunks=n_chunks, total=len(full))
+        trace("FINAL_STREAM_DONE", rid=rid, ms=dt, chunks=n_chunks, frames=text.gate.frames, total=len(full))
         dump_blob("chat_final_stream_result", rid, {"text": full})
         yield full
 
@@ -373,7 +727,7 @@ def _final_chat_once(
     payload = {k: v for k, v in payload.items() if v is not None}
     dump_blob("chat_final_req", rid, payload)
     t0 = _time_ms()
-    resp = requests.post(url, json=payload, timeout=600)
+    resp = http_client.post(url, json=payload, read_timeout=LMSTUDIO_READ_TIMEOUT, rid=rid)
     resp.raise_for_status()
     data = resp.json()
     dt = _time_ms() - t0
@@ -392,58 +746,74 @@ def _auto_continue_loop(
     max_cont: int,
     strip_code: bool,
     rid: str,
+    initial_text: Optional[str] = None,
 ):
+    """
+    Final answer plus auto-continue passes. With initial_text (the streamed first
+    pass already produced the answer) no new completion is requested for it.
+    """
     if not history or history[-1].get("role") != "assistant":
         history.append({"role": "assistant", "content": ""})
 
-    def _run_one_pass_and_yield():
-        if stream_final:
-            for text in _final_chat_stream(api_messages, temperature, max_tokens, rid=rid):
-                history[-1] = {"role": "assistant", "content": text}
-                yield history, ""
-            return history[-1]["content"]
-        else:
-            text = _final_chat_once(api_messages, temperature, max_tokens, rid=rid)
-            history[-1] = {"role": "assistant", "content": text}
-            yield history, ""
-            return text
-
-    for out in _run_one_pass_and_yield():
-        yield out
-    final_text = history[-1]["content"]
-    trace("FINAL_PASS_RESULT", rid=rid, chars=len(final_text))
+    # Code fences are hidden while the text streams, not only once it is finished
+    stripper = FenceStripper() if strip_code else None
 
-    if not auto_continue:
-        if strip_code and final_text:
-            final_text = strip_code_blocks(final_text)
-            history[-1]["content"] = final_text
-            trace("SANITIZE_CODE", rid=rid, applied=True, final_len=len(final_text))
-            yield history, ""
-        return
+    def _display(raw: str, done: bool = False) -> str:
+        if stripper is None:
+            return raw
+        return stripper.finish(raw) if done else stripper.feed(raw)
+
+    def _join(prefix: str, text: str) -> str:
+        return prefix + ("\n" if prefix and text else "") + text
 
-    for i in range(int(max_cont)):
-        if not looks_cut_off(final_text):
-            break
-        trace("AUTO_CONTINUE_TRIGGER", rid=rid, iter=i + 1, current_len=len(final_text))
-        api_messages.append({"role": "assistant", "content": final_text})
-        api_messages.append({"role": "user", "content": "Continue exactly where you left off. If you were writing code, finish it inside a single fenced block."})
+    # This turn's user message; the continuation prompts added below belong to its turn
+    turn_start = max((i for i, m in enumerate(api_messages) if m.get("role") == "user"), default=None)
 
+    passes = [0]
+
+    def _prompt() -> List[Dict[str, Any]]:
+        # Re-fit every pass: tool results and continuations grew the conversation
+        passes[0] += 1
+        msgs, ctx = context_window.fit(api_messages, max_tokens, turn_start)
+        trace("CONTEXT", rid=rid, pass_no=passes[0], **ctx)
+        return msgs
+
+    def _run_one_pass_and_yield(prefix: str):
+        """One completion appended to 'prefix'; yields UI updates and returns the raw text."""
+        msgs = _prompt()
         if stream_final:
-            for text in _final_chat_stream(api_messages, temperature, max_tokens, rid=rid):
-                history[-1] = {"role": "assistant", "content": final_text + ("\n" if text else "") + text}
+            raw = prefix
+            for text in _final_chat_stream(msgs, temperature, max_tokens, rid=rid):
+                raw = _join(prefix, text)
+                history[-1] = {"role": "assistant", "content": _display(raw)}
                 yield history, ""
-            final_text = history[-1]["content"]
-        else:
-            more = _final_chat_once(api_messages, temperature, max_tokens, rid=rid)
-            final_text = final_text + ("\n" if more else "") + more
-            history[-1] = {"role": "assistant", "content": final_text}
-            yield history, ""
+            return raw
+        raw = _join(prefix, _final_chat_once(msgs, temperature, max_tokens, rid=rid))
+        history[-1] = {"role": "assistant", "content": _display(raw)}
+        yield history, ""
+        return raw
+
+    if initial_text is not None:
+        final_text = initial_text
+        history[-1] = {"role": "assistant", "content": _display(final_text)}
+        yield history, ""
+    else:
+        final_text = yield from _run_one_pass_and_yield("")
+    trace("FINAL_PASS_RESULT", rid=rid, chars=len(final_text))
+
+    if auto_continue:
+        for i in range(int(max_cont)):
+            if not looks_cut_off(final_text):
+                break
+            trace("AUTO_CONTINUE_TRIGGER", rid=rid, iter=i + 1, current_len=len(final_text))
+            api_messages.append({"role": "assistant", "content": final_text})
+            api_messages.append({"role": "user", "content": "Continue exactly where you left off. If you were writing code, finish it inside a single fenced block."})
+            final_text = yield from _run_one_pass_and_yield(final_text)
+        trace("AUTO_CONTINUE_DONE", rid=rid, total_len=len(final_text))
 
-    trace("AUTO_CONTINUE_DONE", rid=rid, total_len=len(final_text))
     if strip_code and final_text:
-        final_text = strip_code_blocks(final_text)
-        history[-1]["content"] = final_text
-        trace("SANITIZE_CODE", rid=rid, applied=True, final_len=len(final_text))
+        history[-1]["content"] = _display(final_text, done=True)
+        trace("SANITIZE_CODE", rid=rid, applied=True, final_len=len(history[-1]["content"]))
         yield history, ""
 
 # -------------------- Links helper --------------------
@@ -463,7 +833,7 @@ def _download(url: str, dest: Path, rid: Optional[str] = None):
     t0 = _time_ms()
     try:
         trace("DOWNLOAD_BEGIN", rid=rid, url=url, dest=str(dest))
-        with requests.get(url, stream=True, timeout=600) as resp:
+        with http_client.get(url, stream=True, read_timeout=SANDBOX_READ_TIMEOUT, rid=rid) as resp:
             resp.raise_for_status()
             with open(dest, "wb") as f:
                 for chunk in resp.iter_content(8192):
@@ -505,6 +875,290 @@ def persist_images(images: List[Dict[str, Any]]):
     trace("PERSIST_DONE", rid=rid, dir=str(out_dir), count=len(saved))
     return msg, [Path(p) for p in saved]
 
+# -------------------- Chat pipeline --------------------
+def _execute_tool_call(idx: int, tc: Dict[str, Any], rid: str,
+                       on_output: Callable[[int, str], None]) -> Dict[str, Any]:
+    """Run one model tool call against the sandbox (in a worker thread); returns the tool result payload."""
+    fn = (tc.get("function") or {}).get("name", "") or ""
+    args_str = (tc.get("function") or {}).get("arguments", "{}")
+    try:
+        args = json.loads(args_str) if isinstance(args_str, str) else (args_str or {})
+    except Exception:
+        args = {}
+    if fn != "python_sandbox_execute":
+        return {"error": f"Unsupported tool: {fn}"}
+
+    code_to_run = args.get("code", "") or ""
+    trace("TOOL_CALL_BEGIN", rid=rid, idx=idx, tool=fn,
+          len_code=len(code_to_run), code_hash=_sha(code_to_run))
+    if UI_TRACE_INCLUDE_CODE:
+        dump_blob("tool_code", rid, code_to_run, suffix="py")
+
+    if SANDBOX_STREAM_OUTPUT:
+        data: Dict[str, Any] = {"error": "no result"}
+        for event, ev in sandbox_execute_stream_raw(code_to_run, rid=rid):
+            if event in ("stdout", "stderr"):
+                on_output(idx, ev.get("text", ""))
+            elif event in ("result", "error"):
+                data = ev
+    else:
+        data = sandbox_execute_raw(code_to_run, rid=rid)
+
+    for rec in data.get("images") or []:
+        fnm = rec.get("filename") or ""
+        if ARTIFACTS_EXTERNAL_BASE and fnm:
+            rec["url"] = f"{ARTIFACTS_EXTERNAL_BASE}/{fnm}"
+            rec["iframe_url"] = rec["url"]
+
+    trace("TOOL_CALL_RESULT", rid=rid, idx=idx,
+          rc=data.get("returncode", None),
+          stdout_len=len(data.get("stdout", "") or ""),
+          stderr_len=len(data.get("stderr", "") or ""),
+          images=len((data.get("images") or [])))
+    return data
+
+class _ToolRunner:
+    """
+    Runs tool calls on a bounded pool as they are submitted (possibly while the
+    first pass is still streaming). Workers report output lines and completion
+    through a queue; status() texts are the chat placeholder to show.
+    """
+
+    def __init__(self, rid: str):
+        self.rid = rid
+        self.workers = max(1, UI_TOOL_CONCURRENCY)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tool")
+        self.events: "queue.Queue[Tuple[int, Optional[str]]]" = queue.Queue()
+        self.futures: Dict[int, Any] = {}      # id(call) -> Future
+        self.live: Dict[int, List[str]] = {}   # call number -> output lines
+        self.done = 0
+        self.t0 = _time_ms()
+
+    def submit(self, tc: Dict[str, Any]) -> None:
+        idx = len(self.futures) + 1
+        self.live[idx] = []
+        fut = self.pool.submit(_execute_tool_call, idx, tc, self.rid, lambda i, text: self.events.put((i, text)))
+        fut.add_done_callback(lambda _f, i=idx: self.events.put((i, None)))
+        self.futures[id(tc)] = fut
+
+    def _status(self, idx: int, text: Optional[str]) -> str:
+        if text is None:
+            self.done += 1
+        else:
+            self.live[idx].append(text)
+        return _live_tool_status(idx, len(self.futures), self.live[idx], self.done)
+
+    def pending(self) -> Optional[str]:
+        """Consume queued events without blocking; the latest status, or None if nothing happened."""
+        status = None
+        while True:
+            try:
+                idx, text = self.events.get_nowait()
+            except queue.Empty:
+                return status
+            status = self._status(idx, text)
+
+    def wait(self) -> Iterable[str]:
+        """Block until every submitted call finished, yielding statuses at most once per UI frame."""
+        gate = ui_stream.FrameGate(tokens=0)
+        status = None
+        while self.done < len(self.futures):
+            try:
+                idx, text = self.events.get(timeout=gate.due() if status else None)
+                status = self._status(idx, text)
+            except queue.Empty:
+                pass
+            if status and (gate.due() == 0 and gate.ready()):
+                yield status
+                status = None
+        if status:
+            yield status
+        trace("TOOL_CALLS_DONE", rid=self.rid, count=len(self.futures),
+              workers=self.workers, ms=_time_ms() - self.t0)
+
+    def result(self, tc: Dict[str, Any]) -> Dict[str, Any]:
+        fut = self.futures.get(id(tc))
+        if fut is None:
+            return {"error": "tool call was not run"}
+        try:
+            return fut.result()
+        except Exception as e:
+            trace("TOOL_CALL_ERROR", rid=self.rid, error=str(e))
+            return {"error": str(e)}
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def chat_send(history, user_message, temperature, max_tokens, sys_prompt,
+              stream_final, tools_enabled, auto_cont, max_cont):
+    """
+    One chat turn: first pass (with tools), sandbox tool calls, final pass and
+    auto-continue. Yields (history, "") updates for the Chatbot. Kept at module
+    level so load_chat.py can drive it without the UI.
+    """
+    rid = make_rid()
+    runner: Optional[_ToolRunner] = None
+    try:
+        trace("CHAT_INPUT", rid=rid,
+              msg_len=len(user_message or ""),
+              temp=float(temperature),
+              max_tokens=int(max_tokens),
+              stream=bool(stream_final),
+              tools=bool(tools_enabled),
+              auto=bool(auto_cont),
+              max_cont=int(max_cont))
+
+        history = history or []
+        history.append({"role": "user", "content": user_message or ""})
+
+        api_messages: List[Dict[str, Any]] = []
+        if sys_prompt and sys_prompt.strip():
+            api_messages.append({"role": "system", "content": sys_prompt})
+        api_messages.extend(history)
+        # api_messages stays complete (tool calls/results and continuations are added to it);
+        # each request sends it fitted to the context budget (see context_window.py)
+        prompt, ctx = context_window.fit(api_messages, int(max_tokens))
+        trace("CONTEXT", rid=rid, pass_no=0, history_msgs=len(history), **ctx)
+
+        tools = [PY_SANDBOX_TOOL] if tools_enabled else None
+        placeholder = {"role": "assistant", "content": "🔧 Executing in Python sandbox…"}
+        shown = False   # this turn's assistant message is already in history
+        if UI_STREAM_FIRST_PASS:
+            msg0: Dict[str, Any] = {}
+            for kind, value in _first_chat_pass_stream(prompt, float(temperature), int(max_tokens),
+                                                       tools, rid=rid):
+                if kind == "text":
+                    if runner is not None or not stream_final:
+                        continue
+                    if not shown:
+                        history.append({"role": "assistant", "content": ""})
+                        shown = True
+                    history[-1] = {"role": "assistant", "content": value}
+                    yield history, ""
+                elif kind == "tool_call":
+                    # Start the tool path as soon as the first call is complete
+                    if runner is None:
+                        gr.Info("Calling Python sandbox…")
+                        if shown:
+                            history[-1] = dict(placeholder)
+                        else:
+                            history.append(dict(placeholder))
+                            shown = True
+                        runner = _ToolRunner(rid)
+                    runner.submit(value)
+                    yield history, ""
+                else:
+                    msg0 = value
+                if runner is not None:
+                    status = runner.pending()
+                    if status:
+                        history[-1] = {"role": "assistant", "content": status}
+                        yield history, ""
+        else:
+            first = _first_chat_pass(prompt, float(temperature), int(max_tokens), tools, rid=rid)
+            msg0 = first["choices"][0]["message"]
+
+        tool_calls = msg0.get("tool_calls") or []
+        trace("TOOL_DETECTED", rid=rid, count=len(tool_calls))
+
+        # ------------------------- TOOL PATH -------------------------
+        if tool_calls:
+            if runner is None:
+                # Popup toast + inline status message
+                gr.Info("Calling Python sandbox…")
+                history.append(dict(placeholder))
+                runner = _ToolRunner(rid)
+                for tc in tool_calls:
+                    runner.submit(tc)
+
+            accum_images: List[Dict[str, Any]] = []
+
+            api_messages.append({
+                "role": "assistant",
+                "tool_calls": [
+                    {
+                        "id": tc.get("id"),
+                        "type": tc.get("type"),
+                        "function": tc.get("function"),
+                    } for tc in tool_calls
+                ],
+            })
+
+            for status in runner.wait():
+                history[-1] = {"role": "assistant", "content": status}
+                yield history, ""
+
+            # Tool messages go back in the order the model issued the calls
+            for tc in tool_calls:
+                result_payload = runner.result(tc)
+                accum_images.extend(result_payload.get("images") or [])
+                # the model gets the compact view; the UI keeps the full payload
+                content = json.dumps(result_payload, ensure_ascii=False)
+                if tool_result.TOOL_RESULT_COMPACT:
+                    full_chars = len(content)
+                    content = json.dumps(tool_result.compact(result_payload, _artifact_url), ensure_ascii=False)
+                    trace("TOOL_RESULT_COMPACT", rid=rid, tool_call_id=tc.get("id"),
+                          full_chars=full_chars, sent_chars=len(content))
+                api_messages.append({
+                    "role": "tool",
+                    "content": content,
+                    "tool_call_id": tc.get("id"),
+                })
+
+            # Final assistant message after tool: code fences stripped as it streams
+            history[-1] = {"role": "assistant", "content": ""}
+            for pair in _auto_continue_loop(
+                history,
+                api_messages,
+                float(temperature),
+                int(max_tokens),
+                bool(stream_final),
+                bool(auto_cont),
+                int(max_cont),
+                True,                  # strip fenced code
+                rid=rid,
+            ):
+                yield pair
+
+            # Always append visible Artifacts links (independent of model prose)
+            link_pairs = _links_from_images(accum_images)
+            if link_pairs:
+                appendix = "\n\n**Artifacts**:\n" + "\n".join([f"- [{n}]({u})" for n, u in link_pairs])
+                last = history[-1].get("content", "") or ""
+                history[-1]["content"] = last + appendix
+                # Emit one more update to refresh the Chat UI with the appended links
+                yield history, ""
+
+            return
+
+        # ---------------------- NO-TOOL PATH ------------------------
+        # The first pass already is the answer; only auto-continue may ask for more
+        if not shown:
+            history.append({"role": "assistant", "content": ""})
+        for pair in _auto_continue_loop(
+            history,
+            api_messages,
+            float(temperature),
+            int(max_tokens),
+            bool(stream_final),
+            bool(auto_cont),
+            int(max_cont),
+            False,    # do not strip code when no tool ran
+            rid=rid,
+            initial_text=msg0.get("content") or "",
+        ):
+            yield pair
+        return
+
+    except Exception as e:
+        trace("CHAT_ERROR", rid=rid, error=str(e))
+        history = history or []
+        history.append({"role": "assistant", "content": f"[UI error] {e}"})
+        yield history, ""
+    finally:
+        if runner is not None:
+            runner.close()
+
 # -------------------- UI --------------------
 def _init_models() -> Tuple[List[str], str]:
     ids = list_models()
@@ -547,141 +1201,6 @@ with gr.Blocks(title="LM Studio + MCP (max logging)") as demo:
             max_toks = gr.Slider(0, 4096, value=1024, step=16, label="max_tokens (0 = provider default)")
         send = gr.Button("Send", variant="primary")
 
-        def chat_send(history, user_message, temperature, max_tokens, sys_prompt,
-                      stream_final, tools_enabled, auto_cont, max_cont):
-            rid = make_rid()
-            try:
-                trace("CHAT_INPUT", rid=rid,
-                      msg_len=len(user_message or ""),
-                      temp=float(temperature),
-                      max_tokens=int(max_tokens),
-                      stream=bool(stream_final),
-                      tools=bool(tools_enabled),
-                      auto=bool(auto_cont),
-                      max_cont=int(max_cont))
-
-                history = history or []
-                history.append({"role": "user", "content": user_message or ""})
-
-                api_messages: List[Dict[str, Any]] = []
-                if sys_prompt and sys_prompt.strip():
-                    api_messages.append({"role": "system", "content": sys_prompt})
-                api_messages.extend(history)
-
-                tools = [PY_SANDBOX_TOOL] if tools_enabled else None
-                first = _first_chat_pass(api_messages, float(temperature), int(max_tokens), tools, rid=rid)
-
-                msg0 = first["choices"][0]["message"]
-                tool_calls = msg0.get("tool_calls") or []
-                trace("TOOL_DETECTED", rid=rid, count=len(tool_calls))
-
-                # ------------------------- TOOL PATH -------------------------
-                if tool_calls:
-                    # Popup toast + inline status message
-                    gr.Info("Calling Python sandbox…")
-                    history.append({"role": "assistant", "content": "🔧 Executing in Python sandbox…"})
-
-                    accum_images: List[Dict[str, Any]] = []
-
-                    api_messages.append({
-                        "role": "assistant",
-                        "tool_calls": [
-                            {
-                                "id": tc.get("id"),
-                                "type": tc.get("type"),
-                                "function": tc.get("function"),
-                            } for tc in tool_calls
-                        ],
-                    })
-
-                    for idx, tc in enumerate(tool_calls, start=1):
-                        fn = (tc.get("function") or {}).get("name", "") or ""
-                        args_str = (tc.get("function") or {}).get("arguments", "{}")
-                        try:
-                            args = json.loads(args_str) if isinstance(args_str, str) else (args_str or {})
-                        except Exception:
-                            args = {}
-
-                        result_payload: Dict[str, Any] = {"error": f"Unsupported tool: {fn}"}
-                        if fn == "python_sandbox_execute":
-                            code_to_run = args.get("code", "") or ""
-                            trace("TOOL_CALL_BEGIN", rid=rid, idx=idx, tool=fn,
-                                  len_code=len(code_to_run), code_hash=_sha(code_to_run))
-                            if UI_TRACE_INCLUDE_CODE:
-                                dump_blob("tool_code", rid, code_to_run, suffix="py")
-
-                            data = sandbox_execute_raw(code_to_run, rid=rid)
-
-                            imgs = data.get("images") or []
-                            for rec in imgs:
-                                fnm = rec.get("filename") or ""
-                                if ARTIFACTS_EXTERNAL_BASE and fnm:
-                                    rec["url"] = f"{ARTIFACTS_EXTERNAL_BASE}/{fnm}"
-                                    rec["iframe_url"] = rec["url"]
-                            result_payload = data
-                            accum_images.extend(result_payload.get("images") or [])
-
-                            trace("TOOL_CALL_RESULT", rid=rid, idx=idx,
-                                  rc=result_payload.get("returncode", None),
-                                  stdout_len=len(result_payload.get("stdout", "") or ""),
-                                  stderr_len=len(result_payload.get("stderr", "") or ""),
-                                  images=len((result_payload.get("images") or [])))
-
-                        api_messages.append({
-                            "role": "tool",
-                            "content": json.dumps(result_payload),
-                            "tool_call_id": tc.get("id"),
-                        })
-
-                    # Final assistant message after tool: non-stream + strip code
-                    history[-1] = {"role": "assistant", "content": ""}
-                    for pair in _auto_continue_loop(
-                        history,
-                        api_messages,
-                        float(temperature),
-                        int(max_tokens),
-                        False,                 # non-streamed when a tool ran
-                        bool(auto_cont),
-                        int(max_cont),
-                        True,                  # strip fenced code
-                        rid=rid,
-                    ):
-                        yield pair
-
-                    # Always append visible Artifacts links (independent of model prose)
-                    link_pairs = _links_from_images(accum_images)
-                    if link_pairs:
-                        appendix = "\n\n**Artifacts**:\n" + "\n".join([f"- [{n}]({u})" for n, u in link_pairs])
-                        last = history[-1].get("content", "") or ""
-                        history[-1]["content"] = last + appendix
-                        # Emit one more update to refresh the Chat UI with the appended links
-                        yield history, ""
-
-                    return
-
-                # ---------------------- NO-TOOL PATH ------------------------
-                history.append({"role": "assistant", "content": ""})
-                api_messages.append({"role": "assistant", "content": ""})
-                for pair in _auto_continue_loop(
-                    history,
-                    api_messages,
-                    float(temperature),
-                    int(max_tokens),
-                    bool(stream_final),
-                    bool(auto_cont),
-                    int(max_cont),
-                    False,    # do not strip code when no tool ran
-                    rid=rid,
-                ):
-                    yield pair
-                return
-
-            except Exception as e:
-                trace("CHAT_ERROR", rid=rid, error=str(e))
-                history = history or []
-                history.append({"role": "assistant", "content": f"[UI error] {e}"})
-                return history, ""
-
         send.click(
             chat_send,
             inputs=[chat, user_in, temp, max_toks, sys_prompt, stream_toggle, allow_tools, auto_continue, max_continues],
@@ -707,24 +1226,28 @@ with gr.Blocks(title="LM Studio + MCP (max logging)") as demo:
                 trace("COMP_BEGIN", rid=rid, stream=bool(stream))
                 dump_blob("comp_req", rid, payload)
                 if stream:
-                    with requests.post(url, json=payload, stream=True, timeout=600) as r:
+                    with http_client.post(url, json=payload, stream=True,
+                                          read_timeout=LMSTUDIO_READ_TIMEOUT, rid=rid) as r:
                         r.raise_for_status()
-                        full = ""
-                        for line in _iter_sse_lines(r, rid=rid):
+                        text = ui_stream.StreamText()
+                        for line in ui_stream.with_ticks(_iter_sse_lines(r, rid=rid), text.wait):
+                            if line is ui_stream.TICK:
+                                if text.tick():
+                                    yield text.text
+                                continue
                             try:
-                                obj = json.loads(line)
-                                delta = obj.get("choices", [{}])[0].get("text", "")
-                                if delta:
-                                    full += delta
-                                    if UI_TRACE_VERBOSE:
-                                        trace("COMP_CHUNK", rid=rid, add=len(delta), total=len(full))
-                                    yield full
-                            except Exception:
+                                delta = ui_stream.delta_content(ui_stream.json_loads(line), "text")
+                            except ValueError:
                                 continue
+                            if delta and text.add(delta):
+                                if UI_TRACE_VERBOSE:
+                                    trace("COMP_CHUNK", rid=rid, total=len(text.text), frames=text.gate.frames)
+                                yield text.text
+                        full = text.flush()
                     dump_blob("comp_resp_stream", rid, {"text": full})
                     yield full
                 else:
-                    r = requests.post(url, json=payload, timeout=600)
+                    r = http_client.post(url, json=payload, read_timeout=LMSTUDIO_READ_TIMEOUT, rid=rid)
                     r.raise_for_status()
                     data = r.json()
                     dump_blob("comp_resp", rid, data)
@@ -749,7 +1272,7 @@ with gr.Blocks(title="LM Studio + MCP (max logging)") as demo:
                 payload = {"model": MODEL_NAME, "input": [x for x in (s or "").splitlines() if x.strip()]}
                 trace("EMB_BEGIN", rid=rid, n=len(payload["input"]))
                 dump_blob("emb_req", rid, payload)
-                r = requests.post(url, json=payload, timeout=180)
+                r = http_client.post(url, json=payload, read_timeout=180, rid=rid)
                 r.raise_for_status()
                 data = r.json()
                 dump_blob("emb_resp", rid, data)
@@ -771,12 +1294,14 @@ with gr.Blocks(title="LM Studio + MCP (max logging)") as demo:
         rc = gr.Number(label="return code", precision=0)
         imgs_json = gr.JSON(label="images (raw)")
         links_table = gr.Dataframe(headers=["filename", "url", "viewer"], label="Resolved Links", row_count=(0, "dynamic"))
-        gallery = gr.Gallery(label="Embedded previews", columns=3, allow_preview=True, preview=True, height=320)
+        gallery = gr.Gallery(label="Embedded previews (click for full size)", columns=3, allow_preview=False, height=320)
+        full_image = gr.Image(label="Selected image (full size)", type="filepath", interactive=False)
         persist_btn = gr.Button("Download & Persist")
         persist_msg = gr.Textbox(label="Persist result", lines=2)
         persisted_files = gr.Files(label="Saved files")
 
-        run.click(lambda c: sandbox_execute(c), inputs=code, outputs=[stdout, stderr, rc, imgs_json, links_table, gallery])
+        run.click(sandbox_execute_live, inputs=code, outputs=[stdout, stderr, rc, imgs_json, links_table, gallery])
+        gallery.select(show_full_image, inputs=links_table, outputs=full_image)
         persist_btn.click(lambda imgs: persist_images(imgs), inputs=imgs_json, outputs=[persist_msg, persisted_files])
 
 # -------------- Auth + launch --------------
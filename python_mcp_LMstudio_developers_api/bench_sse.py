@@ -0,0 +1,153 @@
+# bench_sse.py
+"""
+Micro-benchmark for the UI's streaming path: SSE parsing and Chatbot frames.
+
+A synthetic LM Studio chat stream (--tokens chunks) is fed through a real
+requests.Response and parsed with each variant below. "frames" variants also
+serialize the Chatbot history once per UI update, which is what Gradio does
+for every yield, with --history-kb of earlier conversation in it:
+
+  str+json        iter_lines(decode_unicode=True) and json.loads (the old parser)
+  bytes+json      ui_stream.iter_sse_data and json.loads
+  bytes+orjson    ui_stream.iter_sse_data and orjson (if installed)
+  per-token       old assembly: full += delta and one frame per token
+  coalesced       ui_stream.StreamText frames (new deltas appended per frame)
+
+Frames use the gate's token limit only (the synthetic stream arrives at once,
+so the time gate never opens); at a real model's pace the time gate gives
+fewer frames still.
+
+  python bench_sse.py --tokens 4000 --history-kb 50
+"""
+from __future__ import annotations
+
+import io
+import json
+import time
+import argparse
+from typing import Callable, Dict, Iterator, List, Optional
+
+import requests
+
+import ui_stream
+
+
+def make_stream(tokens: int) -> bytes:
+    """An OpenAI/LM Studio-style chat.completion.chunk stream with one word per chunk."""
+    words = "The sandbox result shows the expected values and the figure was saved".split()
+    lines = []
+    for i in range(tokens):
+        chunk = {
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1700000000,
+            "model": "bench-model", "system_fingerprint": "bench-model",
+            "choices": [{"index": 0, "delta": {"content": " " + words[i % len(words)]},
+                         "logprobs": None, "finish_reason": None}],
+        }
+        lines.append(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+    lines.append(b"data: [DONE]\n\n")
+    return b"".join(lines)
+
+
+def _response(body: bytes) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.raw = io.BytesIO(body)
+    resp.encoding = "utf-8"
+    return resp
+
+
+def parse_str_json(body: bytes) -> Iterator[str]:
+    for raw in _response(body).iter_lines(decode_unicode=True):
+        if not raw:
+            continue
+        if raw.startswith("data:"):
+            raw = raw[len("data:"):].strip()
+        if raw == "[DONE]":
+            break
+        try:
+            yield json.loads(raw).get("choices", [{}])[0].get("delta", {}).get("content", "")
+        except Exception:
+            continue
+
+
+def _parse_bytes(loads: Callable) -> Callable[[bytes], Iterator[str]]:
+    def parse(body: bytes) -> Iterator[str]:
+        for raw in ui_stream.iter_sse_data(_response(body)):
+            try:
+                yield ui_stream.delta_content(loads(raw))
+            except ValueError:
+                continue
+    return parse
+
+
+def frames_per_token(deltas: Iterator[str], history: List[Dict[str, str]]) -> Dict[str, int]:
+    full, frames, sent = "", 0, 0
+    for delta in deltas:
+        if delta:
+            full += delta
+            frames += 1
+            sent += len(json.dumps(history + [{"role": "assistant", "content": full}]))
+    return {"frames": frames, "bytes_sent": sent}
+
+
+def frames_coalesced(deltas: Iterator[str], history: List[Dict[str, str]]) -> Dict[str, int]:
+    text = ui_stream.StreamText(ui_stream.FrameGate(frame_ms=1e9))   # token gate only, see module docstring
+    frames, sent = 0, 0
+    for delta in deltas:
+        if delta and text.add(delta):
+            frames += 1
+            sent += len(json.dumps(history + [{"role": "assistant", "content": text.text}]))
+    frames += 1
+    sent += len(json.dumps(history + [{"role": "assistant", "content": text.flush()}]))
+    return {"frames": frames, "bytes_sent": sent}
+
+
+def timed(fn: Callable[[], object], repeat: int) -> Dict[str, object]:
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return {"best_ms": round((best or 0.0) * 1000.0, 2), "result": out}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="SSE parsing and UI frame benchmark")
+    ap.add_argument("--tokens", type=int, default=4000, help="chunks in the synthetic stream")
+    ap.add_argument("--history-kb", type=int, default=50, help="earlier conversation serialized with each frame")
+    ap.add_argument("--repeat", type=int, default=5, help="runs per variant (best is reported)")
+    ap.add_argument("--frame-tokens", type=int, default=ui_stream.UI_STREAM_FRAME_TOKENS or 32)
+    args = ap.parse_args(argv)
+
+    body = make_stream(args.tokens)
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": "x" * 1024}
+               for i in range(args.history_kb)]
+    ui_stream.UI_STREAM_FRAME_TOKENS = args.frame_tokens
+    print(f"stream: {args.tokens} chunks, {len(body) / 1024:.0f} KB; history {args.history_kb} KB; "
+          f"orjson: {'yes' if ui_stream.orjson else 'no'}")
+
+    parsers: Dict[str, Callable[[bytes], Iterator[str]]] = {
+        "str+json": parse_str_json,
+        "bytes+json": _parse_bytes(json.loads),
+    }
+    if ui_stream.orjson is not None:
+        parsers["bytes+orjson"] = _parse_bytes(ui_stream.orjson.loads)
+
+    print(f"{'parse only':<28} {'ms':>9} {'us/chunk':>9}")
+    for name, parse in parsers.items():
+        r = timed(lambda: sum(1 for _ in parse(body)), args.repeat)
+        print(f"{name:<28} {r['best_ms']:>9.2f} {r['best_ms'] * 1000 / args.tokens:>9.2f}")
+
+    fast = parsers.get("bytes+orjson", parsers["bytes+json"])
+    print(f"{'parse + frames':<28} {'ms':>9} {'frames':>9} {'MB sent':>9}")
+    for name, run in (("str+json, per-token", lambda: frames_per_token(parse_str_json(body), history)),
+                      ("fast parse, per-token", lambda: frames_per_token(fast(body), history)),
+                      (f"fast parse, coalesced/{args.frame_tokens}", lambda: frames_coalesced(fast(body), history))):
+        r = timed(run, max(1, args.repeat // 2))
+        res = r["result"]
+        print(f"{name:<28} {r['best_ms']:>9.2f} {res['frames']:>9} {res['bytes_sent'] / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
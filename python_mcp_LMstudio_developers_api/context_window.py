@@ -0,0 +1,162 @@
+# context_window.py
+"""
+Token budget for the chat messages sent to LM Studio.
+
+fit() keeps the system prompt and the most recent turns (a user message and
+the assistant replies, tool calls and tool results after it) within UI_CONTEXT_TOKENS minus the room kept
+for the answer (max_tokens, or UI_CONTEXT_RESERVE when that is 0). Older turns
+are dropped; with UI_CONTEXT_OVERFLOW=digest (default) the questions of the
+dropped turns are listed, shortened, in the system message so the model still
+knows what came before.
+
+The cut point moves in steps of UI_CONTEXT_STEP x budget tokens rather than
+one turn at a time. LM Studio (llama.cpp) reuses its KV cache for the prompt
+prefix it has already processed; trimming a little every turn would change
+that prefix on every request and force a full prompt re-processing, which is
+the cost this module is meant to save.
+
+The UI calls fit() before every completion of a turn (first pass, the answer
+after tool results, auto-continue passes), so the tool output counts too. The
+newest turn is never cut; a huge tool result can still exceed the budget
+(ctx_over_budget), which is what tool_result.py's per-field budgets are for.
+
+Tokens are estimated from characters (UI_CHARS_PER_TOKEN) unless
+UI_TOKENIZER=tiktoken:<encoding> and tiktoken is installed. Neither matches
+the model's own tokenizer exactly, so keep some headroom in the budget.
+"""
+from __future__ import annotations
+
+import os
+import json
+import math
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+UI_CONTEXT_TOKENS = int(os.getenv("UI_CONTEXT_TOKENS", "8192"))       # 0 = send the full history
+UI_CONTEXT_RESERVE = int(os.getenv("UI_CONTEXT_RESERVE", "1024"))     # answer room when max_tokens is 0
+UI_CONTEXT_STEP = float(os.getenv("UI_CONTEXT_STEP", "0.25"))         # cut granularity, share of the budget
+UI_CONTEXT_OVERFLOW = os.getenv("UI_CONTEXT_OVERFLOW", "digest")      # "digest" or "drop"
+UI_CONTEXT_DIGEST_TOKENS = int(os.getenv("UI_CONTEXT_DIGEST_TOKENS", "256"))
+UI_TOKENIZER = os.getenv("UI_TOKENIZER", "estimate")                  # "estimate" or "tiktoken:<encoding>"
+UI_CHARS_PER_TOKEN = float(os.getenv("UI_CHARS_PER_TOKEN", "3.5"))
+
+MESSAGE_OVERHEAD = 4        # role and template tokens per message
+_DIGEST_ITEM_CHARS = 160
+
+
+def _make_counter() -> Tuple[str, Callable[[str], int]]:
+    if UI_TOKENIZER.startswith("tiktoken:"):
+        try:
+            import tiktoken
+            enc = tiktoken.get_encoding(UI_TOKENIZER.split(":", 1)[1])
+            # history is re-counted every turn; encoding is the expensive part
+            return UI_TOKENIZER, lru_cache(maxsize=4096)(lambda text: len(enc.encode(text, disallowed_special=())))
+        except Exception:
+            pass  # not installed or unknown encoding: fall back to the estimate
+    return "estimate", lambda text: math.ceil(len(text) / UI_CHARS_PER_TOKEN)
+
+
+TOKENIZER, _count = _make_counter()
+
+
+def count_text(text: str) -> int:
+    return _count(text) if text else 0
+
+
+def count_message(msg: Dict[str, Any]) -> int:
+    content = msg.get("content")
+    n = MESSAGE_OVERHEAD + count_text(content if isinstance(content, str) else str(content or ""))
+    for tc in msg.get("tool_calls") or []:   # the code the model sent to the sandbox
+        fn = tc.get("function") or {}
+        args = fn.get("arguments")
+        n += MESSAGE_OVERHEAD + count_text(str(fn.get("name") or "")) + \
+            count_text(args if isinstance(args, str) else json.dumps(args or {}))
+    return n
+
+
+def _turns(history: List[Dict[str, Any]], newest_from: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """Split messages into turns; each starts at a user message, except that
+    history[newest_from:] stays one turn (auto-continue prompts are user messages)."""
+    turns: List[List[Dict[str, Any]]] = []
+    for i, msg in enumerate(history):
+        if not turns or msg.get("role") == "user" and (newest_from is None or i <= newest_from):
+            turns.append([msg])
+        else:
+            turns[-1].append(msg)
+    return turns
+
+
+def _digest(dropped: List[List[Dict[str, Any]]]) -> str:
+    """Shortened questions of the dropped turns, newest kept when over UI_CONTEXT_DIGEST_TOKENS."""
+    items: List[str] = []
+    used = count_text("Earlier in this conversation (not shown in full) the user asked:\n")
+    for turn in reversed(dropped):
+        text = " ".join(str(turn[0].get("content") or "").split())
+        if turn[0].get("role") != "user" or not text:
+            continue
+        if len(text) > _DIGEST_ITEM_CHARS:
+            text = text[:_DIGEST_ITEM_CHARS - 1] + "…"
+        cost = count_text(f"- {text}\n")
+        if used + cost > UI_CONTEXT_DIGEST_TOKENS:
+            break
+        items.append(f"- {text}")
+        used += cost
+    if not items:
+        return ""
+    return "Earlier in this conversation (not shown in full) the user asked:\n" + "\n".join(reversed(items))
+
+
+def fit(messages: List[Dict[str, Any]], max_tokens: int = 0,
+        turn_start: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Trim chat 'messages' (optional leading system message, then the history,
+    ending with the new user message and whatever followed it) to the budget.
+    turn_start is the index in 'messages' of that user message when later user
+    messages belong to the same turn. Returns the messages to send and trace
+    fields: tokens sent, tokens saved, turns dropped, budget. The newest turn
+    is always kept, even if it alone exceeds the budget.
+    """
+    system = messages[0] if messages and messages[0].get("role") == "system" else None
+    history = messages[1:] if system is not None else list(messages)
+    offset = 1 if system is not None else 0
+    turns = _turns(history, None if turn_start is None else turn_start - offset)
+    sizes = [sum(count_message(m) for m in t) for t in turns]
+    fixed = count_message(system) if system is not None else 0
+    total = fixed + sum(sizes)
+    stats: Dict[str, Any] = {"ctx_tokens": total, "ctx_saved": 0, "ctx_dropped_turns": 0,
+                             "ctx_budget": 0, "ctx_tokenizer": TOKENIZER}
+    if UI_CONTEXT_TOKENS <= 0:
+        return messages, stats
+
+    budget = UI_CONTEXT_TOKENS - (max_tokens if max_tokens > 0 else UI_CONTEXT_RESERVE)
+    stats["ctx_budget"] = budget
+    if total <= budget or len(turns) <= 1:
+        stats["ctx_over_budget"] = total > budget
+        return messages, stats
+
+    # Drop whole turns from the front, rounding the amount up to a multiple of
+    # 'step' so the cut (and with it the cached prompt prefix) stays put for
+    # several turns.
+    digest_room = UI_CONTEXT_DIGEST_TOKENS if UI_CONTEXT_OVERFLOW == "digest" else 0
+    step = max(1, int(budget * UI_CONTEXT_STEP))
+    excess = total - (budget - digest_room)
+    target = math.ceil(excess / step) * step
+    cut, dropped_tokens = 0, 0
+    while cut < len(turns) - 1 and dropped_tokens < target:
+        dropped_tokens += sizes[cut]
+        cut += 1
+    kept = [m for t in turns[cut:] for m in t]
+
+    out: List[Dict[str, Any]] = []
+    digest = _digest(turns[:cut]) if digest_room else ""
+    if system is not None:
+        content = str(system.get("content") or "")
+        out.append({**system, "content": content + ("\n\n" + digest if digest else "")})
+    elif digest:
+        out.append({"role": "system", "content": digest})
+    out.extend(kept)
+
+    sent = sum(count_message(m) for m in out)
+    stats.update({"ctx_tokens": sent, "ctx_saved": total - sent, "ctx_dropped_turns": cut,
+                  "ctx_over_budget": sent > budget})
+    return out, stats
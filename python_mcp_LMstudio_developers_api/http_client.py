@@ -0,0 +1,155 @@
+# http_client.py
+"""
+Shared outbound HTTP for the UI (LM Studio and the sandbox).
+
+All calls go through one requests.Session, so connections are kept alive and
+reused from a per-host pool instead of opening a new TCP connection per call.
+Timeouts are (connect, read) pairs: a dead host fails after HTTP_CONNECT_TIMEOUT
+while a slow generation still gets the full read timeout. Failed connects are
+retried with exponential backoff for every method (nothing was sent yet);
+read errors and 502/503/504 are retried only for idempotent methods (GET,
+HEAD, ...), never for POSTs that start a generation or a sandbox run.
+
+Each request is reported to the trace hook (set_trace) with its latency to
+response headers and the host's pool counters; stats() returns the totals.
+"""
+from __future__ import annotations
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "8"))           # hosts with a cached pool
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))      # kept-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.3"))             # sleeps 0, 2x, 4x ... this
+
+_session: Optional[requests.Session] = None
+_adapter: Optional[HTTPAdapter] = None
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+_trace: Optional[Callable[..., None]] = None
+
+
+def _retry() -> Retry:
+    return Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        other=0,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,   # the caller's raise_for_status() reports the last response
+    )
+
+
+def session() -> requests.Session:
+    global _session, _adapter
+    with _lock:
+        if _session is None:
+            _adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                                   max_retries=_retry())
+            s = requests.Session()
+            s.mount("http://", _adapter)
+            s.mount("https://", _adapter)
+            _session = s
+        return _session
+
+
+def timeout(read: float) -> Tuple[float, float]:
+    """(connect, read) pair for requests' timeout= argument."""
+    return (HTTP_CONNECT_TIMEOUT, read)
+
+
+def set_trace(fn: Optional[Callable[..., None]]) -> None:
+    """fn(marker, rid=..., **fields) is called once per request (the UI's trace())."""
+    global _trace
+    _trace = fn
+
+
+def _host(url: str) -> str:
+    p = urlparse(url)
+    return f"{p.scheme}://{p.netloc}"
+
+
+def _pool_counters() -> Dict[str, Tuple[int, int]]:
+    """host -> (connections opened, requests sent) from urllib3's pools."""
+    out: Dict[str, Tuple[int, int]] = {}
+    if _adapter is None:
+        return out
+    pools = _adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = f"{pool.scheme}://{pool.host}" + (f":{pool.port}" if pool.port else "")
+        conns, reqs = out.get(host, (0, 0))
+        out[host] = (conns + pool.num_connections, reqs + pool.num_requests)
+    return out
+
+
+def _record(method: str, url: str, rid: Optional[str], ms: float,
+            status: Optional[int], error: Optional[str]) -> None:
+    host = _host(url)
+    with _lock:
+        st = _stats.setdefault(host, {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        st["requests"] += 1
+        st["errors"] += 1 if error or (status or 0) >= 500 else 0
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+    if _trace is not None:
+        conns, reqs = _pool_counters().get(host, (0, 0))
+        _trace("HTTP", rid=rid, method=method, url=url, status=status, ms=round(ms, 1),
+               pool_conns=conns, pool_reqs=reqs, error=error)
+
+
+def request(method: str, url: str, *, read_timeout: float, rid: Optional[str] = None,
+            **kwargs: Any) -> requests.Response:
+    """session().request() with a (connect, read) timeout and stats/trace bookkeeping.
+
+    The latency recorded is time to response headers; for stream=True the body
+    is read later by the caller.
+    """
+    t0 = time.perf_counter()
+    try:
+        resp = session().request(method, url, timeout=timeout(read_timeout), **kwargs)
+    except Exception as e:
+        _record(method, url, rid, (time.perf_counter() - t0) * 1000.0, None, f"{type(e).__name__}: {e}")
+        raise
+    _record(method, url, rid, (time.perf_counter() - t0) * 1000.0, resp.status_code, None)
+    return resp
+
+
+def get(url: str, *, read_timeout: float, rid: Optional[str] = None, **kwargs: Any) -> requests.Response:
+    return request("GET", url, read_timeout=read_timeout, rid=rid, **kwargs)
+
+
+def post(url: str, *, read_timeout: float, rid: Optional[str] = None, **kwargs: Any) -> requests.Response:
+    return request("POST", url, read_timeout=read_timeout, rid=rid, **kwargs)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Per host: requests, errors, mean/max latency, connections opened and reuse ratio."""
+    counters = _pool_counters()
+    with _lock:
+        out: Dict[str, Dict[str, Any]] = {}
+        for host, st in _stats.items():
+            conns, reqs = counters.get(host, (0, 0))
+            out[host] = {
+                "requests": int(st["requests"]),
+                "errors": int(st["errors"]),
+                "mean_ms": round(st["total_ms"] / st["requests"], 1) if st["requests"] else None,
+                "max_ms": round(st["max_ms"], 1),
+                "connections_opened": conns,
+                "connection_reuse": round(1.0 - conns / reqs, 3) if reqs else None,
+            }
+        return out
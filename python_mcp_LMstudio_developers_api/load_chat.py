@@ -0,0 +1,171 @@
+# load_chat.py
+"""
+Load driver for the Gradio chat pipeline (chat_send), without a browser.
+
+Runs N concurrent chat sessions, each sending --turns messages through
+chat_send exactly as the Send button does, and reports per-turn end-to-end
+latency and time to first token (first assistant text that is not the tool
+status placeholder) as p50/p95/p99, plus turn throughput. By default an
+in-process mock LM Studio (mock_lmstudio.py) is started, so only the UI code,
+the mock's pacing and the sandbox are measured; point --lmstudio-url at a
+real server instead to measure the model. Tool calls go to SANDBOX_BASE_URL
+(use --no-tools when no sandbox is running).
+
+  python load_chat.py --sessions 1,4,8 --turns 3 --latency-ms 300 --tps 40
+  python load_chat.py --replay logs/blobs --sessions 4
+  python load_chat.py --lmstudio-url http://10.11.11.123:1234 --sessions 2 --no-tools
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import mock_lmstudio
+
+HERE = Path(__file__).resolve().parent
+_TOOL_PLACEHOLDER = "🔧"
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def _dist(values: List[float]) -> Dict[str, Optional[float]]:
+    return {f"p{p}_ms": (round(percentile(values, p), 1) if values else None) for p in (50, 95, 99)}
+
+
+def _import_app(lmstudio_url: str, model: str):
+    """Import the UI module against the given endpoint (its import lists models and builds the Blocks)."""
+    os.environ["LMSTUDIO_BASE_URL"] = lmstudio_url
+    os.environ["MODEL_NAME"] = model
+    os.environ.setdefault("UI_LOG_DIR", str(Path(tempfile.gettempdir()) / "load_chat_logs"))
+    os.environ.setdefault("UI_TRACE_VERBOSE", "0")
+    sys.path.insert(0, str(HERE))
+    import app_gradio_lmstudio_mcp_stream_auth_models_v9 as app
+    return app
+
+
+def run_turn(app, history: List[Dict[str, Any]], message: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Drive one chat_send call to completion; returns timings and the final history."""
+    t0 = time.perf_counter()
+    ttft = None
+    updates = 0
+    used_tool = False
+    for hist, _ in app.chat_send(history, message, args.temperature, args.max_tokens, app.SYSTEM_PROMPT,
+                                 args.stream, not args.no_tools, args.auto_continue, args.max_continues):
+        updates += 1
+        history = hist
+        content = str((hist[-1] if hist else {}).get("content") or "")
+        if content.startswith(_TOOL_PLACEHOLDER):
+            used_tool = True
+        elif content and ttft is None and hist[-1].get("role") == "assistant":
+            ttft = (time.perf_counter() - t0) * 1000.0
+    last = str((history[-1] if history else {}).get("content") or "")
+    return {
+        "e2e_ms": (time.perf_counter() - t0) * 1000.0,
+        "ttft_ms": ttft,
+        "updates": updates,
+        "tool": used_tool,
+        "error": last if last.startswith("[UI error]") else None,
+        "history": history,
+    }
+
+
+def run_sessions(app, n_sessions: int, args: argparse.Namespace) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def session(i: int) -> None:
+        history: List[Dict[str, Any]] = []
+        for t in range(args.turns):
+            res = run_turn(app, history, args.prompt.format(session=i, turn=t + 1), args)
+            history = res.pop("history")
+            with lock:
+                results.append(res)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+        for f in [pool.submit(session, i) for i in range(n_sessions)]:
+            f.result()
+    wall = time.perf_counter() - t0
+    ok = [r for r in results if not r["error"]]
+    return {
+        "sessions": n_sessions,
+        "turns": len(results),
+        "errors": len(results) - len(ok),
+        "first_error": next((r["error"] for r in results if r["error"]), None),
+        "tool_turns": sum(1 for r in ok if r["tool"]),
+        "wall_s": round(wall, 3),
+        "turns_per_s": round(len(ok) / wall, 3) if wall > 0 else None,
+        "e2e": _dist([r["e2e_ms"] for r in ok]),
+        "ttft": _dist([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]),
+        "updates_mean": round(sum(r["updates"] for r in ok) / len(ok), 1) if ok else None,
+        "http": app.http_client.stats(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Concurrent chat_send load test")
+    ap.add_argument("--sessions", default="1,4", help="comma-separated concurrent session counts")
+    ap.add_argument("--turns", type=int, default=2, help="messages per session")
+    ap.add_argument("--prompt", default="Session {session}, turn {turn}: compute something and plot it.")
+    ap.add_argument("--lmstudio-url", default=None, help="use this server instead of the in-process mock")
+    ap.add_argument("--no-tools", action="store_true", help="do not offer the sandbox tool")
+    ap.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True, help="stream the final answer")
+    ap.add_argument("--auto-continue", action=argparse.BooleanOptionalAction, default=False)
+    ap.add_argument("--max-continues", type=int, default=1)
+    ap.add_argument("--temperature", type=float, default=0.7)
+    ap.add_argument("--max-tokens", type=int, default=512)
+    ap.add_argument("--out", default="", help="JSON result file (default: logs/load-chat-<time>.json)")
+    mock_lmstudio.add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    mock = None
+    url = args.lmstudio_url
+    if not url:
+        mock, url = mock_lmstudio.start(mock_lmstudio.config_from_args(args))
+        print(f"mock LM Studio on {url}")
+    app = _import_app(url, (args.model or ["mock-model"])[0])
+
+    report: Dict[str, Any] = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "lmstudio_url": url,
+        "mock": None if args.lmstudio_url else {"latency_ms": args.latency_ms, "tps": args.tps,
+                                                "tokens": args.tokens, "replay": args.replay},
+        "sandbox_url": None if args.no_tools else app.SANDBOX_BASE_URL,
+        "stream": args.stream,
+        "runs": [],
+    }
+    for n in [int(x) for x in args.sessions.split(",") if x]:
+        res = run_sessions(app, n, args)
+        report["runs"].append(res)
+        print(f"sessions={n:<3} turns={res['turns']:<4} err={res['errors']:<3} tools={res['tool_turns']:<3} "
+              f"e2e p50/p95/p99={res['e2e']['p50_ms']}/{res['e2e']['p95_ms']}/{res['e2e']['p99_ms']} ms  "
+              f"ttft p50/p95={res['ttft']['p50_ms']}/{res['ttft']['p95_ms']} ms  {res['turns_per_s']} turns/s")
+        if res["first_error"]:
+            print(f"  first error: {res['first_error'][:300]}")
+
+    out = Path(args.out) if args.out else Path(os.environ["UI_LOG_DIR"]) / f"load-chat-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"wrote {out}")
+    if mock is not None:
+        mock.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# mock_lmstudio.py
+"""
+Local stand-in for LM Studio's OpenAI-compatible API, for exercising the chat
+pipeline without a GPU:
+
+  GET  /v1/models
+  POST /v1/chat/completions   (stream and non-stream, tool calls included)
+  POST /v1/completions        (stream and non-stream)
+  POST /v1/embeddings         (deterministic vectors derived from the text)
+
+Timing is configurable: --latency-ms before the first token, then --tps
+tokens per second. Answers are either synthetic (a tool call running
+--tool-code for a --tool-rate share of turns that offer tools, otherwise
+--tokens words of filler) or replayed from the blobs the UI writes with
+UI_TRACE_SAVE_BLOBS=1 (--replay <UI_LOG_DIR>/blobs): per recorded turn,
+chat_first_resp is returned for the first pass (or a tool call built from
+sandbox_req_code / tool_code), then chat_final_stream_result /
+chat_final_resp for the following passes. Recorded turns are handed out
+round-robin.
+
+  python mock_lmstudio.py --port 1235 --latency-ms 300 --tps 40
+  LMSTUDIO_BASE_URL=http://127.0.0.1:1235 python app_gradio_lmstudio_mcp_stream_auth_models_v9.py
+"""
+from __future__ import annotations
+
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+_FILLER = ("The sandbox result shows the expected values and the figure was saved to the run folder. "
+           "Each step is summarised below with the key numbers and a short interpretation. ").split()
+_DEFAULT_TOOL_CODE = "import math\nprint('mock tool call', math.pi)\n"
+_MAX_TURNS = 1000
+# The UI's auto-continue prompt: a user message that continues the current turn
+_CONTINUE_PREFIX = "Continue exactly where you left off"
+
+
+@dataclass
+class MockConfig:
+    models: List[str] = field(default_factory=lambda: ["mock-model"])
+    latency_ms: float = 200.0       # before the first token (prefill)
+    tps: float = 50.0               # tokens per second after that; 0 = no pacing
+    tokens: int = 120               # length of synthetic answers
+    tool_rate: float = 1.0          # share of tool-enabled first passes answered with a tool call
+    tool_code: str = _DEFAULT_TOOL_CODE
+    tool_calls: int = 1             # calls per synthetic tool message
+    embedding_dim: int = 384
+    replay_dir: Optional[str] = None
+    seed: Optional[int] = None
+
+
+@dataclass
+class _Recording:
+    rid: str
+    first_resp: Optional[Dict[str, Any]] = None
+    code: Optional[str] = None
+    finals: List[str] = field(default_factory=list)
+
+
+@dataclass
+class _Turn:
+    recording: Optional[_Recording]
+    finals: List[str]
+
+
+def load_recordings(blob_dir: str) -> List[_Recording]:
+    """Group dump_blob files ("<ms>_<rid>_<kind>.<ext>") by request id, oldest first."""
+    by_rid: "OrderedDict[str, _Recording]" = OrderedDict()
+    for path in sorted(Path(blob_dir).iterdir(), key=lambda p: p.name):
+        parts = path.name.split("_", 2)
+        if len(parts) != 3 or not parts[0].isdigit():
+            continue
+        rid, kind = parts[1], parts[2].rsplit(".", 1)[0]
+        rec = by_rid.setdefault(rid, _Recording(rid))
+        try:
+            text = path.read_text(encoding="utf-8")
+            if kind == "chat_first_resp":
+                rec.first_resp = json.loads(text)
+            elif kind in ("sandbox_req_code", "tool_code") and rec.code is None:
+                rec.code = text
+            elif kind == "chat_final_stream_result":
+                rec.finals.append(json.loads(text).get("text") or "")
+            elif kind == "chat_final_resp":
+                rec.finals.append(json.loads(text)["choices"][0]["message"].get("content") or "")
+        except (OSError, ValueError, KeyError, IndexError):
+            continue
+    return [r for r in by_rid.values() if r.first_resp or r.code or r.finals]
+
+
+class MockBackend:
+    """Decides what to answer; the HTTP handler only paces and frames it."""
+
+    def __init__(self, cfg: MockConfig):
+        self.cfg = cfg
+        self.recordings = load_recordings(cfg.replay_dir) if cfg.replay_dir else []
+        self._rng = random.Random(cfg.seed)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._turns: "OrderedDict[str, _Turn]" = OrderedDict()
+        self.requests = 0
+
+    @staticmethod
+    def _key(messages: List[Dict[str, Any]]) -> str:
+        return hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def _find_turn(self, messages: List[Dict[str, Any]]) -> Optional[_Turn]:
+        # A fresh user message starts a new turn; later passes of a turn (after tool
+        # results or an auto-continue prompt) extend the messages of its first pass
+        last = messages[-1] if messages else {}
+        if last.get("role") == "user" and not str(last.get("content") or "").startswith(_CONTINUE_PREFIX):
+            return None
+        for k in range(len(messages) - 1, 0, -1):
+            turn = self._turns.get(self._key(messages[:k]))
+            if turn is not None:
+                return turn
+        return None
+
+    def _filler(self, n: Optional[int] = None) -> str:
+        n = n or self.cfg.tokens
+        return " ".join(self._rng.choice(_FILLER) for _ in range(n)) + "."
+
+    def chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """{"content": str} or {"tool_calls": [...]} for one chat request."""
+        messages = body.get("messages") or []
+        with self._lock:
+            self.requests += 1
+            turn = self._find_turn(messages)
+            if turn is not None:
+                return {"content": turn.finals.pop(0) if turn.finals else self._filler()}
+
+            rec = None
+            if self.recordings:
+                rec = self.recordings[self._next % len(self.recordings)]
+                self._next += 1
+            self._turns[self._key(messages)] = _Turn(rec, list(rec.finals) if rec else [])
+            while len(self._turns) > _MAX_TURNS:
+                self._turns.popitem(last=False)
+
+            if rec is not None and rec.first_resp:
+                msg = (rec.first_resp.get("choices") or [{}])[0].get("message") or {}
+                if msg.get("tool_calls") and body.get("tools"):
+                    return {"tool_calls": msg["tool_calls"]}
+                return {"content": msg.get("content") or ""}
+            wants_tool = bool(body.get("tools")) and self._rng.random() < self.cfg.tool_rate
+            if wants_tool:
+                code = rec.code if rec is not None and rec.code else self.cfg.tool_code
+                return {"tool_calls": [{
+                    "id": f"call_{uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": "python_sandbox_execute", "arguments": json.dumps({"code": code})},
+                } for _ in range(max(1, self.cfg.tool_calls))]}
+            if rec is not None and rec.finals:
+                return {"content": rec.finals[0]}
+            return {"content": self._filler()}
+
+    def completion(self, body: Dict[str, Any]) -> str:
+        with self._lock:
+            self.requests += 1
+            return self._filler()
+
+    def embedding(self, text: str) -> List[float]:
+        out: List[float] = []
+        seed = hashlib.sha256(text.encode("utf-8")).digest()
+        while len(out) < self.cfg.embedding_dim:
+            seed = hashlib.sha256(seed).digest()
+            out.extend((b - 127.5) / 127.5 for b in seed)
+        return out[: self.cfg.embedding_dim]
+
+
+def tokens_of(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text or "")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive; streams use chunked encoding
+    backend: MockBackend            # set on the server subclass
+
+    def log_message(self, fmt: str, *args: Any) -> None:  # quiet by default
+        pass
+
+    # ---- framing ----
+    def _json(self, obj: Any, status: int = 200) -> None:
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _sse(self, frames: Iterator[Dict[str, Any]]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for frame in frames:
+                self._chunk(b"data: " + json.dumps(frame).encode("utf-8") + b"\n\n")
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+    # ---- pacing ----
+    def _prefill(self) -> None:
+        time.sleep(max(0.0, self.backend.cfg.latency_ms) / 1000.0)
+
+    def _paced(self, pieces: List[str]) -> Iterator[str]:
+        tps = self.backend.cfg.tps
+        start = time.monotonic()
+        for i, piece in enumerate(pieces):
+            if tps > 0:
+                delay = start + i / tps - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield piece
+
+    def _generate_all(self, n_tokens: int) -> None:
+        self._prefill()
+        if self.backend.cfg.tps > 0:
+            time.sleep(n_tokens / self.backend.cfg.tps)
+
+    # ---- routes ----
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/v1/models":
+            self._json({"object": "list", "data": [{"id": m, "object": "model", "owned_by": "mock"}
+                                                   for m in self.backend.cfg.models]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self) -> None:
+        try:
+            body = self._body()
+        except ValueError:
+            self._json({"error": "invalid JSON"}, 400)
+            return
+        route = self.path.rstrip("/")
+        if route == "/v1/chat/completions":
+            self._chat(body)
+        elif route == "/v1/completions":
+            self._completion(body)
+        elif route == "/v1/embeddings":
+            inputs = body.get("input") or []
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._json({"object": "list", "model": body.get("model"),
+                        "data": [{"object": "embedding", "index": i, "embedding": self.backend.embedding(str(t))}
+                                 for i, t in enumerate(inputs)]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def _chat(self, body: Dict[str, Any]) -> None:
+        answer = self.backend.chat(body)
+        cid, created, model = f"chatcmpl-{uuid4().hex[:12]}", int(time.time()), body.get("model") or "mock-model"
+        calls = answer.get("tool_calls")
+        content = answer.get("content") or ""
+        pieces = [] if calls else tokens_of(content)
+        finish = "tool_calls" if calls else "stop"
+
+        if not body.get("stream"):
+            self._generate_all(sum(len(tokens_of(c["function"]["arguments"])) for c in calls) if calls else len(pieces))
+            message: Dict[str, Any] = {"role": "assistant", "content": None if calls else content}
+            if calls:
+                message["tool_calls"] = calls
+            self._json({
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+                "usage": {"completion_tokens": len(pieces)},
+            })
+            return
+
+        def frames() -> Iterator[Dict[str, Any]]:
+            def frame(delta: Dict[str, Any], reason: Optional[str] = None) -> Dict[str, Any]:
+                return {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": reason}]}
+            self._prefill()
+            yield frame({"role": "assistant"})
+            if calls:
+                for i, call in enumerate(calls):
+                    yield frame({"tool_calls": [{"index": i, "id": call.get("id"), "type": "function",
+                                                 "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                    for piece in self._paced(tokens_of(call["function"]["arguments"])):
+                        yield frame({"tool_calls": [{"index": i, "function": {"arguments": piece}}]})
+            else:
+                for piece in self._paced(pieces):
+                    yield frame({"content": piece})
+            yield frame({}, finish)
+        self._sse(frames())
+
+    def _completion(self, body: Dict[str, Any]) -> None:
+        pieces = tokens_of(self.backend.completion(body))
+        cid, created, model = f"cmpl-{uuid4().hex[:12]}", int(time.time()), body.get("model") or "mock-model"
+        if not body.get("stream"):
+            self._generate_all(len(pieces))
+            self._json({"id": cid, "object": "text_completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "text": "".join(pieces), "finish_reason": "stop"}]})
+            return
+
+        def frames() -> Iterator[Dict[str, Any]]:
+            self._prefill()
+            for piece in self._paced(pieces):
+                yield {"id": cid, "object": "text_completion", "created": created, "model": model,
+                       "choices": [{"index": 0, "text": piece, "finish_reason": None}]}
+        self._sse(frames())
+
+
+def start(cfg: MockConfig, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Serve in a background thread; returns (server, base URL). Port 0 picks a free port."""
+    backend = MockBackend(cfg)
+    handler = type("MockHandler", (_Handler,), {"backend": backend})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-lmstudio", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_arguments(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--latency-ms", type=float, default=200.0, help="delay before the first token")
+    ap.add_argument("--tps", type=float, default=50.0, help="tokens per second (0 = unpaced)")
+    ap.add_argument("--tokens", type=int, default=120, help="words per synthetic answer")
+    ap.add_argument("--tool-rate", type=float, default=1.0, help="share of tool-enabled turns that call the tool")
+    ap.add_argument("--tool-calls", type=int, default=1, help="tool calls per synthetic tool message")
+    ap.add_argument("--tool-code", default=_DEFAULT_TOOL_CODE, help="code sent in synthetic tool calls")
+    ap.add_argument("--replay", default=None, help="dump_blob directory to replay (UI_LOG_DIR/blobs)")
+    ap.add_argument("--model", action="append", default=None, help="model id(s) listed by /v1/models")
+    ap.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        models=args.model or ["mock-model"],
+        latency_ms=args.latency_ms,
+        tps=args.tps,
+        tokens=args.tokens,
+        tool_rate=args.tool_rate,
+        tool_code=args.tool_code,
+        tool_calls=args.tool_calls,
+        replay_dir=args.replay,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Mock LM Studio (OpenAI-compatible) server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1235)
+    add_arguments(ap)
+    args = ap.parse_args()
+    cfg = config_from_args(args)
+    server, url = start(cfg, args.host, args.port)
+    replay = f", replaying {len(server.RequestHandlerClass.backend.recordings)} turn(s)" if cfg.replay_dir else ""
+    print(f"mock LM Studio on {url} (latency {cfg.latency_ms:g} ms, {cfg.tps:g} tok/s{replay})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
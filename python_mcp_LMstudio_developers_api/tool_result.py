@@ -0,0 +1,162 @@
+# tool_result.py
+"""
+Compact view of a run result for the model (the tool message content).
+
+REST clients and the UI display the full result: stdout/stderr up to the
+MAX_OUTPUT_* limits, every artifact record, timings, rusage. Sent back to the
+model as-is, a large dataframe print or a long traceback costs thousands of
+context tokens and slows the next completion. compact() keeps what the model
+needs to continue:
+
+  - stdout/stderr: identical tracebacks kept once, runs of repeated lines (or
+    2-4 line blocks such as recursion frames) collapsed, then cut at
+    line boundaries to TOOL_RESULT_STDOUT_TOKENS / TOOL_RESULT_STDERR_TOKENS,
+    keeping head and tail (stderr keeps more of the tail, where the exception is)
+  - artifacts: [{"file", "url"}], at most TOOL_RESULT_MAX_ARTIFACTS
+  - full_output: where the complete stream is (the run directory's log file)
+  - returncode, run_id, error, non-empty timings, a short profile summary
+
+Tokens are estimated at TOOL_RESULT_CHARS_PER_TOKEN characters each.
+
+This file exists twice, byte for byte: MCP_core_server/tool_result.py and
+python_mcp_LMstudio_developers_api/tool_result.py. The two images are built
+from separate Docker contexts, so neither can COPY the other's; apply every
+change to both (`cmp` the two files before committing).
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TOOL_RESULT_COMPACT = os.getenv("TOOL_RESULT_COMPACT", "1") in ("1", "true", "TRUE", "yes", "on")
+TOOL_RESULT_STDOUT_TOKENS = int(os.getenv("TOOL_RESULT_STDOUT_TOKENS", "1000"))
+TOOL_RESULT_STDERR_TOKENS = int(os.getenv("TOOL_RESULT_STDERR_TOKENS", "800"))
+TOOL_RESULT_MAX_ARTIFACTS = int(os.getenv("TOOL_RESULT_MAX_ARTIFACTS", "20"))
+TOOL_RESULT_CHARS_PER_TOKEN = float(os.getenv("TOOL_RESULT_CHARS_PER_TOKEN", "3.5"))
+
+_TB_HEAD = "Traceback (most recent call last):"
+_MAX_PERIOD = 4         # longest repeated block collapse_repeats() looks for
+_PROFILE_ROWS = 10
+_MEMORY_ROWS = 5
+
+# relpath under TEMP_DIR -> absolute URL
+Linker = Callable[[str], str]
+
+
+def collapse_repeats(text: str) -> str:
+    """Replace 3+ consecutive copies of a 1-4 line block with one copy and a count."""
+    lines = text.split("\n")
+    out: List[str] = []
+    i, n = 0, len(lines)
+    while i < n:
+        for p in range(1, _MAX_PERIOD + 1):
+            block = lines[i:i + p]
+            if len(block) < p or not any(line.strip() for line in block):
+                continue
+            j, k = i + p, 0
+            while lines[j:j + p] == block:
+                j += p
+                k += 1
+            if k >= 2:
+                out.extend(block)
+                out.append(f"[previous {p} line{'s' if p > 1 else ''} repeated {k} more times]")
+                i = j
+                break
+        else:
+            out.append(lines[i])
+            i += 1
+    return "\n".join(out)
+
+
+def dedupe_tracebacks(text: str) -> str:
+    """Keep the first copy of each identical traceback; later copies become a one-line reference."""
+    if text.count(_TB_HEAD) < 2:
+        return text
+    parts = text.split(_TB_HEAD)
+    out = [parts[0]]
+    seen = set()
+    for part in parts[1:]:
+        lines = part.split("\n")
+        # the traceback ends at the exception line: the first unindented line after the frames
+        end = next((k for k in range(1, len(lines)) if lines[k] and not lines[k][0].isspace()), len(lines) - 1)
+        tb = "\n".join(lines[:end + 1])
+        if tb in seen:
+            ref = f"[same traceback as above: {lines[end].strip()}]"
+            # keep the line break after the exception line, even when nothing else follows
+            out.append(ref + ("\n" + "\n".join(lines[end + 1:]) if end + 1 < len(lines) else ""))
+        else:
+            seen.add(tb)
+            out.append(_TB_HEAD + part)
+    return "".join(out)
+
+
+def head_tail(text: str, max_chars: int, head_share: float, where: Optional[str] = None) -> Tuple[str, int]:
+    """Cut 'text' to about max_chars, keeping head and tail at line boundaries; returns (text, chars omitted)."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text, 0
+    head_len = int(max_chars * head_share)
+    head = text[:head_len]
+    nl = head.rfind("\n")
+    if nl >= head_len // 2:
+        head = head[:nl + 1]
+    tail = text[len(text) - (max_chars - head_len):] if max_chars > head_len else ""
+    nl = tail.find("\n")
+    if 0 <= nl < len(tail) // 2:
+        tail = tail[nl + 1:]
+    omitted = text[len(head):len(text) - len(tail)]
+    note = f"; full output: {where}" if where else ""
+    marker = f"...[{omitted.count(chr(10))} lines, {len(omitted)} chars omitted{note}]...\n"
+    return head + ("" if head.endswith("\n") or not head else "\n") + marker + tail, len(omitted)
+
+
+def _profile(prof: Dict[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {k: prof[k] for k in ("error", "total_time_s", "prof_url", "prof_file") if k in prof}
+    if prof.get("functions"):
+        out["functions"] = [{k: row.get(k) for k in ("function", "ncalls", "tottime_s", "cumtime_s")}
+                            for row in prof["functions"][:_PROFILE_ROWS]]
+    memory = prof.get("memory")
+    if isinstance(memory, dict):
+        out["memory"] = {**{k: memory[k] for k in ("peak_kb", "error") if k in memory},
+                         "top": (memory.get("top") or [])[:_MEMORY_ROWS]}
+    return out
+
+
+def compact(result: Dict[str, Any], link: Optional[Linker] = None) -> Dict[str, Any]:
+    """The model-facing view of a sandbox result (see module docstring)."""
+    out: Dict[str, Any] = {k: result[k] for k in ("returncode", "error", "run_id", "cached")
+                           if result.get(k) is not None}
+    output = result.get("output") if isinstance(result.get("output"), dict) else {}
+    full: Dict[str, str] = {}
+    for stream, tokens, head_share in (("stdout", TOOL_RESULT_STDOUT_TOKENS, 0.6),
+                                       ("stderr", TOOL_RESULT_STDERR_TOKENS, 0.3)):
+        info = output.get(stream) if isinstance(output.get(stream), dict) else {}
+        where = info.get("log_url") or (link(info["log"]) if link and info.get("log") else info.get("log"))
+        text = str(result.get(stream) or "")
+        if stream == "stderr":
+            text = dedupe_tracebacks(text)   # before collapsing, which adds unindented marker lines
+        text = collapse_repeats(text)
+        text, omitted = head_tail(text, int(tokens * TOOL_RESULT_CHARS_PER_TOKEN), head_share, where)
+        out[stream] = text
+        if where and (omitted or info.get("truncated")):
+            full[stream] = where
+    if full:
+        out["full_output"] = full
+
+    images = result.get("images") if isinstance(result.get("images"), list) else []
+    artifacts = []
+    for rec in images[:TOOL_RESULT_MAX_ARTIFACTS]:
+        name = str(rec.get("filename") or "")
+        url = rec.get("url") or (link(name) if link and name else None)
+        artifacts.append({"file": name, "url": url} if url else {"file": name})
+    out["artifacts"] = artifacts
+    if len(images) > TOOL_RESULT_MAX_ARTIFACTS:
+        out["artifacts_omitted"] = len(images) - TOOL_RESULT_MAX_ARTIFACTS
+    if result.get("images_skipped"):
+        out["artifacts_skipped"] = len(result["images_skipped"])
+
+    timings = result.get("timings")
+    if isinstance(timings, dict):
+        out["timings"] = {k: v for k, v in timings.items() if v is not None}
+    if isinstance(result.get("profile"), dict):
+        out["profile"] = _profile(result["profile"])
+    return out
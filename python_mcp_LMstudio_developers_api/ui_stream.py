@@ -0,0 +1,183 @@
+# ui_stream.py
+"""
+Streaming helpers for the UI: SSE parsing and frame coalescing.
+
+Every Gradio update re-sends the whole Chatbot history, so pushing one update
+per token costs O(history) serialization and network traffic per token.
+FrameGate coalesces deltas into frames: at most one every UI_STREAM_FRAME_MS,
+or one per UI_STREAM_FRAME_TOKENS deltas when tokens arrive in bursts.
+StreamText keeps the reply: the deltas since the last frame are joined and
+appended when a frame goes out, so a frame costs its new text, not a re-join
+of the whole reply. Callers always emit the complete text once the stream ends.
+
+with_ticks() reads the stream on a helper thread so that text held back by
+the gate is still shown when the model stalls: once the gate's deadline
+passes with no new line, it yields TICK and the caller flushes.
+
+iter_sse_data() reads data lines as bytes (no per-chunk unicode decoding) and
+json_loads is orjson when installed (it ships with gradio), else json.loads.
+See bench_sse.py for the numbers.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # plain json also accepts bytes
+    orjson = None  # type: ignore[assignment]
+    json_loads = json.loads
+
+# 0 disables the time gate (every delta is a frame); 0 tokens disables the count gate
+UI_STREAM_FRAME_MS = float(os.getenv("UI_STREAM_FRAME_MS", "50"))
+UI_STREAM_FRAME_TOKENS = int(os.getenv("UI_STREAM_FRAME_TOKENS", "32"))
+
+
+def iter_sse_data(resp, chunk_size: int = 512) -> Iterator[bytes]:
+    """
+    Payloads of a text/event-stream response as bytes, stopping at "[DONE]".
+    "data:" prefixes are removed, comments (":...") skipped; other non-empty
+    lines are passed through as-is (servers that send bare JSON lines).
+    """
+    for line in resp.iter_lines(chunk_size=chunk_size):
+        if not line or line[:1] == b":":
+            continue
+        if line.startswith(b"data:"):
+            line = line[5:].strip()
+        if line == b"[DONE]":
+            return
+        yield line
+
+
+def delta_content(obj: Any, key: str = "content") -> str:
+    """choices[0].delta[key] (or choices[0][key] for /v1/completions) of a parsed chunk, or ""."""
+    try:
+        choice = obj["choices"][0]
+        delta = choice.get("delta")
+        value = (delta or {}).get(key) if delta is not None else choice.get(key)
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+    return value or ""
+
+
+class FrameGate:
+    """
+    Decides which streamed deltas become UI frames. ready() counts one delta
+    and is True when a frame should go out now: the first delta, then once
+    frame_ms has passed or 'tokens' deltas are pending. Deltas pending when
+    the stream ends are the caller's to flush.
+    """
+
+    def __init__(self, frame_ms: Optional[float] = None, tokens: Optional[int] = None):
+        self.frame_s = (UI_STREAM_FRAME_MS if frame_ms is None else frame_ms) / 1000.0
+        self.tokens = UI_STREAM_FRAME_TOKENS if tokens is None else tokens
+        self.pending = 0
+        self.frames = 0
+        self._last = float("-inf")
+
+    def ready(self) -> bool:
+        self.pending += 1
+        now = time.monotonic()
+        if now - self._last >= self.frame_s or (self.tokens and self.pending >= self.tokens):
+            self._last = now
+            self.pending = 0
+            self.frames += 1
+            return True
+        return False
+
+    def due(self) -> float:
+        """Seconds until the time gate opens again (0 if it is open)."""
+        return max(0.0, self._last + self.frame_s - time.monotonic())
+
+    def wait(self) -> Optional[float]:
+        """Seconds until held-back deltas should go out anyway; None if nothing is pending."""
+        return self.due() if self.pending else None
+
+    def flush_due(self) -> bool:
+        """True (and a frame is counted) when deltas are pending and the time gate is open."""
+        if not self.pending or self.due() > 0:
+            return False
+        self._last = time.monotonic()
+        self.pending = 0
+        self.frames += 1
+        return True
+
+
+class StreamText:
+    """
+    Text of a streamed reply. add() returns True when a frame should go out
+    (then .text is current); tick() does the same for a deadline flush and
+    flush() folds in whatever is left at the end of the stream.
+    """
+
+    def __init__(self, gate: Optional[FrameGate] = None):
+        self.gate = gate or FrameGate()
+        self.text = ""
+        self._new: List[str] = []
+
+    def _fold(self) -> None:
+        if self._new:
+            self.text += "".join(self._new)
+            self._new.clear()
+
+    def add(self, delta: str) -> bool:
+        self._new.append(delta)
+        if self.gate.ready():
+            self._fold()
+            return True
+        return False
+
+    def tick(self) -> bool:
+        if self.gate.flush_due():
+            self._fold()
+            return True
+        return False
+
+    def wait(self) -> Optional[float]:
+        return self.gate.wait()
+
+    def flush(self) -> str:
+        self._fold()
+        return self.text
+
+
+# Yielded by with_ticks() when nothing arrived before the deadline
+TICK = object()
+
+
+def with_ticks(items: Iterable[Any], wait: Callable[[], Optional[float]]) -> Iterator[Any]:
+    """
+    Items of 'items', read on a helper thread. When none arrives within wait()
+    seconds (None: no deadline, block), TICK is yielded instead. Errors raised
+    by 'items' are re-raised here; closing the underlying response ends the reader.
+    """
+    q: "queue.Queue[tuple]" = queue.Queue()
+
+    def pump() -> None:
+        try:
+            for item in items:
+                q.put((True, item))
+        except BaseException as e:
+            q.put((False, e))
+            return
+        q.put((False, None))
+
+    threading.Thread(target=pump, name="stream-reader", daemon=True).start()
+    while True:
+        try:
+            ok, item = q.get(timeout=wait())
+        except queue.Empty:
+            yield TICK
+            continue
+        if ok:
+            yield item
+        elif item is None:
+            return
+        else:
+            raise item